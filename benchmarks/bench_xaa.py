@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+# Benchmarks xaa() on synthetic sources and compares the results with a stored baseline.
+#
+#   python benchmarks/bench_xaa.py                         # one-factor-at-a-time sweep
+#   python benchmarks/bench_xaa.py --full                  # every combination
+#   python benchmarks/bench_xaa.py --baseline benchmarks/baseline.json
+#   python benchmarks/bench_xaa.py --output benchmarks/baseline.json   # store a new baseline
+#
+# Every configuration runs in a fresh process so that its peak memory use can be measured.
+# The exit status is 1 if any configuration is slower or uses more memory than the baseline
+# by more than the tolerance, or if a configuration that worked in the baseline now fails.
+# The number of ShufflePlanes in each configuration's graph is reported too, from xaa_dryrun.
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+
+RESOLUTIONS = {
+    "sd": (720, 480),
+    "1080p": (1920, 1080),
+    "2160p": (3840, 2160),
+}
+
+FORMATS = ["GRAY8", "YUV420P8", "YUV420P16", "YUV422P10", "YUV444P8"]
+
+AA_MODES = ["sr", "dr", "di"]
+AA_DIRECTIONS = ["h", "v", "b"]
+AA_PASSES = [1, 2]
+AA_TYPES = ["SangNom", "znedi3", "nnedi3cl", "eedi3", "eedi2"]
+SS = [1.0, 1.5, 2.0]
+MASKS = [0, 1]
+CHROMA = [0, 1]
+
+BASE = dict(resolution="1080p", format="YUV420P8", aa_mode="sr", direction="b", passes=1, type="SangNom", ss=2.0, mask=1, chroma=0)
+
+
+def config_id(config):
+    return "{resolution}-{format}-{aa_mode}{direction}{passes}-{type}-ss{ss}-m{mask}-c{chroma}".format(**config)
+
+
+def make_configs(full, resolutions, formats):
+    dimensions = dict(aa_mode=AA_MODES, direction=AA_DIRECTIONS, passes=AA_PASSES, type=AA_TYPES, ss=SS, mask=MASKS, chroma=CHROMA)
+
+    configs = []
+
+    if full:
+        keys = list(dimensions)
+        for resolution, format in itertools.product(resolutions, formats):
+            for values in itertools.product(*[dimensions[k] for k in keys]):
+                config = dict(zip(keys, values))
+                config.update(resolution=resolution, format=format)
+                configs.append(config)
+    else:
+        # Vary one setting at a time around the base configuration, for every resolution and format.
+        for resolution, format in itertools.product(resolutions, formats):
+            base = dict(BASE, resolution=resolution, format=format)
+            configs.append(base)
+            for key, values in dimensions.items():
+                for value in values:
+                    if value != base[key]:
+                        configs.append(dict(base, **{key: value}))
+
+    unique = {}
+    for config in configs:
+        unique.setdefault(config_id(config), config)
+    return list(unique.values())
+
+
+def make_source(core, vs, width, height, format, frames):
+    fmt = core.get_video_format(getattr(vs, format))
+    peak = (1 << fmt.bits_per_sample) - 1
+
+    clip = core.std.BlankClip(width=width, height=height, format=fmt.id, length=frames, fpsnum=24000, fpsden=1001)
+
+    # Thin diagonal stripes and circles that move every frame, so there are aliased edges everywhere.
+    lo = 16 * peak // 255
+    hi = 235 * peak // 255
+    stripes = "X Y 3 * + N 2 * + 29 % 4 < {hi} {lo} ?".format(hi=hi, lo=lo)
+    circles = "X width 2 / - dup * Y height 2 / - dup * + sqrt N + 37 % 3 < {hi} x ?".format(hi=hi)
+    clip = core.std.Expr(clips=clip, expr=[stripes])
+    clip = core.std.Expr(clips=clip, expr=[circles])
+    return clip
+
+
+def render(clip, prefetch):
+    # Keep a window of requests in flight so the core always has work queued.
+    futures = {}
+    next_request = 0
+    for n in range(clip.num_frames):
+        while next_request < clip.num_frames and next_request < n + prefetch:
+            futures[next_request] = clip.get_frame_async(next_request)
+            next_request += 1
+        futures.pop(n).result()
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss / (1024.0 * 1024.0)
+    return rss / 1024.0
+
+
+def run_config(config, frames, threads, backend, queue):
+    result = dict(id=config_id(config), config=config, fps=None, peak_rss_mb=None, shuffle_planes=None, error=None)
+
+    try:
+        import vapoursynth as vs
+        import xaa
+
+        core = vs.core
+        if threads:
+            core.num_threads = threads
+
+        width, height = RESOLUTIONS[config["resolution"]]
+        source = make_source(core, vs, width, height, config["format"], frames)
+
+        mode = "{}{}{} {}".format(config["aa_mode"], config["direction"], config["passes"], config["type"])
+        params = dict(mode=mode, ss=config["ss"], mask=config["mask"], chroma=config["chroma"])
+        if backend is not None:
+            params["backend"] = backend
+
+        stages = xaa.xaa_dryrun(source.format, width, height, **params)
+        result["shuffle_planes"] = sum(1 for stage in stages if stage.filter == "std.ShufflePlanes")
+
+        clip = xaa.xaa(source, **params)
+
+        # The first frame pays for initialising the plugins, so it isn't counted.
+        clip.get_frame(0)
+        clip = clip[1:]
+
+        start = time.perf_counter()
+        render(clip, prefetch=max(2, core.num_threads))
+        elapsed = time.perf_counter() - start
+
+        result["fps"] = clip.num_frames / elapsed
+        result["peak_rss_mb"] = peak_rss_mb()
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+
+    queue.put(result)
+
+
+def run_isolated(config, args):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=run_config, args=(config, args.frames, args.threads, args.backend, queue))
+    process.start()
+    try:
+        result = queue.get(timeout=args.timeout)
+    except Exception:
+        process.terminate()
+        result = dict(id=config_id(config), config=config, fps=None, peak_rss_mb=None, shuffle_planes=None, error="timed out after {} s".format(args.timeout))
+    process.join()
+    return result
+
+
+def compare(results, baseline, tolerance):
+    old = {r["id"]: r for r in baseline["results"]}
+    regressions = []
+
+    for result in results:
+        before = old.get(result["id"])
+        if before is None:
+            continue
+
+        if result["error"] and not before["error"]:
+            regressions.append((result["id"], "now fails: {}".format(result["error"])))
+            continue
+
+        if result["fps"] and before["fps"] and result["fps"] < before["fps"] * (1.0 - tolerance):
+            regressions.append((result["id"], "fps {:.2f} -> {:.2f}".format(before["fps"], result["fps"])))
+
+        if result["peak_rss_mb"] and before["peak_rss_mb"] and result["peak_rss_mb"] > before["peak_rss_mb"] * (1.0 + tolerance):
+            regressions.append((result["id"], "peak memory {:.0f} MB -> {:.0f} MB".format(before["peak_rss_mb"], result["peak_rss_mb"])))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark xaa() over its modes, types and settings.")
+    parser.add_argument("--full", action="store_true", help="run every combination instead of varying one setting at a time")
+    parser.add_argument("--resolutions", default=",".join(RESOLUTIONS), help="comma separated subset of {}".format(", ".join(RESOLUTIONS)))
+    parser.add_argument("--formats", default=",".join(FORMATS), help="comma separated subset of {}".format(", ".join(FORMATS)))
+    parser.add_argument("--filter", default="", help="only run configurations whose id contains this string")
+    parser.add_argument("--frames", type=int, default=50, help="frames to render per configuration")
+    parser.add_argument("--threads", type=int, default=0, help="core.num_threads, 0 for VapourSynth's default")
+    parser.add_argument("--backend", default=None, help="passed to xaa's backend parameter")
+    parser.add_argument("--timeout", type=float, default=600.0, help="seconds before a configuration is abandoned")
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.json"))
+    parser.add_argument("--baseline", default=None, help="results file to compare against, created by the first run if it doesn't exist")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative slowdown or memory growth")
+    args = parser.parse_args()
+
+    resolutions = [r for r in args.resolutions.split(",") if r]
+    formats = [f for f in args.formats.split(",") if f]
+    for r in resolutions:
+        if r not in RESOLUTIONS:
+            parser.error("unknown resolution '{}'".format(r))
+
+    configs = [c for c in make_configs(args.full, resolutions, formats) if args.filter in config_id(c)]
+
+    results = []
+    for i, config in enumerate(configs):
+        result = run_isolated(config, args)
+        results.append(result)
+
+        if result["error"]:
+            status = "error: " + result["error"]
+        else:
+            status = "{:8.2f} fps".format(result["fps"])
+            if result["peak_rss_mb"] is not None:
+                status += " {:8.0f} MB".format(result["peak_rss_mb"])
+            status += " {:4d} ShufflePlanes".format(result["shuffle_planes"])
+        print("[{}/{}] {:60} {}".format(i + 1, len(configs), result["id"], status), flush=True)
+
+    meta = dict(time=time.strftime("%Y-%m-%dT%H:%M:%S"), python=platform.python_version(), machine=platform.machine(),
+                cpus=os.cpu_count(), frames=args.frames, threads=args.threads, backend=args.backend)
+    try:
+        import vapoursynth as vs
+        meta["vapoursynth"] = vs.__version__
+    except Exception:
+        pass
+
+    with open(args.output, "w") as f:
+        json.dump(dict(meta=meta, results=results), f, indent=2)
+
+    if args.baseline:
+        # No baseline is shipped, because the numbers only mean something on the machine that
+        # made them. The first run with a new baseline file creates it.
+        if not os.path.exists(args.baseline):
+            shutil.copyfile(args.output, args.baseline)
+            print("Saved the results as the new baseline {}.".format(args.baseline))
+            return 0
+
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.tolerance)
+        for id, message in regressions:
+            print("REGRESSION {}: {}".format(id, message))
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
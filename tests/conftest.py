@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import vapoursynth as vs
+except ImportError:
+    # The test modules skip themselves.
+    vs = None
+
+
+# The tests that render frames use the stand-in backend, so they only need the std and
+# resize filters that come with VapourSynth. The other tests only build graphs with xaa_dryrun.
+def pytest_collection_modifyitems(config, items):
+    if vs is None:
+        return
+
+    if hasattr(vs.core, "std") and hasattr(vs.core, "resize"):
+        return
+
+    skip = pytest.mark.skip(reason="needs VapourSynth's std and resize filters")
+    for item in items:
+        if "render" in item.keywords:
+            item.add_marker(skip)
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "render: renders frames with the stand-in backend")
@@ -0,0 +1,45 @@
+import pytest
+
+vs = pytest.importorskip("vapoursynth")
+
+import xaa
+
+
+# Holds of 1, 5, 1 and 4 frames, all but the single frames longer than the dedupe window.
+HOLDS = [(1, 16), (5, 80), (1, 144), (4, 208)]
+
+
+def make_holds(core):
+    clips = []
+    for length, luma in HOLDS:
+        clip = core.std.BlankClip(format=vs.YUV420P8, width=96, height=64, length=length, color=[luma, 128, 128])
+        # Something for the edge mask and the antialiasing to work on.
+        clips.append(core.std.AddBorders(clip=core.std.Crop(clip=clip, left=40), left=40, color=[255 - luma, 128, 128]))
+    return core.std.Splice(clips=clips)
+
+
+@pytest.mark.render
+@pytest.mark.parametrize("dedupe", [1, 2])
+def test_hold_is_antialiased_once(dedupe):
+    core = vs.core
+    clip = make_holds(core)
+
+    profiler = xaa.XaaProfiler()
+    counters = xaa.XaaCounters()
+    output = xaa.xaa(clip, mode="sr2 eedi3 znedi3", dedupe=dedupe, profile=profiler, counters=counters, backend="standin")
+
+    frames = [output.get_frame(n) for n in range(output.num_frames)]
+
+    served = {stage["stage"]: stage["frames"] for stage in profiler.report()}
+    assert served["aa"] == len(HOLDS)
+    assert counters.reused == clip.num_frames - len(HOLDS)
+
+    # Every frame of a hold is the output of the hold's first frame.
+    start = 0
+    for length, luma in HOLDS:
+        first = frames[start]
+        for n in range(start, start + length):
+            assert frames[n].props["XaaReused"] == min(dedupe, n - start)
+            for plane in range(first.format.num_planes):
+                assert bytes(frames[n][plane]) == bytes(first[plane])
+        start += length
@@ -0,0 +1,116 @@
+import glob
+import os
+
+import pytest
+
+vs = pytest.importorskip("vapoursynth")
+
+import xaa
+import xaa_tools
+
+
+# Flat frames that skip_below bypasses, and frames with an edge that are antialiased.
+def make_clip(core):
+    flat = core.std.BlankClip(format=vs.YUV420P8, width=96, height=64, length=3, color=[64, 128, 128])
+    edge = core.std.AddBorders(clip=core.std.Crop(clip=flat, left=40), left=40, color=[192, 128, 128])
+    return core.std.Interleave(clips=[flat, edge])
+
+
+def render(clip):
+    return [clip.get_frame(n) for n in range(clip.num_frames)]
+
+
+def props(frame):
+    return {name: value for name, value in frame.props.items() if name != "XaaCached"}
+
+
+def assert_same(frames, expected):
+    assert len(frames) == len(expected)
+    for frame, other in zip(frames, expected):
+        assert props(frame) == props(other)
+        for plane in range(frame.format.num_planes):
+            assert bytes(frame[plane]) == bytes(other[plane])
+
+
+PARAMS = dict(mode="sr2 eedi3 znedi3", ow=48, oh=32, skip_below=0.01, adaptive_passes=0.5, backend="standin")
+
+
+@pytest.mark.render
+def test_cached_frames_keep_their_props(tmp_path):
+    core = vs.core
+    clip = make_clip(core)
+    expected = render(xaa.xaa(clip, **PARAMS))
+    assert {frame.props["XaaBypassed"] for frame in expected} == {0, 1}
+
+    cache = xaa_tools.XaaDiskCache(str(tmp_path))
+    try:
+        stored = render(xaa.xaa(clip, disk_cache=cache, **PARAMS))
+        cached = render(xaa.xaa(clip, disk_cache=cache, **PARAMS))
+    finally:
+        cache.close()
+
+    assert [frame.props["XaaCached"] for frame in stored] == [0] * clip.num_frames
+    assert [frame.props["XaaCached"] for frame in cached] == [1] * clip.num_frames
+    assert_same(stored, expected)
+    assert_same(cached, expected)
+
+
+# The chunks are deleted behind the cache's back, as another process sharing it would.
+@pytest.mark.render
+def test_deleted_chunks_are_made_again(tmp_path):
+    core = vs.core
+    clip = make_clip(core)
+    expected = render(xaa.xaa(clip, **PARAMS))
+
+    writer = xaa_tools.XaaDiskCache(str(tmp_path), chunk_frames=1)
+    try:
+        render(xaa.xaa(clip, disk_cache=writer, **PARAMS))
+    finally:
+        writer.close()
+
+    for path in glob.glob(os.path.join(str(tmp_path), "*.chunk")):
+        os.remove(path)
+
+    cache = xaa_tools.XaaDiskCache(str(tmp_path), chunk_frames=1)
+    try:
+        frames = render(xaa.xaa(clip, disk_cache=cache, **PARAMS))
+        assert cache.report()["hits"] == 0
+    finally:
+        cache.close()
+
+    assert_same(frames, expected)
+
+
+@pytest.mark.render
+def test_eviction_while_rendering(tmp_path):
+    core = vs.core
+    clip = make_clip(core)
+    expected = render(xaa.xaa(clip, **PARAMS))
+
+    # Less than one chunk, so every chunk is evicted as soon as it's written.
+    cache = xaa_tools.XaaDiskCache(str(tmp_path), max_size=0.001, chunk_frames=1)
+    try:
+        assert_same(render(xaa.xaa(clip, disk_cache=cache, **PARAMS)), expected)
+        assert_same(render(xaa.xaa(clip, disk_cache=cache, **PARAMS)), expected)
+        assert cache.report()["evicted"] >= clip.num_frames
+    finally:
+        cache.close()
+
+
+def test_lookup_after_chunk_is_deleted(tmp_path):
+    cache = xaa_tools.XaaDiskCache(str(tmp_path), chunk_frames=2)
+    try:
+        cache._store("variant", "key", 4, [memoryview(b"abcd")], "[[], []]")
+        assert cache._lookup("variant", "key", 4) == (b"abcd", "[[], []]")
+
+        cache._maps.pop(1).close()
+        os.remove(os.path.join(str(tmp_path), "00000001.chunk"))
+
+        assert cache._lookup("variant", "key", 4) is None
+        assert cache.report()["frames"] == 0
+
+        # The frame can be stored again.
+        cache._store("variant", "key", 4, [memoryview(b"efgh")], "[[], []]")
+        assert cache._lookup("variant", "key", 4) == (b"efgh", "[[], []]")
+    finally:
+        cache.close()
@@ -0,0 +1,80 @@
+import pytest
+
+vs = pytest.importorskip("vapoursynth")
+
+import xaa
+
+
+FORMATS = [vs.GRAY8, vs.YUV444P8, vs.RGB24]
+INTERPOLATORS = ["znedi3", "eedi3", "eedi2"]
+
+
+def make_source(core, format):
+    clip = core.std.BlankClip(format=vs.GRAY8, width=48, height=40, length=2, color=32)
+    clip = core.std.AddBorders(clip=core.std.Crop(clip=clip, left=20, top=14), left=20, top=14, color=224)
+    clip = core.resize.Bicubic(clip=clip, width=48, height=40, src_left=0.3)
+    if format == vs.GRAY8:
+        return clip
+
+    planes = [clip, core.std.Invert(clip), core.std.Transpose(core.resize.Point(clip=clip, width=40, height=48))]
+    family = core.get_video_format(format).color_family
+    return core.std.ShufflePlanes(clips=planes, planes=[0, 0, 0], colorfamily=family)
+
+
+def assert_same_frames(a, b):
+    assert a.format.id == b.format.id
+    assert (a.width, a.height, a.num_frames) == (b.width, b.height, b.num_frames)
+    for n in range(a.num_frames):
+        fa = a.get_frame(n)
+        fb = b.get_frame(n)
+        for plane in range(fa.format.num_planes):
+            assert bytes(fa[plane]) == bytes(fb[plane])
+
+
+# Doubles one plane at a time. Asking for a single plane of a clip with more than
+# one plane takes edi_rpow2's per-plane path, and a GRAY clip gets two copies of
+# itself as the other planes for that.
+def per_plane(core, clip, **params):
+    if clip.format.num_planes == 1:
+        clip444 = core.std.ShufflePlanes(clips=[clip, clip, clip], planes=[0, 0, 0], colorfamily=vs.YUV)
+        return core.std.ShufflePlanes(clips=xaa.edi_rpow2(clip444, planes=[0], **params), planes=0, colorfamily=vs.GRAY)
+
+    doubled = [xaa.edi_rpow2(clip, planes=[plane], **params) for plane in range(clip.format.num_planes)]
+    return core.std.ShufflePlanes(clips=doubled, planes=[0, 1, 2], colorfamily=clip.format.color_family)
+
+
+@pytest.mark.render
+@pytest.mark.parametrize("format", FORMATS)
+@pytest.mark.parametrize("edi", INTERPOLATORS)
+@pytest.mark.parametrize("bordfix", [False, True])
+@pytest.mark.parametrize("cshift", ["", "Spline36"])
+@pytest.mark.parametrize("rfactors", [(2, 2), (4, 2)])
+def test_whole_clip_matches_per_plane(format, edi, bordfix, cshift, rfactors):
+    core = vs.core
+    clip = make_source(core, format)
+    params = dict(rfactorX=rfactors[0], rfactorY=rfactors[1], edi=edi, cshift=cshift, bordfix=bordfix, backend="standin")
+
+    assert_same_frames(xaa.edi_rpow2(clip, **params), per_plane(core, clip, **params))
+
+
+# The planes go through the interpolators together, so there are as many
+# interpolator calls as for a single plane.
+@pytest.mark.parametrize("format", FORMATS)
+@pytest.mark.parametrize("edi", INTERPOLATORS)
+def test_whole_clip_interpolates_once(format, edi):
+    gray = xaa.xaa_dryrun(vs.GRAY8, 48, 40, function=xaa.edi_rpow2, rfactorX=4, rfactorY=2, edi=edi, cshift="Spline36")
+    whole = xaa.xaa_dryrun(format, 48, 40, function=xaa.edi_rpow2, rfactorX=4, rfactorY=2, edi=edi, cshift="Spline36")
+
+    plugin = [stage.filter for stage in gray if stage.filter.split(".")[0] in ["znedi3", "eedi3m", "eedi2"]]
+    assert len(plugin) == 3
+    assert [stage.filter for stage in whole] == [stage.filter for stage in gray]
+
+
+# nnedi3cl's dw doesn't behave like the Avisynth version, so it doubles the width
+# through transposes like the others.
+@pytest.mark.parametrize("format", FORMATS)
+def test_nnedi3cl_doubles_like_znedi3(format):
+    znedi3 = xaa.xaa_dryrun(format, 48, 40, function=xaa.edi_rpow2, rfactorX=2, rfactorY=2, edi="znedi3", cshift="Spline36")
+    nnedi3cl = xaa.xaa_dryrun(format, 48, 40, function=xaa.edi_rpow2, rfactorX=2, rfactorY=2, edi="nnedi3cl", cshift="Spline36")
+
+    assert [stage.filter.replace("znedi3.nnedi3", "nnedi3cl.NNEDI3CL") for stage in znedi3] == [stage.filter for stage in nnedi3cl]
@@ -0,0 +1,124 @@
+import contextlib
+import functools
+
+import pytest
+
+vs = pytest.importorskip("vapoursynth")
+
+import xaa
+
+
+# Variants that differ in the settings of every stage, each next to ones it could wrongly share
+# stages with.
+VARIANTS = [dict(mode="di znedi3", ss=2.0, dscl=dscl) for dscl in ["Spline36", "Bicubic", "Lanczos"]] + \
+           [dict(mode="sr2 znedi3", ss=2.0, nns=nns) for nns in [1, 3]] + \
+           [dict(mode="sr eedi3", ss=2.0, uscl="eedi3", eedimthr=eedimthr) for eedimthr in [0.0, 10.0, 20.0]] + \
+           [dict(mode="sr SangNom", ss=2.0, roi=32, mthr=mthr, csharp=csharp) for mthr in [4.0, 8.0] for csharp in [0, 1, 2]] + \
+           [dict(mode="sr SangNom", ss=2.0, csharp=csharp, cstr=cstr) for csharp in [1, 2] for cstr in [-1.0, 0.5]] + \
+           [dict(mode="sr SangNom", ss=ss, ow=320, oh=180, chroma=chroma) for ss in [1.5, 2.0] for chroma in [0, 1]] + \
+           [dict(mode="drb2 eedi2", ss=2.0, adaptive_passes=adaptive_passes) for adaptive_passes in [0.0, 0.5]] + \
+           [dict(mode="sr eedi3", ss=ss, eedimthr=8.0, mthr=8.0, mshare=True) for ss in [1.5, 2.0]]
+
+
+# Builds graphs with the dry run core, on a source that all of them share.
+@contextlib.contextmanager
+def traced(format=vs.YUV420P8, width=640, height=360):
+    tracer = xaa._Tracer()
+    previous = getattr(xaa._local, "core", None)
+    xaa._local.core = xaa._TraceCore(tracer)
+    try:
+        yield tracer, xaa._TraceNode(tracer, vs.core.get_video_format(format), width, height, 1)
+    finally:
+        xaa._local.core = previous
+
+
+# Reduces graphs to numbers that are equal when the graphs are built the same way, whichever
+# clips they are built from. Stage cache lookups are replaced by the stage they would compute.
+class Canonical:
+    def __init__(self, tracer):
+        self.filters = {id(node): (filter, kwargs) for filter, node, src, kwargs in tracer.calls}
+        self.structures = {}
+        self.nodes = {}
+        # Every stage cache key, with the stages it was used for.
+        self.keys = {}
+
+    def __call__(self, value):
+        if isinstance(value, xaa._TraceNode):
+            return self.node(value)
+        if isinstance(value, (list, tuple)):
+            return ("list",) + tuple(self(v) for v in value)
+        if isinstance(value, dict):
+            return ("dict",) + tuple((k, self(v)) for k, v in sorted(value.items()))
+        if isinstance(value, functools.partial):
+            return ("partial", value.func.__name__, self(list(value.args)), self(value.keywords))
+        if callable(value):
+            return ("function", value.__name__)
+        if isinstance(value, (bool, int, float, str, bytes, type(None))):
+            return (type(value).__name__, repr(value))
+        if isinstance(value, vs.VideoFormat):
+            return ("format", value.id)
+        return ("object", type(value).__name__)
+
+    def node(self, node):
+        number = self.nodes.get(id(node))
+        if number is not None:
+            return number
+
+        if id(node) not in self.filters:
+            structure = ("source", node.format.id, node.width, node.height)
+        else:
+            filter, kwargs = self.filters[id(node)]
+            select = kwargs.get("eval")
+            if filter == "std.FrameEval" and isinstance(select, functools.partial) and select.func is xaa._stage_cache_select:
+                # store is a ModifyFrame on the stage itself.
+                number = self.node(self.filters[id(select.keywords["store"])][1]["clip"])
+                self.keys.setdefault(select.keywords["key"], set()).add(number)
+                self.nodes[id(node)] = number
+                return number
+            structure = (filter, self(kwargs))
+
+        number = self.structures.setdefault(structure, len(self.structures))
+        self.nodes[id(node)] = number
+        return number
+
+
+def test_cached_stages_match_independent_graphs():
+    with traced() as (tracer, source):
+        cache = xaa.XaaStageCache()
+        cached = [xaa.xaa(source, stage_cache=cache, **params) for params in VARIANTS]
+        alone = [xaa.xaa(source, **params) for params in VARIANTS]
+
+    canonical = Canonical(tracer)
+    for params, a, b in zip(VARIANTS, cached, alone):
+        assert canonical(a) == canonical(b), params
+
+    # The stages the cache would hand out for a key are all the same.
+    assert len(canonical.keys) > len(VARIANTS)
+    for key, stages in canonical.keys.items():
+        assert len(stages) == 1, key
+
+
+def test_roi_variants_use_roi():
+    for params in VARIANTS:
+        if params.get("roi"):
+            assert xaa.xaa_plan(vs.YUV420P8, 640, 360, **params).roi > 0
+
+
+SWEEPS = [(dict(mode="di znedi3", ss=2.0), dict(dscl=["Spline36", "Bicubic", "Lanczos", "Bilinear"])),
+          (dict(mode="sr SangNom", ss=2.0, roi=32), dict(mthr=[4.0, 8.0], csharp=[0, 1, 2])),
+          (dict(mode="sr2 znedi3", ss=2.0, uscl="eedi3"), dict(eedimthr=[0.0, 10.0], nns=[1, 3])),
+          (dict(mode="sr SangNom", ss=1.5), dict(ow=[320, 640], oh=[180, 360], chroma=[0, 1])),
+          (dict(mode="sr eedi3", ow=320, oh=180, eedimthr=8.0, mthr=8.0, mshare=True), dict(ss=[1.5, 2.0]))]
+
+
+def test_swept_variants_match_xaa():
+    for params, grid in SWEEPS:
+        with traced() as (tracer, source):
+            clips, report = xaa.xaa_sweep(source, grid, **params)
+            alone = [xaa.xaa(source, **dict(params, **settings)) for settings, clip in clips]
+
+        assert report["shared"] > 0
+
+        canonical = Canonical(tracer)
+        for (settings, clip), other in zip(clips, alone):
+            assert canonical(clip) == canonical(other), settings
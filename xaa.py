@@ -1,6 +1,249 @@
+import collections
+import functools
+import itertools
+import json
+import math
+import os
+import threading
+import time
+
 import vapoursynth as vs
 
 
+# Filters are created through _get_core() rather than vs.core directly,
+# so that xaa_dryrun() can substitute a tracing core for the current thread,
+# and so that the plugins can be replaced by stand-ins (see _StandinCore).
+_local = threading.local()
+
+
+def _get_core():
+    core = getattr(_local, "core", None)
+    if core is None:
+        core = vs.core
+    if _get_backend() == "standin":
+        return _StandinCore(core)
+    return core
+
+
+# "plugins" uses the real plugins. "standin" replaces them with std and resize
+# filters that produce clips of the same format and dimensions.
+_backends = ["plugins", "standin"]
+
+
+def _get_backend():
+    backend = getattr(_local, "backend", None)
+    if backend is None:
+        backend = os.environ.get("XAA_BACKEND") or "plugins"
+        if backend not in _backends:
+            raise ValueError("xaa: the XAA_BACKEND environment variable must be one of {}.".format(_backends))
+    return backend
+
+
+# Lets the decorated function take a 'backend' parameter, which applies
+# to every filter created until the function returns.
+def _with_backend(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        backend = kwargs.get("backend")
+        if backend is None:
+            return function(*args, **kwargs)
+
+        if backend not in _backends:
+            raise ValueError("{}: 'backend' must be one of {}.".format(function.__name__, _backends))
+
+        previous = getattr(_local, "backend", None)
+        _local.backend = backend
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.backend = previous
+
+    return wrapper
+
+
+# While a graph is built, remembers which clips are transposes of which, so that turning a clip
+# back returns the clip it came from instead of adding another Transpose. Crops, Point pads and
+# plane extraction only move pixels around, so when their input is a transpose, their output is
+# also remembered as the transpose of the same filter applied to the unturned clip.
+#
+# removed counts the transposes that weren't created, plus the ones they made unnecessary.
+class _Transposes:
+    def __init__(self):
+        self._sources = {}
+        self._bypassed = set()
+        self._cancelled = 0
+
+    @property
+    def removed(self):
+        return self._cancelled + len(self._bypassed)
+
+    def source(self, clip):
+        entry = self._sources.get(id(clip))
+        if entry is None or entry[0] is not clip:
+            return None
+        return entry[1]
+
+    # turned is the transpose of source. It's derived from the Transpose filter that turned_from
+    # is, or was derived from, and the result doesn't need that one anymore once it's cancelled.
+    def add(self, turned, source, turned_from=None):
+        if turned_from is None:
+            original = id(turned)
+        else:
+            original = self._sources[id(turned_from)][2]
+        self._sources[id(turned)] = (turned, source, original)
+
+    def transpose(self, core, clip):
+        source = self.source(clip)
+        if source is not None:
+            self._cancelled += 1
+            self._bypassed.add(self._sources[id(clip)][2])
+            return source
+
+        turned = core.std.Transpose(clip=clip)
+        self.add(turned, clip)
+        return turned
+
+
+# Lets the decorated function cancel the transposes it creates, unless it's
+# called while another function is already doing that.
+def _with_transposes(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if getattr(_local, "transposes", None) is not None:
+            return function(*args, **kwargs)
+
+        _local.transposes = _Transposes()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.transposes = None
+
+    return wrapper
+
+
+def _transpose(core, clip):
+    transposes = getattr(_local, "transposes", None)
+    if transposes is None:
+        return core.std.Transpose(clip=clip)
+    return transposes.transpose(core, clip)
+
+
+# The clip that clip is a transpose of, if any. Subsampled clips are left alone because
+# the chroma location of a turned clip isn't the turned chroma location.
+def _turned_source(clip):
+    transposes = getattr(_local, "transposes", None)
+    if transposes is None or clip.format.subsampling_w or clip.format.subsampling_h:
+        return None
+    return transposes.source(clip)
+
+
+def _crop(core, clip, left=0, right=0, top=0, bottom=0):
+    cropped = core.std.Crop(clip=clip, left=left, right=right, top=top, bottom=bottom)
+
+    source = _turned_source(clip)
+    if source is not None:
+        _local.transposes.add(cropped, _crop(core, source, left=top, right=bottom, top=left, bottom=right), clip)
+
+    return cropped
+
+
+# Pads with copies of the edge pixels.
+def _point_pad(core, clip, left=0, right=0, top=0, bottom=0):
+    width = clip.width + left + right
+    height = clip.height + top + bottom
+    padded = core.resize.Point(clip=clip, width=width, height=height, src_left=-left, src_top=-top, src_width=width, src_height=height)
+
+    source = _turned_source(clip)
+    if source is not None:
+        _local.transposes.add(padded, _point_pad(core, source, left=top, right=bottom, top=left, bottom=right), clip)
+
+    return padded
+
+
+def _extract_plane(core, clip, plane):
+    extracted = _shuffle_planes(core, clip, plane, vs.GRAY)
+
+    source = _turned_source(clip)
+    if source is not None and _turned_source(extracted) is None:
+        _local.transposes.add(extracted, _extract_plane(core, source, plane), clip)
+
+    return extracted
+
+
+# While a graph is built, remembers which planes every ShufflePlanes took from which clips. Taking a
+# plane out of a merged clip then gives the clip that went into it, and merging planes that all came
+# out of one clip gives that clip back. The stages that work on GRAY planes can hand their results on
+# as merged clips: the next stage gets the planes themselves, and a merge of merges is flattened into
+# one ShufflePlanes that takes every plane from the stage that made it, so the merges in between are
+# left out of the graph. Identical ShufflePlanes are only made once.
+class _Planes:
+    def __init__(self):
+        self._sources = {}
+        self._shuffles = {}
+
+    # The clip and plane that plane of clip came from, through any number of ShufflePlanes.
+    def source(self, clip, plane):
+        while True:
+            entry = self._sources.get(id(clip))
+            if entry is None or entry[0] is not clip:
+                return clip, plane
+            clip, plane = entry[1][plane]
+
+    def shuffle(self, core, clips, planes, colorfamily):
+        if colorfamily != vs.GRAY:
+            clips = clips + [clips[-1]] * (len(planes) - len(clips))
+        sources = [self.source(c, p) for c, p in zip(clips, planes)]
+        if colorfamily == vs.GRAY:
+            sources = sources[:1]
+
+        first = sources[0][0]
+        if all(c is first and p == i for i, (c, p) in enumerate(sources)) and first.format.color_family == colorfamily and first.format.num_planes == len(sources):
+            return first
+
+        key = (tuple((id(c), p) for c, p in sources), colorfamily)
+        if key in self._shuffles:
+            return self._shuffles[key][1]
+
+        shuffled = core.std.ShufflePlanes(clips=[c for c, p in sources], planes=[p for c, p in sources], colorfamily=colorfamily)
+        self._shuffles[key] = (sources, shuffled)
+        self._sources[id(shuffled)] = (shuffled, sources)
+        return shuffled
+
+
+# Lets the decorated function reuse the planes it splits and merges, unless it's
+# called while another function is already doing that.
+def _with_planes(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if getattr(_local, "planes", None) is not None:
+            return function(*args, **kwargs)
+
+        _local.planes = _Planes()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.planes = None
+
+    return wrapper
+
+
+# std.ShufflePlanes, with clips and planes also taken as a single clip and plane.
+def _shuffle_planes(core, clips, planes, colorfamily):
+    if not isinstance(clips, list):
+        clips = [clips]
+    if not isinstance(planes, list):
+        planes = [planes]
+
+    registry = getattr(_local, "planes", None)
+    if registry is None:
+        return core.std.ShufflePlanes(clips=clips, planes=planes, colorfamily=colorfamily)
+    return registry.shuffle(core, clips, planes, colorfamily)
+
+
+def _is_clip(clip):
+    return isinstance(clip, (vs.VideoNode, _TraceNode))
+
+
 def is420(clip):
     return clip.format.color_family == vs.YUV and clip.format.subsampling_w == 1 and clip.format.subsampling_h == 1
 
@@ -34,129 +277,169 @@ def Blur(clip, amount=0, planes=None):
     return clip.std.Convolution(matrix=blur_matrix, planes=planes)
 
 
-# Recursive helper functions for repeated edi image doubling
-# When calling these functions, the f and t parameters should always be left at their default values.
-# They're used only to control behavior during recursion and changing them will cause a malfunction.
+##### Interpolators #####
 
-def edi_rpow2_znedi3(clip, rfactorX, rfactorY, alignc=False, nsize=None, nns=None, qual=None, etype=None, pscrn=None, opt=None, int16_prescreener=None, int16_predictor=None, exp=None, f=True, turned=False):
-    core = vs.core
+# Splits the frames into fields for the interpolators that always double the height.
+# Field 0 and 1 keep only the bottom or top fields, 2 and 3 keep both, for double rate.
+def _separate_fields(core, clip, field):
+    sf = core.std.SeparateFields(clip=clip, tff=True)
+    sf = core.std.RemoveFrameProps(clip=sf, props=["_Field"])
 
-    # If alignc=true, always use field=1 for doubling the width
-    # to maintain alignment of horizontally subsampled chroma.
-    field2 = int(f)
-    
-    if alignc:
-        field1 = 1
-    else:
-        field1 = field2
-    
-    # Only turn right if doubling the width and the input isn't already turned
-    dbl = clip
-    if not turned and rfactorX > 1:
-        dbl = dbl.std.Transpose()
-        turned = True
-        
-    if rfactorX > 1:
-        dbl = dbl.znedi3.nnedi3(field=field1, dh=True, nsize=nsize, nns=nns, qual=qual, etype=etype, pscrn=pscrn, opt=opt, int16_prescreener=int16_prescreener, int16_predictor=int16_predictor, exp=exp)
-        
-    # Only turn left if the height is going to be doubled or after the last iteration of doubling the width.
-    # This avoids unnecessary turning when only the width is doubled repeatedly.
-    if turned and (rfactorY > 1 or rfactorX == 2):
-        dbl = dbl.std.Transpose()
-        turned = False
-        
-    if rfactorY > 1:
-        dbl = dbl.znedi3.nnedi3(field=field2, dh=True, nsize=nsize, nns=nns, qual=qual, etype=etype, pscrn=pscrn, opt=opt, int16_prescreener=int16_prescreener, int16_predictor=int16_predictor, exp=exp)
-    
-    if rfactorX > 1 or rfactorY > 1:
-        return edi_rpow2_znedi3(clip=dbl, rfactorX=max(1, rfactorX // 2), rfactorY=max(1, rfactorY // 2), alignc=alignc, nsize=nsize, nns=nns, qual=qual, etype=etype, pscrn=pscrn, opt=opt, int16_prescreener=int16_prescreener, int16_predictor=int16_predictor, exp=exp, f=False, turned=turned)
-    else:
-        return clip
-    
+    if field == 1:
+        sf = core.std.SelectEvery(clip=sf, cycle=2, offsets=0)
+    elif field == 0:
+        sf = core.std.SelectEvery(clip=sf, cycle=2, offsets=1)
+
+    return sf
+
+
+# The call adapters take the field like znedi3 does: 0 and 1 interpolate the top or the bottom
+# field, 2 and 3 return both at double rate. dh doubles the height, dw the width.
+
+def _call_sangnom(core, clip, field, dh=False, chromaloc="left", **params):
+    # SangNom can't double the height, so the lines are duplicated first.
+    if dh:
+        clip = core.resize.Point(clip=clip, width=clip.width, height=clip.height * 2, chromaloc_in_s=chromaloc, chromaloc_s=chromaloc)
+
+    if field == 3:
+        return core.std.Interleave(clips=[core.sangnom.SangNom(clip=clip, order=1, **params),
+                                          core.sangnom.SangNom(clip=clip, order=2, **params)])
+    elif field == 2:
+        return core.std.Interleave(clips=[core.sangnom.SangNom(clip=clip, order=2, **params),
+                                          core.sangnom.SangNom(clip=clip, order=1, **params)])
+    elif field == 1:
+        return core.sangnom.SangNom(clip=clip, order=1, **params)
+    else:
+        return core.sangnom.SangNom(clip=clip, order=2, **params)
+
+
+def _call_znedi3(core, clip, field, dh=False, **params):
+    return core.znedi3.nnedi3(clip=clip, field=field, dh=dh, **params)
+
+
+def _call_nnedi3cl(core, clip, field, dh=False, dw=False, **params):
+    return core.nnedi3cl.NNEDI3CL(clip=clip, field=field, dh=dh, dw=dw, **params)
+
+
+def _call_eedi3(core, clip, field, dh=False, **params):
+    return core.eedi3m.EEDI3(clip=clip, field=field, dh=dh, **params)
 
-def edi_rpow2_nnedi3cl(clip, rfactorX, rfactorY, alignc=False, nsize=None, nns=None, qual=None, etype=None, pscrn=None, f=True, turned=False):
-    core = vs.core
 
+def _call_eedi2(core, clip, field, dh=False, **params):
+    # EEDI2 always doubles the height, so it gets half height fields when the height is kept.
+    if not dh:
+        clip = _separate_fields(core, clip, field)
+
+    return core.eedi2.EEDI2(clip=clip, field=field, **params)
+
+
+# What each interpolator can do:
+#   dh: doubles the height itself.
+#   dw: doubles the width itself, which saves the two transposes around every width doubling.
+#   fields: keeping the height means working on separated fields, so every plane of the
+#           clip must have a mod2 height, and a 422 clip with chroma needs mod8 padding.
+#   sclip, mclip: accepts a clip to fall back on and a mask of the pixels to process.
+#   support: how far the interpolator reaches from the pixel it interpolates with its
+#            default settings, rounded up. This is the context a tile needs for the result
+#            to match the whole frame.
+#   params: the parameters that are passed through to the plugin.
+#   call: the call adapter.
+_Interpolator = collections.namedtuple("_Interpolator", ["dh", "dw", "fields", "sclip", "mclip", "support", "params", "call"])
+
+_interpolators = collections.OrderedDict([
+    ("SangNom", _Interpolator(dh=False, dw=False, fields=False, sclip=False, mclip=False, support=4,
+                              params=["aa", "chromaloc"],
+                              call=_call_sangnom)),
+    ("znedi3", _Interpolator(dh=True, dw=False, fields=False, sclip=False, mclip=False, support=16,
+                             params=["nsize", "nns", "qual", "etype", "pscrn", "opt", "int16_prescreener", "int16_predictor", "exp", "planes"],
+                             call=_call_znedi3)),
     # FIXME Not using the dw parameter because it behaves differently from the Avisynth version.
-    
-    # If alignc=true, always use field=1 for doubling the width
-    # to maintain alignment of horizontally subsampled chroma.
-    field2 = int(f)
-    
-    if alignc:
-        field1 = 1
-    else:
-        field1 = field2
-    
-    # Only turn right if doubling the width and the input isn't already turned
-    dbl = clip
-    if not turned and rfactorX > 1:
-        dbl = dbl.std.Transpose()
-        turned = True
-        
-    if rfactorX > 1:
-        dbl = dbl.nnedi3cl.NNEDI3CL(field=field1, dh=True, nsize=nsize, nns=nns, qual=qual, etype=etype, pscrn=pscrn)
-        
-    # Only turn left if the height is going to be doubled or after the last iteration of doubling the width.
-    # This avoids unnecessary turning when only the width is doubled repeatedly.
-    if turned and (rfactorY > 1 or rfactorX == 2):
-        dbl = dbl.std.Transpose()
-        turned = False
-        
-    if rfactorY > 1:
-        dbl = dbl.nnedi3cl.NNEDI3CL(field=field2, dh=True, nsize=nsize, nns=nns, qual=qual, etype=etype, pscrn=pscrn)
-    
-    if rfactorX > 1 or rfactorY > 1:
-        return edi_rpow2_nnedi3cl(clip=dbl, rfactorX=max(1, rfactorX // 2), rfactorY=max(1, rfactorY // 2), alignc=alignc, nsize=nsize, nns=nns, qual=qual, etype=etype, pscrn=pscrn, f=False, turned=turned)
-    else:
-        return clip
+    ("nnedi3cl", _Interpolator(dh=True, dw=False, fields=False, sclip=False, mclip=False, support=16,
+                               params=["nsize", "nns", "qual", "etype", "pscrn", "planes"],
+                               call=_call_nnedi3cl)),
+    ("eedi3", _Interpolator(dh=True, dw=False, fields=False, sclip=True, mclip=True, support=24,
+                            params=["alpha", "beta", "gamma", "nrad", "mdis", "hp", "ucubic", "cost3", "vcheck", "vthresh0", "vthresh1", "vthresh2", "sclip", "mclip", "opt", "planes"],
+                            call=_call_eedi3)),
+    ("eedi2", _Interpolator(dh=True, dw=False, fields=True, sclip=False, mclip=False, support=32,
+                            params=["mthresh", "lthresh", "vthresh", "estr", "dstr", "maxd", "map", "nt", "pp", "planes"],
+                            call=_call_eedi2)),
+])
 
 
-def edi_rpow2_eedi2(clip, rfactorX, rfactorY, alignc=False, mthresh=None, lthresh=None, vthresh=None, estr=None, dstr=None, maxd=None, map=None, nt=None, pp=None, f=True, turned=False):
-    core = vs.core
+# Interpolates clip with the named interpolator. params can hold the parameters of every
+# interpolator, each one only gets its own.
+def _interpolate(core, type, clip, field, dh=False, dw=False, **params):
+    interp = _interpolators[type]
 
-    field2 = int(f)
-    
-    if alignc:
-        field1 = 1
+    params = {name: value for name, value in params.items() if name in interp.params}
+    if dw:
+        params["dw"] = True
+
+    return interp.call(core, clip, field, dh=dh, **params)
+
+
+# Whether the antialiasing drivers have to separate the fields for this type and sclip.
+def _needs_fields(type, sclip):
+    interp = _interpolators[type]
+    if interp.fields:
+        return True
+    return interp.sclip and sclip != "" and (sclip not in _interpolators or _interpolators[sclip].fields)
+
+
+
+# Doubles the height of clip once with the edi interpolator, along with the sclip it falls back on.
+def _edi_double_step(core, edi, clip, field, params, sclip, sclip_params, mclip, nnrep):
+    # Use a src_top shift dependent on the field when resizing
+    # for the sclip to keep it in alignment with the edi clip.
+    if field == 1:
+        rshift = 0.25
     else:
-        field1 = field2
-        
-    dbl = clip
-    if not turned and rfactorX > 1:
-        dbl = dbl.std.Transpose()
-        turned = True
-    
-    if rfactorX > 1:
-        dbl = dbl.eedi2.EEDI2(field=field1, mthresh=mthresh, lthresh=lthresh, vthresh=vthresh, estr=estr, dstr=dstr, maxd=maxd, map=map, nt=nt, pp=pp)
-        
-    if turned and (rfactorY > 1 or rfactorX == 2):
-        dbl = dbl.std.Transpose()
-        turned = False
-        
-    if rfactorY > 1:
-        dbl = dbl.eedi2.EEDI2(field=field2, mthresh=mthresh, lthresh=lthresh, vthresh=vthresh, estr=estr, dstr=dstr, maxd=maxd, map=map, nt=nt, pp=pp)
-        
-    if rfactorX > 1 or rfactorY > 1:
-        return edi_rpow2_eedi2(clip=dbl, rfactorX=max(1, rfactorX // 2), rfactorY=max(1, rfactorY // 2), alignc=alignc, mthresh=mthresh, lthresh=lthresh, vthresh=vthresh, estr=estr, dstr=dstr, maxd=maxd, map=map, nt=nt, pp=pp, f=False, turned=turned)
+        rshift = -0.25
+
+    if sclip == "":
+        sclip2 = None
+    elif sclip in _interpolators:
+        sclip2 = _interpolate(core, sclip, clip, field, dh=True, **sclip_params)
     else:
-        return clip
-    
-    
-def edi_rpow2_eedi3(clip, rfactorX, rfactorY, alignc=False, alpha=None, beta=None, gamma=None, nrad=None, mdis=None, hp=None, ucubic=None, cost3=None, vcheck=None, vthresh0=None, vthresh1=None, vthresh2=None, sclip=None, sclip_params=dict(), mclip=None, opt=None, f=True, turned=False, nnrep=False):
-    core = vs.core
+        sclip2 = eval("core.resize." + sclip)(clip=clip, width=clip.width, height=clip.height * 2, src_left=0, src_top=rshift, **sclip_params)
+
+    if _interpolators[edi].sclip:
+        params = dict(params, sclip=sclip2, mclip=mclip)
+
+    dbl = _interpolate(core, edi, clip, field, dh=True, **params)
+
+    if nnrep and sclip == "znedi3":
+        dbl = core.rgvs.Repair(clip=dbl, repairclip=sclip2, mode=9)
+
+    return dbl
+
+
+# Recursive helper functions for repeated edi image doubling
+# When calling these functions, the f and t parameters should always be left at their default values.
+# They're used only to control behavior during recursion and changing them will cause a malfunction.
 
+def _edi_double(clip, edi, rfactorX, rfactorY, alignc=False, params=dict(), sclip="", sclip_params=dict(), mclip=None, nnrep=False, f=True, turned=False):
+    core = _get_core()
+
+    interp = _interpolators[edi]
+
+    if not interp.sclip:
+        sclip = ""
+
+    if not interp.mclip:
+        mclip = None
+
+    # If alignc=true, always use field=1 for doubling the width
+    # to maintain alignment of horizontally subsampled chroma.
     field2 = int(f)
     
     if alignc:
         field1 = 1
     else:
         field1 = field2
-        
-    # Use a src_left or src_top shift dependent on the field when resizing
-    # for the sclip or mclip to keep it in alignment with the eedi3 clip.
-    # Additionally, the vertical shift for YV12 chroma is doubled,
-    # so the chroma must be resized separately when doubling the height.
+    
+    # The mclip is resized along with the clip, with the same shift dependent on the field
+    # as the sclip to keep it in alignment with the edi clip.
     if field1 == 1:
         rshift1 = 0.25
     else:
@@ -168,77 +451,80 @@ def edi_rpow2_eedi3(clip, rfactorX, rfactorY, alignc=False, alpha=None, beta=Non
         rshift2 = -0.25
         
     dbl = clip
-    if not turned and rfactorX > 1:
-        dbl = dbl.std.Transpose()
-        turned = True
 
-    
-    if rfactorX > 1:
-        if sclip == "":
-            sclip2 = None
-        elif sclip == "znedi3":
-            sclip2 = dbl.znedi3.nnedi3(field=field1, dh=True, **sclip_params)
-        elif sclip == "nnedi3cl":
-            sclip2 = dbl.nnedi3cl.NNEDI3CL(field=field1, dh=True, **sclip_params)
-        elif sclip == "eedi2":
-            sclip2 = dbl.eedi2.EEDI2(field=field1, **sclip_params)
-        else:
-            sclip2 = eval("core.resize." + sclip)(clip=dbl, width=dbl.width, height=dbl.height * 2, src_left=0, src_top=rshift1, **sclip_params)
+    # Double both dimensions in one call when the interpolator can double the width itself.
+    # The width and the height must use the same field for this, and nothing here needs
+    # turning, so it saves both transposes.
+    if interp.dw and rfactorX > 1 and rfactorY > 1 and field1 == field2 and not turned:
+        dbl = _interpolate(core, edi, dbl, field1, dh=True, dw=True, **params)
+    else:
+        # Only turn right if doubling the width and the input isn't already turned
+        if not turned and rfactorX > 1:
+            dbl = _transpose(core, dbl)
+            turned = True
+    
+        if rfactorX > 1:
+            mclip1 = mclip
+            if mclip1 is not None:
+                mclip1 = _transpose(core, mclip1)
             
-        mclip1 = mclip
-        if mclip1 is not None:
-            mclip1 = mclip1.std.Transpose()
+            dbl = _edi_double_step(core, edi, dbl, field1, params, sclip, sclip_params, mclip1, nnrep)
         
-        dbl = dbl.eedi3m.EEDI3(field=field1, dh=True, alpha=alpha, beta=beta, gamma=gamma, nrad=nrad, mdis=mdis, hp=hp, ucubic=ucubic, cost3=cost3, vcheck=vcheck, vthresh0=vthresh0, vthresh1=vthresh1, vthresh2=vthresh2, sclip=sclip2, mclip=mclip1, opt=opt)
+            if mclip is not None:
+                mclip = core.resize.Spline36(clip=mclip, width=mclip.width * 2, height=mclip.height, src_left=rshift1, src_top=0)
+                mclip = core.std.Binarize(clip=mclip)
         
-        if nnrep and sclip == "znedi3":
-            dbl = core.rgvs.Repair(clip=dbl, repairclip=sclip2, mode=9)
+        # Only turn left if the height is going to be doubled or after the last iteration of doubling the width.
+        # This avoids unnecessary turning when only the width is doubled repeatedly.
+        if turned and (rfactorY > 1 or rfactorX == 2):
+            dbl = _transpose(core, dbl)
+            turned = False
     
-        if mclip is not None:
-            mclip = core.resize.Spline36(clip=mclip, width=mclip.width * 2, height=mclip.height, src_left=rshift1, src_top=0)
-            mclip = core.std.Binarize(clip=mclip)
-            
-            
-    if turned and (rfactorY > 1 or rfactorX == 2):
-        dbl = dbl.std.Transpose()
-        turned = False
-        
-    if rfactorY > 1:
-        if sclip == "":
-            sclip2 = None
-        elif sclip == "znedi3":
-            sclip2 = dbl.znedi3.nnedi3(field=field2, dh=True, **sclip_params)
-        elif sclip == "nnedi3cl":
-            sclip2 = dbl.nnedi3cl.NNEDI3CL(field=field2, dh=True, **sclip_params)
-        elif sclip == "eedi2":
-            sclip2 = dbl.eedi2.EEDI2(field=field2, **sclip_params)
-        else:
-            sclip2 = eval("core.resize." + sclip)(clip=dbl, width=dbl.width, height=dbl.height * 2, src_left=0, src_top=rshift2, **sclip_params)
+        if rfactorY > 1:
+            dbl = _edi_double_step(core, edi, dbl, field2, params, sclip, sclip_params, mclip, nnrep)
             
-        dbl = dbl.eedi3m.EEDI3(field=field2, dh=True, alpha=alpha, beta=beta, gamma=gamma, nrad=nrad, mdis=mdis, hp=hp, ucubic=ucubic, cost3=cost3, vcheck=vcheck, vthresh0=vthresh0, vthresh1=vthresh1, vthresh2=vthresh2, sclip=sclip2, mclip=mclip, opt=opt)
-        
-        if nnrep and sclip == "znedi3":
-            dbl = core.rgvs.Repair(clip=dbl, repairclip=sclip2, mode=9)
-            
-        if mclip is not None:
-            mclip = core.resize.Spline36(clip=mclip, width=mclip.width, height=mclip.height * 2, src_left=0, src_top=rshift2)
-            mclip = core.std.Binarize(clip=mclip)
+            if mclip is not None:
+                mclip = core.resize.Spline36(clip=mclip, width=mclip.width, height=mclip.height * 2, src_left=0, src_top=rshift2)
+                mclip = core.std.Binarize(clip=mclip)
             
     if rfactorX > 1 or rfactorY > 1:
-        return edi_rpow2_eedi3(clip=dbl, rfactorX=max(1, rfactorX // 2), rfactorY=max(1, rfactorY // 2), alignc=alignc, alpha=alpha, beta=beta, gamma=gamma, nrad=nrad, mdis=mdis, hp=hp, ucubic=ucubic, cost3=cost3, vcheck=vcheck, vthresh0=vthresh0, vthresh1=vthresh1, vthresh2=vthresh2, sclip=sclip, sclip_params=sclip_params, mclip=mclip, opt=opt, f=False, turned=turned, nnrep=nnrep)
+        return _edi_double(clip=dbl, edi=edi, rfactorX=max(1, rfactorX // 2), rfactorY=max(1, rfactorY // 2), alignc=alignc, params=params, sclip=sclip, sclip_params=sclip_params, mclip=mclip, nnrep=nnrep, f=False, turned=turned)
     else:
         return clip
 
 
+def edi_rpow2_znedi3(clip, rfactorX, rfactorY, alignc=False, nsize=None, nns=None, qual=None, etype=None, pscrn=None, opt=None, int16_prescreener=None, int16_predictor=None, exp=None, f=True, turned=False):
+    params = dict(nsize=nsize, nns=nns, qual=qual, etype=etype, pscrn=pscrn, opt=opt, int16_prescreener=int16_prescreener, int16_predictor=int16_predictor, exp=exp)
+    return _edi_double(clip=clip, edi="znedi3", rfactorX=rfactorX, rfactorY=rfactorY, alignc=alignc, params=params, f=f, turned=turned)
+
+
+def edi_rpow2_nnedi3cl(clip, rfactorX, rfactorY, alignc=False, nsize=None, nns=None, qual=None, etype=None, pscrn=None, f=True, turned=False):
+    params = dict(nsize=nsize, nns=nns, qual=qual, etype=etype, pscrn=pscrn)
+    return _edi_double(clip=clip, edi="nnedi3cl", rfactorX=rfactorX, rfactorY=rfactorY, alignc=alignc, params=params, f=f, turned=turned)
+
+
+def edi_rpow2_eedi2(clip, rfactorX, rfactorY, alignc=False, mthresh=None, lthresh=None, vthresh=None, estr=None, dstr=None, maxd=None, map=None, nt=None, pp=None, f=True, turned=False):
+    params = dict(mthresh=mthresh, lthresh=lthresh, vthresh=vthresh, estr=estr, dstr=dstr, maxd=maxd, map=map, nt=nt, pp=pp)
+    return _edi_double(clip=clip, edi="eedi2", rfactorX=rfactorX, rfactorY=rfactorY, alignc=alignc, params=params, f=f, turned=turned)
+
+
+def edi_rpow2_eedi3(clip, rfactorX, rfactorY, alignc=False, alpha=None, beta=None, gamma=None, nrad=None, mdis=None, hp=None, ucubic=None, cost3=None, vcheck=None, vthresh0=None, vthresh1=None, vthresh2=None, sclip=None, sclip_params=dict(), mclip=None, opt=None, f=True, turned=False, nnrep=False):
+    params = dict(alpha=alpha, beta=beta, gamma=gamma, nrad=nrad, mdis=mdis, hp=hp, ucubic=ucubic, cost3=cost3, vcheck=vcheck, vthresh0=vthresh0, vthresh1=vthresh1, vthresh2=vthresh2, opt=opt)
+    return _edi_double(clip=clip, edi="eedi3", rfactorX=rfactorX, rfactorY=rfactorY, alignc=alignc, params=params, sclip=sclip or "", sclip_params=sclip_params, mclip=mclip, nnrep=nnrep, f=f, turned=turned)
 
 
+
+
+@_with_backend
+@_with_transposes
+@_with_planes
 def edi_rpow2(clip, rfactorX=2, rfactorY=None, edi="znedi3", cshift="", fwidth=None, fheight=None,
               cplace="MPEG2", planes=None, bordfix=None, YV12cfix=True,
               nsize=0, nns=3, qual=None, etype=None, pscrn=None, opt=None, int16_prescreener=None, int16_predictor=None, exp=None,
               alpha=None, beta=None, gamma=None, nrad=None, mdis=None, hp=None, ucubic=None, cost3=None,
               vcheck=None, vthresh0=None, vthresh1=None, vthresh2=None, sclip="", sclip_params=dict(), mclip=None,
-              mthresh=None, lthresh=None, vthresh=None, estr=None, dstr=None, maxd=None, map=None, nt=None, pp=None, nnrep=False):
-    core = vs.core
+              mthresh=None, lthresh=None, vthresh=None, estr=None, dstr=None, maxd=None, map=None, nt=None, pp=None, nnrep=False, backend=None):
+    core = _get_core()
 
     
     def Default(param, value):
@@ -268,7 +554,8 @@ def edi_rpow2(clip, rfactorX=2, rfactorY=None, edi="znedi3", cshift="", fwidth=N
     if rfactorY <= 0 or (rfactorY & (rfactorY - 1) != 0):
         raise ValueError("edi_rpow2: 'rfactorY' must be a power of 2.")
     
-    acceptable_edi = ["znedi3", "nnedi3cl", "eedi3", "eedi2"]
+    # Every interpolator that can double the height.
+    acceptable_edi = [name for name, interp in _interpolators.items() if interp.dh]
     if edi not in acceptable_edi:
         raise ValueError("edi_rpow2: 'edi' must be one of {}.".format(acceptable_edi))
     
@@ -280,7 +567,7 @@ def edi_rpow2(clip, rfactorX=2, rfactorY=None, edi="znedi3", cshift="", fwidth=N
     if cplace not in acceptable_cplace:
         raise ValueError("edi_rpow2: 'cplace' must be one of {}.".format(acceptable_cplace))
     
-    acceptable_sclip = acceptable_cshift + ["znedi3", "nnedi3cl", "eedi2"]
+    acceptable_sclip = acceptable_cshift + [name for name, interp in _interpolators.items() if interp.dh and not interp.sclip]
     if sclip not in acceptable_sclip:
         raise ValueError("edi_rpow2: 'sclip' must be one of {}.".format(acceptable_sclip))
     
@@ -364,21 +651,9 @@ def edi_rpow2(clip, rfactorX=2, rfactorY=None, edi="znedi3", cshift="", fwidth=N
     einput = clip
     emclip = mclip
     if bordfix:
-        einput = core.resize.Point(clip=einput,
-                                   width=iw + padL + padR,
-                                   height=ih + padT + padB,
-                                   src_left=-padL,
-                                   src_top=-padT,
-                                   src_width=iw + padL + padR,
-                                   src_height=ih + padT + padB)
+        einput = _point_pad(core, einput, left=padL, right=padR, top=padT, bottom=padB)
         if emclip is not None:
-            emclip = core.resize.Point(clip=emclip,
-                                       width=iw + padL + padR,
-                                       height=ih + padT + padB,
-                                       src_left=-padL,
-                                       src_top=-padT,
-                                       src_width=iw + padL + padR,
-                                       src_height=ih + padT + padB)
+            emclip = _point_pad(core, emclip, left=padL, right=padR, top=padT, bottom=padB)
     
     padL = [padL, padL_c, padL_c]
     padR = [padR, padR_c, padR_c]
@@ -391,48 +666,63 @@ def edi_rpow2(clip, rfactorX=2, rfactorY=None, edi="znedi3", cshift="", fwidth=N
     cshiftH = [cshiftH, cshiftH_c, cshiftH_c]
     cshiftV = [cshiftV, cshiftV_c, cshiftV_c]
     
+    # Each interpolator only gets its own parameters out of these.
+    edi_params = dict(nsize=nsize, nns=nns, qual=qual, etype=etype, pscrn=pscrn, opt=opt, int16_prescreener=int16_prescreener, int16_predictor=int16_predictor, exp=exp,
+                      alpha=alpha, beta=beta, gamma=gamma, nrad=nrad, mdis=mdis, hp=hp, ucubic=ucubic, cost3=cost3,
+                      vcheck=vcheck, vthresh0=vthresh0, vthresh1=vthresh1, vthresh2=vthresh2,
+                      mthresh=mthresh, lthresh=lthresh, vthresh=vthresh, estr=estr, dstr=dstr, maxd=maxd, map=map, nt=nt, pp=pp)
+    
+    # Crops off the padding and corrects the center shift of the doubled plane.
+    def Finish(p, plane):
+        if padL[plane] or padR[plane] or padT[plane] or padB[plane]:
+            p = _crop(core, p,
+                      left=padL[plane] * rfactorX,
+                      top=padT[plane] * rfactorY,
+                      right=padR[plane] * rfactorX,
+                      bottom=padB[plane] * rfactorY)
+
+        if cshift != "":
+            p = eval("core.resize." + cshift)(clip=p,
+                                              width=fwidth[plane],
+                                              height=fheight[plane],
+                                              src_left=cshiftH[plane],
+                                              src_top=cshiftV[plane])
+        
+        return p
+
+    # Without subsampling all the planes have the same size and shifts, so when every plane is
+    # doubled, they can go through the interpolators together instead of one chain per plane.
+    if not hssc12 and not vssc12 and set(planes) == set(range(einput.format.num_planes)):
+        # The mask comes from the input of xaa, which isn't GRAY when only the luma is processed.
+        if emclip is not None and einput.format.num_planes == 1 and emclip.format.num_planes > 1:
+            emclip = _extract_plane(core, emclip, 0)
+
+        whole_params = dict(edi_params, planes=list(range(einput.format.num_planes)))
+
+        p = _edi_double(clip=einput, edi=edi, rfactorX=rfactorX, rfactorY=rfactorY, alignc=alignc, params=whole_params, sclip=sclip, sclip_params=sclip_params, mclip=emclip, nnrep=nnrep)
+
+        return Finish(p, 0)
+
     pow2 = []
     
     blank = core.std.BlankClip(clip=clip, width=fwidth[0], height=fheight[0])
     
     for plane in range(einput.format.num_planes):
         if not plane in planes:
-            pow2.append(core.std.ShufflePlanes(clips=blank, planes=plane, colorfamily=vs.GRAY))
+            pow2.append(_extract_plane(core, blank, plane))
             
             continue
         
-        p = core.std.ShufflePlanes(clips=einput, planes=plane, colorfamily=vs.GRAY)
+        p = _extract_plane(core, einput, plane)
         
         # Image enlargement
-        if edi == "znedi3":
-            p = edi_rpow2_znedi3(clip=p, rfactorX=rfactorX, rfactorY=rfactorY, alignc=alignc, nsize=nsize, nns=nns, qual=qual, etype=etype, pscrn=pscrn, opt=opt, int16_prescreener=int16_prescreener, int16_predictor=int16_predictor, exp=exp)
-        elif edi == "nnedi3cl":
-            p = edi_rpow2_nnedi3cl(clip=p, rfactorX=rfactorX, rfactorY=rfactorY, alignc=alignc, nsize=nsize, nns=nns, qual=qual, etype=etype, pscrn=pscrn)
-        elif edi == "eedi3":
-            emclip_p = emclip
-            if emclip_p is not None:
-                emclip_p = core.std.ShufflePlanes(clips=emclip_p, planes=plane, colorfamily=vs.GRAY)
-            
-            p = edi_rpow2_eedi3(clip=p, rfactorX=rfactorX, rfactorY=rfactorY, alignc=alignc, alpha=alpha, beta=beta, gamma=gamma, nrad=nrad, mdis=mdis, hp=hp, ucubic=ucubic, cost3=cost3, vcheck=vcheck, vthresh0=vthresh0, vthresh1=vthresh1, vthresh2=vthresh2, sclip=sclip, sclip_params=sclip_params, mclip=emclip_p, opt=opt, nnrep=nnrep)
-        elif edi == "eedi2":
-            p = edi_rpow2_eedi2(clip=p, rfactorX=rfactorX, rfactorY=rfactorY, alignc=alignc, mthresh=mthresh, lthresh=lthresh, vthresh=vthresh, estr=estr, dstr=dstr, maxd=maxd, map=map, nt=nt, pp=pp)
-            
-        # Crop off the padding
-        p = core.std.Crop(clip=p,
-                          left=padL[plane] * rfactorX,
-                          top=padT[plane] * rfactorY,
-                          right=padR[plane] * rfactorX,
-                          bottom=padB[plane] * rfactorY)
-        
-        # Center shift correction
-        if cshift != "":
-            p = eval("core.resize." + cshift)(clip=p,
-                                              width=fwidth[plane],
-                                              height=fheight[plane],
-                                              src_left=cshiftH[plane],
-                                              src_top=cshiftV[plane])
-        
-        pow2.append(p)
+        emclip_p = emclip
+        if emclip_p is not None and _interpolators[edi].mclip:
+            emclip_p = _extract_plane(core, emclip_p, plane)
+
+        p = _edi_double(clip=p, edi=edi, rfactorX=rfactorX, rfactorY=rfactorY, alignc=alignc, params=edi_params, sclip=sclip, sclip_params=sclip_params, mclip=emclip_p, nnrep=nnrep)
+
+        pow2.append(Finish(p, plane))
         
     # Even if the center shift isn't corrected,
     # doubling the height of YV12 causes a vertical chroma shift that needs to be corrected
@@ -448,112 +738,549 @@ def edi_rpow2(clip, rfactorX=2, rfactorY=None, edi="znedi3", cshift="", fwidth=N
     if len(pow2) == 1:
         return pow2[0]
     else:
-        return core.std.ShufflePlanes(clips=pow2, planes=[0, 0, 0], colorfamily=clip.format.color_family)
+        return _shuffle_planes(core, pow2, [0, 0, 0], clip.format.color_family)
 
 
-def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom", uscl=None, dscl="Spline36", csharp=None, cstr=None, mask=None, mtype=None, mthr=None, chroma=None, cplace="MPEG2", nns=1, eedimthr=0.0, eediA=0.2, eediB=0.25, eediG=20.0):
-    core = vs.core
-    
-    
-    
-    def Default(param, value):
-        if param is None:
-            return value
-        else:
-            return param
-    
-    
-    # Avisynth's Round function doesn't do quite the same thing as Python's round function.
-    def AvisynthRound(value):
-        if value < 0:
-            return -int(-value + 0.5)
-        else:
-            return int(value + 0.5)
+# zimg's chroma locations, by how far the chroma is from the middle of the luma pixels it covers,
+# horizontally and vertically, in luma pixels.
+_chroma_locations = collections.OrderedDict([
+    ((-0.5, 0.0), "left"),
+    ((0.0, 0.0), "center"),
+    ((-0.5, -0.5), "top_left"),
+    ((0.0, -0.5), "top"),
+    ((-0.5, 0.5), "bottom_left"),
+    ((0.0, 0.5), "bottom"),
+])
     
-    
-    # Resize the luma and the chroma separately in order to use different subpixel shifts.
-    def ResizeSeparately(clip, width, height, src_left, src_top, kernel="Spline36", cplace="MPEG2"):
-        core = vs.core
 
-        if not isinstance(clip, vs.VideoNode):
-            raise ValueError("ResizeSeparately: 'clip' must be a clip.")
-        
-        if clip.format is None:
-            raise ValueError("ResizeSeparately: 'clip' must have constant format.")
-        
-        if clip.width == 0 or clip.height == 0:
-            raise ValueError("ResizeSeparately: 'clip' must have constant dimensions.")
-        
-        ratio = 1 << clip.format.subsampling_w
-        if width % ratio != 0:
-            raise ValueError("ResizeSeparately: 'width' must be a multiple of {}. Instead it is {}.".format(ratio, width))
-        
-        ratio = 1 << clip.format.subsampling_h
-        if height % ratio != 0:
-            raise ValueError("ResizeSeparately: 'height' must be a multiple of {}. Instead it is {}.".format(ratio, height))
-        
-        if not isinstance(src_left, list) or len(src_left) != 2:
-            raise ValueError("ResizeSeparately: 'src_left' must be a list of two numbers.")
-        
-        if not isinstance(src_top, list) or len(src_top) != 2:
-            raise ValueError("ResizeSeparately: 'src_top' must be a list of two numbers.")
-        
-        if src_left[0] == src_left[1] and src_top[0] == src_top[1]:
-            raise ValueError("ResizeSeparately: 'src_left'/'src_top' are the same for the luma and chroma. If the luma and chroma can be resized with the same subpixel shifts, use the resizer filters directly.")
-        
-        if isGray(clip):
-            raise ValueError("ResizeSeparately: 'clip' is GRAY. Use the resizer filters directly.")
+# The input and output chroma locations that make a single resize do what ResizeSeparately does,
+# or None if there are none. The resizer moves the chroma by the output location times the
+# scale, minus the input location, so the difference between the chroma and the luma shifts
+# has to be one of those.
+def _shifted_chromaloc(clip, width, height, src_left, src_top, cplace):
+    fmt = clip.format
+    if fmt.subsampling_w > 1 or fmt.subsampling_h > 1:
+        return None
 
-        if kernel not in ["Bilinear", "Bicubic", "Lanczos", "Spline16", "Spline36"]:
-            raise ValueError("ResizeSeparately: 'kernel' must be 'Bilinear', 'Bicubic', 'Lanczos', 'Spline16', 'Spline36'.")
-        
-        if cplace not in ["MPEG1", "MPEG2"]:
-            raise ValueError("ResizeSeparately: 'cplace' must be 'MPEG1' or 'MPEG2'.")
-        
-        
-        width = [width, width >> clip.format.subsampling_w, width >> clip.format.subsampling_w]
-        height = [height, height >> clip.format.subsampling_h, height >> clip.format.subsampling_h]
-        
-        
-        src_left[1] = src_left[1] / (1 << clip.format.subsampling_w)
-            
-        if clip.format.subsampling_w == 1 and cplace == "MPEG2":
-            MPEG2shift = 0.25 * (1.0 - clip.width / width[0])
-            
-            src_left[1] += MPEG2shift
-                
-        src_top[1] = src_top[1] / (1 << clip.format.subsampling_h)
-            
-        src_left.append(src_left[1])
-        src_top.append(src_top[1])
-            
-        
-        planes = [None, None, None]
-        
-        for plane in range(3):
-            p = core.std.ShufflePlanes(clips=clip, planes=plane, colorfamily=vs.GRAY)
-            
-            p = eval("core.resize." + kernel)(clip=p,
-                                              width=width[plane],
-                                              height=height[plane],
-                                              src_left=src_left[plane],
-                                              src_top=src_top[plane])
-            
-            planes[plane] = p
-            
-        return core.std.ShufflePlanes(clips=planes, planes=[0, 0, 0], colorfamily=clip.format.color_family)
-        
-        
+    shift_h = src_left[1] - src_left[0]
+    shift_v = src_top[1] - src_top[0]
 
+    # ResizeSeparately keeps MPEG2 chroma on the left when it scales the chroma plane.
+    if fmt.subsampling_w and cplace == "MPEG2":
+        shift_h += 0.5 * (1.0 - clip.width / width)
+
+    # The location only moves the chroma in the directions it is subsampled in.
+    if (not fmt.subsampling_w and shift_h) or (not fmt.subsampling_h and shift_v):
+        return None
+
+    # The output location cplace stands for is tried first.
+    cplace_location = (-0.5 if cplace == "MPEG2" else 0.0, 0.0)
+    for out_h, out_v in sorted(_chroma_locations, key=lambda location: location != cplace_location):
+        in_h = out_h * clip.width / width - shift_h if fmt.subsampling_w else out_h
+        in_v = out_v * clip.height / height - shift_v if fmt.subsampling_h else out_v
+
+        for (loc_h, loc_v), name in _chroma_locations.items():
+            if abs(loc_h - in_h) < 1e-9 and abs(loc_v - in_v) < 1e-9:
+                return name, _chroma_locations[(out_h, out_v)]
+
+    return None
+
+
+# Resize the luma and the chroma separately in order to use different subpixel shifts.
+@_with_planes
+def ResizeSeparately(clip, width, height, src_left, src_top, kernel="Spline36", cplace="MPEG2"):
+    core = _get_core()
+
+    if not _is_clip(clip):
+        raise ValueError("ResizeSeparately: 'clip' must be a clip.")
+
+    if clip.format is None:
+        raise ValueError("ResizeSeparately: 'clip' must have constant format.")
 
-    if not isinstance(clip, vs.VideoNode):
-        raise ValueError("xaa: 'clip' must be a clip.")
-        
-    iw = clip.width
-    ih = clip.height
-    
     if clip.width == 0 or clip.height == 0:
+        raise ValueError("ResizeSeparately: 'clip' must have constant dimensions.")
+
+    ratio = 1 << clip.format.subsampling_w
+    if width % ratio != 0:
+        raise ValueError("ResizeSeparately: 'width' must be a multiple of {}. Instead it is {}.".format(ratio, width))
+
+    ratio = 1 << clip.format.subsampling_h
+    if height % ratio != 0:
+        raise ValueError("ResizeSeparately: 'height' must be a multiple of {}. Instead it is {}.".format(ratio, height))
+
+    if not isinstance(src_left, list) or len(src_left) != 2:
+        raise ValueError("ResizeSeparately: 'src_left' must be a list of two numbers.")
+
+    if not isinstance(src_top, list) or len(src_top) != 2:
+        raise ValueError("ResizeSeparately: 'src_top' must be a list of two numbers.")
+
+    if src_left[0] == src_left[1] and src_top[0] == src_top[1]:
+        raise ValueError("ResizeSeparately: 'src_left'/'src_top' are the same for the luma and chroma. If the luma and chroma can be resized with the same subpixel shifts, use the resizer filters directly.")
+
+    if isGray(clip):
+        raise ValueError("ResizeSeparately: 'clip' is GRAY. Use the resizer filters directly.")
+
+    if kernel not in ["Bilinear", "Bicubic", "Lanczos", "Spline16", "Spline36"]:
+        raise ValueError("ResizeSeparately: 'kernel' must be 'Bilinear', 'Bicubic', 'Lanczos', 'Spline16', 'Spline36'.")
+
+    if cplace not in ["MPEG1", "MPEG2"]:
+        raise ValueError("ResizeSeparately: 'cplace' must be 'MPEG1' or 'MPEG2'.")
+
+
+    # Most of the time a single resize can do it, when it's told that the input chroma is somewhere
+    # else than the output chroma. The output then has to be labelled with the real chroma location.
+    chromaloc = _shifted_chromaloc(clip, width, height, src_left, src_top, cplace)
+    if chromaloc is not None:
+        resized = eval("core.resize." + kernel)(clip=clip,
+                                                width=width,
+                                                height=height,
+                                                src_left=src_left[0],
+                                                src_top=src_top[0],
+                                                chromaloc_in_s=chromaloc[0],
+                                                chromaloc_s=chromaloc[1])
+
+        if chromaloc[1] != _chroma_locations[(-0.5 if cplace == "MPEG2" else 0.0, 0.0)]:
+            resized = core.std.SetFrameProps(clip=resized, _ChromaLocation=0 if cplace == "MPEG2" else 1)
+
+        return resized
+
+
+    width = [width, width >> clip.format.subsampling_w, width >> clip.format.subsampling_w]
+    height = [height, height >> clip.format.subsampling_h, height >> clip.format.subsampling_h]
+
+
+    src_left[1] = src_left[1] / (1 << clip.format.subsampling_w)
+
+    if clip.format.subsampling_w == 1 and cplace == "MPEG2":
+        MPEG2shift = 0.25 * (1.0 - clip.width / width[0])
+
+        src_left[1] += MPEG2shift
+
+    src_top[1] = src_top[1] / (1 << clip.format.subsampling_h)
+
+    src_left.append(src_left[1])
+    src_top.append(src_top[1])
+
+
+    planes = [None, None, None]
+
+    for plane in range(3):
+        p = _extract_plane(core, clip, plane)
+
+        p = eval("core.resize." + kernel)(clip=p,
+                                          width=width[plane],
+                                          height=height[plane],
+                                          src_left=src_left[plane],
+                                          src_top=src_top[plane])
+
+        planes[plane] = p
+
+    return _shuffle_planes(core, planes, [0, 0, 0], clip.format.color_family)
+
+
+# both as in both horizontal (3x1) and vertical (1x3)
+mt_expand_mode_both = [0, 1, 0,
+                       1,    1,
+                       0, 1, 0]
+
+
+# Makes the edge masks used by xaa and remembers them, so that each mask is only made once per
+# source clip, mtype, temtype, threshold, and planes. Prewitt and Sobel masks that only differ in
+# the threshold share the gradient.
+#
+# With resample=True, masks can also be taken from a bigger mask of the same picture (see 'picture'
+# in get()) and resized, and TEdgeMask masks that only differ in the threshold share a magnitude
+# mask. This is faster, but the masks are not quite the same as the ones made from scratch.
+class _EdgeMasks:
+    def __init__(self, core, resample=False):
+        self._core = core
+        self._resample = resample
+        # Values are (clip, mask) so the clip whose id is in the key stays alive.
+        self._masks = {}
+        self._gradients = {}
+        self._pictures = collections.defaultdict(list)
+
+    # picture names what the clip shows, e.g. "input" for the input clip and its resized versions,
+    # as long as they are aligned with each other. None means the clip shows something unique.
+    def get(self, clip, mtype, temtype, threshold, planes, picture=None):
+        planes = tuple(planes)
+        key = (id(clip), mtype, temtype, threshold, planes)
+
+        if key in self._masks:
+            return self._masks[key][1]
+
+        mask = None
+        if self._resample and picture is not None:
+            mask = self._resized(clip, mtype, temtype, threshold, planes, picture)
+        if mask is None:
+            mask = self._make(clip, mtype, temtype, threshold, planes)
+
+        self._masks[key] = (clip, mask)
+        if picture is not None:
+            self._pictures[picture].append(clip)
+
+        return mask
+
+    def _gradient(self, clip, mtype, temtype, planes):
+        key = (id(clip), mtype, temtype, planes)
+
+        if key not in self._gradients:
+            core = self._core
+            if mtype == "TEdgeMask":
+                gradient = core.tedgemask.TEdgeMask(clip=clip, threshold=0, type=temtype, link=0, planes=planes)
+            elif mtype == "Prewitt":
+                gradient = core.std.Prewitt(clip=clip, planes=planes)
+            elif mtype == "Sobel":
+                gradient = core.std.Sobel(clip=clip, planes=planes)
+            self._gradients[key] = (clip, gradient)
+
+        return self._gradients[key][1]
+
+    def _make(self, clip, mtype, temtype, threshold, planes):
+        core = self._core
+        planes = list(planes)
+
+        if mtype == "TEdgeMask":
+            if self._resample:
+                mask = core.std.Binarize(clip=self._gradient(clip, mtype, temtype, tuple(planes)), threshold=threshold * (1 << (clip.format.bits_per_sample - 8)), planes=planes)
+            else:
+                mask = core.tedgemask.TEdgeMask(clip=clip, threshold=threshold, type=temtype, link=0, planes=planes)
+        elif mtype == "TCanny":
+            mask = core.tcanny.TCanny(clip=clip, t_h=threshold, t_l=threshold, planes=planes, op=0)
+            mask = core.std.Maximum(clip=mask, planes=planes, coordinates=mt_expand_mode_both)
+            mask = core.std.Inflate(clip=mask, planes=planes)
+            mask = core.std.Minimum(clip=mask, planes=planes, coordinates=mt_expand_mode_both)
+        elif mtype in ["Prewitt", "Sobel"]:
+            # Add 1 to obtain the behaviour of mt_edge's thX1/thX2 parameters:
+            # mt_edge does pixel <= mthr ? 0 : 255
+            # But we use std.Binarize which does pixel < mthr ? 0 : 255
+            mask = core.std.Binarize(clip=self._gradient(clip, mtype, temtype, tuple(planes)), threshold=(threshold + 1) << (clip.format.bits_per_sample - 8), planes=planes)
+
+        return core.std.Inflate(clip=mask, planes=planes)
+
+    def _resized(self, clip, mtype, temtype, threshold, planes, picture):
+        core = self._core
+        fmt = clip.format
+
+        # Use the smallest mask that is at least as big as the clip and has all the wanted planes.
+        best = None
+        for other in self._pictures[picture]:
+            key = (id(other), mtype, temtype, threshold, planes)
+            if key not in self._masks or other.width < clip.width or other.height < clip.height:
+                continue
+            if fmt.num_planes > 1 and other.format.num_planes > 1 and (other.format.subsampling_w != fmt.subsampling_w or other.format.subsampling_h != fmt.subsampling_h):
+                continue
+            if max(planes) >= other.format.num_planes:
+                continue
+            if best is None or other.width * other.height < best.width * best.height:
+                best = other
+
+        if best is None:
+            return None
+
+        mask = self._masks[(id(best), mtype, temtype, threshold, planes)][1]
+        if fmt.num_planes == 1 and mask.format.num_planes > 1:
+            mask = _extract_plane(core, mask, 0)
+        if mask.width != clip.width or mask.height != clip.height:
+            mask = core.resize.Bilinear(clip=mask, width=clip.width, height=clip.height)
+
+        if fmt.num_planes == 1 or (mask.format.num_planes == fmt.num_planes and len(planes) == fmt.num_planes):
+            return mask
+
+        # Like the masks made from scratch, copy the planes that aren't processed from the clip.
+        if mask.format.num_planes == 1:
+            mask_planes = [0] * fmt.num_planes
+        else:
+            mask_planes = list(range(fmt.num_planes))
+        return _shuffle_planes(core,
+                               [mask if p in planes else clip for p in range(fmt.num_planes)],
+                               [mask_planes[p] if p in planes else p for p in range(fmt.num_planes)],
+                               fmt.color_family)
+
+
+# xaa's roi splits the frame into at most this many tiles, and antialiases at most
+# this many of them in one frame's mosaic.
+_roi_max_tiles = 64
+_roi_max_slots = 16
+
+
+# ModifyFrame callback for xaa's roi. f holds the PlaneStats of the parts of the edge
+# mask that can take pixels from each tile, per_tile of them for every tile. Sets
+# XaaRoiTiles to 1 for the tiles that need antialiasing and 0 for the others.
+def _roi_active(n, f, per_tile):
+    flags = []
+    for i in range(0, len(f), per_tile):
+        flags.append(int(any(frame.props["PlaneStatsMax"] > 0 for frame in f[i:i + per_tile])))
+
+    fout = f[0].copy()
+    fout.props["XaaRoiTiles"] = flags
+    return fout
+
+
+# FrameEval callback for a slot of xaa's roi mosaic. It holds the slot-th tile that
+# needs antialiasing. Slots without one hold the first tile, which is never used.
+def _roi_slot(n, f, slot, tiles):
+    active = [i for i, flag in enumerate(f.props["XaaRoiTiles"]) if flag]
+    if slot < len(active):
+        return tiles[active[slot]]
+    return tiles[0]
+
+
+# FrameEval callback for a tile of xaa's roi. Returns the tile's slot of the antialiased
+# mosaic if it needs antialiasing, and the tile of rs1 otherwise.
+def _roi_select(n, f, index, skipped, slots):
+    flags = f.props["XaaRoiTiles"]
+    slot = sum(flags[:index])
+    if flags[index] and slot < len(slots):
+        return slots[slot]
+    return skipped
+
+
+# FrameEval callback for xaa's roi. Returns rs1 when no tile needs antialiasing, the
+# tiles when they all fit in the mosaic, and the whole antialiased frame otherwise.
+def _roi_choose(n, f, unchanged, tiles, whole, slots):
+    count = sum(f.props["XaaRoiTiles"])
+    if count == 0:
+        return unchanged
+    elif count <= slots:
+        return tiles
+    return whole
+
+
+
+# FrameEval callback for xaa's skip_below. f has the edge mask coverage of the merged planes.
+def _skip_select(n, f, bypassed, processed, planes, threshold):
+    for plane in planes:
+        if f.props["XaaCoverage{}Average".format(plane)] >= threshold:
+            return processed
+
+    return bypassed
+
+
+
+# Values that a FrameEval callback hands to the prebuilt ModifyFrame it picks for frame n, such as
+# a frame it found in a cache, so that the ModifyFrame doesn't have to find it again after it could
+# have been dropped. A value that is never taken, because the core had the ModifyFrame's frame in
+# its own cache, goes once there are size newer ones.
+class _FramePins:
+    def __init__(self, size=64):
+        self._lock = threading.Lock()
+        self._values = collections.OrderedDict()
+        self._size = size
+
+    def put(self, n, value):
+        with self._lock:
+            self._values[n] = value
+            self._values.move_to_end(n)
+            while len(self._values) > self._size:
+                self._values.popitem(last=False)
+
+    def take(self, n):
+        with self._lock:
+            return self._values.pop(n)
+
+
+# The last few output frames of xaa's dedupe, so that the frames after them can return them
+# without requesting anything. A frame that repeats a reused frame gets the same frame, so a
+# held frame is only processed once however long it's held.
+class _DedupeFrames:
+    def __init__(self, size):
+        self._lock = threading.Lock()
+        self._frames = collections.OrderedDict()
+        self._size = size
+
+    def get(self, n):
+        with self._lock:
+            return self._frames.get(n)
+
+    def put(self, n, frame):
+        with self._lock:
+            self._frames[n] = frame
+            self._frames.move_to_end(n)
+            while len(self._frames) > self._size:
+                self._frames.popitem(last=False)
+
+
+# FrameEval callback for xaa's dedupe. f has the differences between the input frame and the ones
+# before it, and earlier[k - 1] is the deduped output from k frames back, which is the output of
+# the first frame of the repeats. It's only requested when that frame isn't held anymore.
+def _dedupe_select(n, f, current, earlier, held, reused, pins, num_planes, threshold, counters):
+    for k in range(min(len(earlier), n), 0, -1):
+        if all(f.props["XaaDup{}_{}Diff".format(k, plane)] <= threshold for plane in range(num_planes)):
+            if counters is not None:
+                counters._count(k)
+
+            frame = held.get(n - k)
+            if frame is None:
+                return earlier[k - 1]
+            pins.put(n, frame)
+            return reused[k - 1]
+
+    if counters is not None:
+        counters._count(0)
+    return current
+
+
+# ModifyFrame callback that returns the held frame of xaa's dedupe that _dedupe_select found, k frames back.
+def _dedupe_reuse(pins, k, n, f):
+    fout = pins.take(n).copy()
+    fout.props["XaaReused"] = k
+    return fout
+
+
+# ModifyFrame callback that holds on to xaa's deduped output frames.
+def _dedupe_keep(held, n, f):
+    held.put(n, f)
+    return f
+
+
+# FrameEval callback for the adaptive passes. f is the output of the previous pass.
+def _pass_select(n, f, previous, current, threshold):
+    if "XaaPassDiff" in f.props and f.props["XaaPassDiff"] < threshold:
+        return previous
+
+    return current
+
+
+# ModifyFrame callback that copies the XaaPasses of the antialiased frame to the output frame.
+def _copy_passes(n, f):
+    fout = f[0].copy()
+    if "XaaPasses" in f[1].props:
+        fout.props["XaaPasses"] = f[1].props["XaaPasses"]
+    return fout
+
+
+# How many times edi_rpow2 has to double size to get close to target: 8 if target is more than
+# about six times size, 4 if it's more than about three times, 2 if it's bigger, and 1 otherwise.
+def _rfactor(target, size):
+    if target > size * 6 - 4:
+        return 8
+    elif target > size * 3 - 4:
+        return 4
+    elif target > size:
+        return 2
+    else:
+        return 1
+
+
+# A subpixel shift that a clip still has to be corrected by, in pixels of the clip: h and v for the luma,
+# h_c and v_c for the chroma (in luma pixels, like ResizeSeparately). xaa's stages hand it to the next
+# resize instead of resampling their output, so that each clip is only resampled once.
+_Shift = collections.namedtuple("_Shift", ["h", "v", "h_c", "v_c"])
+
+_no_shift = _Shift(0, 0, 0, 0)
+
+
+# The shift as it is after the clip's size was doubled rfactorX and rfactorY times, plus other.
+def _shift_scaled(shift, rfactorX, rfactorY, other=_no_shift):
+    return _Shift(h=shift.h * rfactorX + other.h,
+                  v=shift.v * rfactorY + other.v,
+                  h_c=shift.h_c * rfactorX + other.h_c,
+                  v_c=shift.v_c * rfactorY + other.v_c)
+
+
+# The center shift edi_rpow2 leaves in a clip when it doubles the size rfactorX and rfactorY times
+# and isn't asked to correct it.
+def _edi_cshift(rfactorX, rfactorY, hssc12, vssc12, chroma, cplace):
+    if rfactorX > 1:
+        if not hssc12 or chroma == 0:
+            h = -0.5
+        else:
+            h = -0.5 * (rfactorX - 1)
+    else:
+        h = 0
+
+    if rfactorY > 1:
+        v = -0.5
+    else:
+        v = 0
+
+    if rfactorX > 1 and cplace == "MPEG1" and hssc12 and chroma:
+        h_c = -0.5 * (rfactorX - 1) + h
+    else:
+        h_c = h
+
+    if rfactorY > 1 and vssc12 and chroma:
+        v_c = v * 2.0
+    else:
+        v_c = v
+
+    return _Shift(h=h, v=v, h_c=h_c, v_c=v_c)
+
+
+# Resizes clip to width x height and corrects shift at the same time.
+def _shift_resize(core, clip, width, height, shift, kernel, cplace, chromaloc):
+    if shift.h != shift.h_c or shift.v != shift.v_c:
+        return ResizeSeparately(clip=clip,
+                                width=width,
+                                height=height,
+                                src_left=[shift.h, shift.h_c],
+                                src_top=[shift.v, shift.v_c],
+                                kernel=kernel,
+                                cplace=cplace)
+
+    return eval("core.resize." + kernel)(clip=clip,
+                                         width=width,
+                                         height=height,
+                                         src_left=shift.h,
+                                         src_top=shift.v,
+                                         chromaloc_in_s=chromaloc,
+                                         chromaloc_s=chromaloc)
+
+
+# All of the values xaa derives from its parameters before it builds any filters.
+# Plans are immutable and hashable, so they can be reused across calls and used as dict keys.
+XaaPlan = collections.namedtuple("XaaPlan", [
+    "format_id", "width", "height",
+    "ow", "oh", "ssw", "ssh",
+    "aa_mode", "aa_h", "aa_v", "aa_pass", "aa_type", "aa_sclip",
+    "uscl", "dscl", "rs_sclip", "csharp", "cstr",
+    "mask", "mtype", "temtype", "mthr", "mshare", "chroma", "planes", "roi", "roi_margin", "roi_slots", "skip_below", "dedupe", "dedupe_thr", "adaptive_passes",
+    "cplace", "chromaloc", "nns", "eedimthr", "eediA", "eediB", "eediG",
+    "aa_ow", "aa_oh",
+    "rs1_type", "rs1_isedi", "rs1_rfacX", "rs1_rfacY", "rs1_cshift", "rs1_shift", "delay_cshift",
+    "aa_delayresize_h", "aa_delayresize_v", "aa_shift",
+    "rs1_pad8", "rs1_addpad", "rs1_padL", "rs1_padR", "rs1_padT", "rs1_padB",
+    "ssw_pad", "ssh_pad", "ssw_pad_c", "ssh_pad_c",
+    "rsaa_type", "rsaa_isedi", "rsaa_rfacX", "rsaa_rfacY", "rsaa_cshift", "rsaa_shift",
+    "rs2_type", "rs2_isedi", "rs2_rfacX", "rs2_rfacY", "rs2_cshift",
+])
+
+
+def xaa_plan(format, width, height, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom", uscl=None, dscl="Spline36", csharp=None, cstr=None, mask=None, mtype=None, mthr=None, chroma=None, cplace="MPEG2", nns=1, eedimthr=0.0, eediA=0.2, eediB=0.25, eediG=20.0, mshare=False, roi=0, skip_below=0.0, dedupe=0, dedupe_thr=0.001, adaptive_passes=0.0):
+    if format is None:
+        raise RuntimeError("xaa: 'clip' must have constant format.")
+
+    if isinstance(format, int):
+        format_id = format
+    else:
+        format_id = format.id
+
+    if width == 0 or height == 0:
         raise RuntimeError("xaa: 'clip' must have constant dimensions.")
+
+    return _xaa_plan(format_id, width, height, ow, oh, ss, ssw, ssh, mode, uscl, dscl, csharp, cstr, mask, mtype, mthr, chroma, cplace, nns, eedimthr, eediA, eediB, eediG, mshare, roi, skip_below, dedupe, dedupe_thr, adaptive_passes)
+
+
+# typed=True because ssw=2 and ssw=2.0 mean different things.
+@functools.lru_cache(maxsize=256, typed=True)
+def _xaa_plan(format_id, iw, ih, ow, oh, ss, ssw, ssh, mode, uscl, dscl, csharp, cstr, mask, mtype, mthr, chroma, cplace, nns, eedimthr, eediA, eediB, eediG, mshare, roi, skip_below, dedupe, dedupe_thr, adaptive_passes):
+    fmt = vs.core.get_video_format(format_id)
+    
+    
+    def Default(param, value):
+        if param is None:
+            return value
+        else:
+            return param
+    
+    
+    # Avisynth's Round function doesn't do quite the same thing as Python's round function.
+    def AvisynthRound(value):
+        if value < 0:
+            return -int(-value + 0.5)
+        else:
+            return int(value + 0.5)
     
     
     ow = Default(ow, iw)
@@ -624,9 +1351,6 @@ def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom",
     if cplace not in ["MPEG1", "MPEG2"]:
         raise ValueError("xaa: 'cplace' must be 'MPEG1' or 'MPEG2'.")
     
-    if clip.format is None:
-        raise RuntimeError("xaa: 'clip' must have constant format.")
-    
     
     ##### Set variable values based on parameter settings #####
     
@@ -637,32 +1361,38 @@ def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom",
         chromaloc = "left"
     
     
-    if clip.format.sample_type != vs.INTEGER or clip.format.bits_per_sample > 16:
+    if fmt.sample_type != vs.INTEGER or fmt.bits_per_sample > 16:
         raise RuntimeError("xaa: 'clip' must have 8..16 bit integer format.")
     
-    if not (isGray(clip) or is420(clip) or is422(clip) or is444(clip)):
+    is_gray = fmt.color_family == vs.GRAY
+    is_yuv = fmt.color_family == vs.YUV
+    is_420 = is_yuv and fmt.subsampling_w == 1 and fmt.subsampling_h == 1
+    is_422 = is_yuv and fmt.subsampling_w == 1 and fmt.subsampling_h == 0
+    is_444 = is_yuv and fmt.subsampling_w == 0 and fmt.subsampling_h == 0
+
+    if not (is_gray or is_420 or is_422 or is_444):
         raise RuntimeError("xaa: 'clip' must be GRAY, 420, 422, or 444.")
     
     
-    hssc12 = clip.format.subsampling_w > 0
-    vssc12 = clip.format.subsampling_h > 0
+    hssc12 = fmt.subsampling_w > 0
+    vssc12 = fmt.subsampling_h > 0
     
     if ow > 0 and hssc12 and ow % 2:
-        raise ValueError("xaa: output width of {} must be a multiple of 2.".format(clip.format.name))
+        raise ValueError("xaa: output width of {} must be a multiple of 2.".format(fmt.name))
     
     if oh > 0 and vssc12 and oh % 2:
-        raise ValueError("xaa: output height of {} must be a multiple of 2.".format(clip.format.name))
+        raise ValueError("xaa: output height of {} must be a multiple of 2.".format(fmt.name))
     
-    if isGray(clip):
+    if is_gray:
         chroma = 0
         
     if chroma not in [0, 1, 2]:
         raise ValueError("xaa: 'chroma' must be 0, 1, or 2.")
     
     if chroma == 0:
-        planes = [0]
+        planes = (0,)
     else:
-        planes = [0, 1, 2]
+        planes = (0, 1, 2)
 
     
     # If ssw or ssh is a float, use it as a multiplier to determine the supersampled resolution
@@ -738,31 +1468,25 @@ def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom",
         mode = mode[1:]
         
     # Get the aa type from the mode string
+    aa_types = [name for name in _interpolators if mode.startswith(name)]
+
     if mode == "null":
         aa_type = "null"
-    elif mode.startswith("SangNom"):
-        aa_type = "SangNom"
-    elif mode.startswith("nnedi3cl"):
-        aa_type = "nnedi3cl"
-    elif mode.startswith("znedi3"):
-        aa_type = "znedi3"
-    elif mode.startswith("eedi3"):
-        aa_type = "eedi3"
-    elif mode.startswith("eedi2"):
-        aa_type = "eedi2"
+    elif aa_types:
+        aa_type = aa_types[0]
     else:
         raise ValueError("xaa: invalid mode string '{}': the antialiasing type must be 'SangNom', 'nnedi3cl', 'znedi3', 'eedi3', or 'eedi2'.".format(original_mode))
     
     # Get the aa sclip from the mode string
-    if aa_type == "eedi3" and len(mode) > 5:
-        mode = mode[5:]
+    if aa_type != "null" and _interpolators[aa_type].sclip and len(mode) > len(aa_type):
+        mode = mode[len(aa_type):]
         
         if mode[0] in mode_separators:
             mode = mode[1:]
             
         aa_sclip = mode
         
-        acceptable_aa_sclip = acceptable_dscl + ["SangNom", "znedi3", "nnedi3cl", "eedi2"]
+        acceptable_aa_sclip = acceptable_dscl + [name for name, interp in _interpolators.items() if not interp.sclip]
         if aa_sclip not in acceptable_aa_sclip:
             raise ValueError("xaa: invalid mode string '{}': the antialiasing sclip type must be one of {}.".format(original_mode, acceptable_aa_sclip))
     else:
@@ -782,28 +1506,12 @@ def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom",
     
     # Define these before the resize sections so they can be used as conditionals
     # TODO this comment might have been necessary only in Avisynth
-    if aa_mode == "di" and csharp != 1 and not aa_v:
-        aa_ow = ssw * 2
-    else:
-        aa_ow = ssw
-        
-    if aa_mode == "di" and csharp != 1 and aa_v:
-        aa_oh = ssh * 2
-    else:
-        aa_oh = ssh
-        
     if ssw > iw or ssh > ih:
         rs1_type = uscl
     else:
         rs1_type = dscl
     rs1_isedi = "edi" in rs1_type
     
-    if ow > aa_ow or oh > aa_oh:
-        rsaa_type = uscl
-    else:
-        rsaa_type = dscl
-    rsaa_isedi = "edi" in rsaa_type
-    
     if ow > iw or oh > ih:
         rs2_type = uscl
     else:
@@ -838,6 +1546,34 @@ def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom",
     if mthr <= 0.0:
         raise ValueError("xaa: 'mthr' must be greater than 0.")
     
+    if not isinstance(mshare, bool):
+        raise TypeError("xaa: 'mshare' must be a bool.")
+
+    if not isinstance(roi, int) or roi < 0 or roi % 8 != 0:
+        raise ValueError("xaa: 'roi' must be 0 or a multiple of 8.")
+
+    if roi and mask != 1:
+        raise ValueError("xaa: 'roi' only works with mask=1.")
+
+    # Nothing to skip without antialiasing.
+    if aa_mode == "null":
+        roi = 0
+
+    if skip_below < 0.0 or skip_below > 1.0:
+        raise ValueError("xaa: 'skip_below' must be between 0.0 and 1.0.")
+
+    if skip_below > 0 and mask != 1:
+        raise ValueError("xaa: 'skip_below' only works with mask=1.")
+
+    if not isinstance(dedupe, int) or dedupe < 0:
+        raise ValueError("xaa: 'dedupe' must be 0 or a positive integer.")
+
+    if dedupe_thr < 0:
+        raise ValueError("xaa: 'dedupe_thr' must be 0.0 or greater.")
+
+    if adaptive_passes < 0:
+        raise ValueError("xaa: 'adaptive_passes' must be 0.0 or greater.")
+
         
     
     # Round the mthr values for Prewitt and Sobel mask types
@@ -846,146 +1582,92 @@ def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom",
         eedimthr = AvisynthRound(eedimthr)
         
         
-    # Remove frame properties that could confuse nnedi3 etc or the resizer.
-    clip = core.std.RemoveFrameProps(clip=clip, props=["_FieldBased", "_Field"])
-    
-    
     ##### Scale the input clip to the supersampled resolution #####
     
     # rs1_type and rs1_isedi are defined earlier
-    if ssw > iw * 6 - 4:
-        rs1_rfacX = 8
-    elif ssw > iw * 3 - 4:
-        rs1_rfacX = 4
-    elif ssw > iw:
-        rs1_rfacX = 2
-    else:
-        rs1_rfacX = 1
-        
-    if ssh > ih * 6 - 4:
-        rs1_rfacY = 8
-    elif ssh > ih * 3 - 4:
-        rs1_rfacY = 4
-    elif ssh > ih:
-        rs1_rfacY = 2
-    else:
-        rs1_rfacY = 1
+    rs1_rfacX = _rfactor(ssw, iw)
+    rs1_rfacY = _rfactor(ssh, ih)
     
     if ssw >= iw * rs1_rfacX or ssh >= ih * rs1_rfacY:
         rs1_cshift = "Spline36"
     else:
         rs1_cshift = dscl
         
-    
-    # To avoid resizing twice, don't correct the edi_rpow2 center shift until
-    # resizing to the output resolution if no other processing will happen until then.
-    # This isn't done all the time because the center shift messes with antialiasing.
-    delay_cshift = aa_mode == "null" and rs1_isedi and ssw == iw * rs1_rfacX and ssh == ih * rs1_rfacY
-    
-    if delay_cshift and rs1_isedi and rs1_rfacX > 1:
-        if not hssc12 or chroma == 0:
-            rs1_hshift = -0.5
-        else:
-            rs1_hshift = -0.5 * (rs1_rfacX - 1)
-    else:
-        rs1_hshift = 0
-        
-    if delay_cshift and rs1_isedi and rs1_rfacY > 1:
-        rs1_vshift = -0.5
-    else:
-        rs1_vshift = 0
-        
-    if delay_cshift and rs1_isedi and rs1_rfacX > 1 and cplace == "MPEG1" and hssc12 and chroma:
-        rs1_hshift_c = -0.5 * (rs1_rfacX - 1) + rs1_hshift
-    else:
-        rs1_hshift_c = rs1_hshift
-        
-    if delay_cshift and rs1_isedi and rs1_rfacY > 1 and vssc12 and chroma:
-        rs1_vshift_c = rs1_vshift * 2.0
+    # The size of rs1 before its last resize, and the center shift that resize corrects
+    if rs1_isedi:
+        rs1_w = iw * rs1_rfacX
+        rs1_h = ih * rs1_rfacY
+        rs1_shift = _edi_cshift(rs1_rfacX, rs1_rfacY, hssc12, vssc12, chroma, cplace)
     else:
-        rs1_vshift_c = rs1_vshift
-        
+        rs1_w = iw
+        rs1_h = ih
+        rs1_shift = _no_shift
     
-    # both as in both horizontal (3x1) and vertical (1x3)
-    mt_expand_mode_both = [0, 1, 0,
-                           1,    1,
-                           0, 1, 0]
-    
-    # Edge mask for eedi3's mclip parameter to use for the rs1 and rs2 resizes
-    if uscl == "eedi3" and eedimthr > 0:
-        if mtype == "TEdgeMask":
-            rs12_mclip = clip.tedgemask.TEdgeMask(threshold=eedimthr, type=temtype, link=0, planes=planes)
-        elif mtype == "TCanny":
-            rs12_mclip = clip.tcanny.TCanny(t_h=eedimthr, t_l=eedimthr, planes=planes, op=0)
-            rs12_mclip = rs12_mclip.std.Maximum(planes=planes, coordinates=mt_expand_mode_both).std.Inflate(planes=planes)
-            rs12_mclip = rs12_mclip.std.Minimum(planes=planes, coordinates=mt_expand_mode_both)
-        elif mtype == "Prewitt":
-            # Add 1 to obtain the behaviour of mt_edge's thX1/thX2 parameters:
-            # mt_edge does pixel <= mthr ? 0 : 255
-            # But we use std.Binarize which does pixel < mthr ? 0 : 255
-            rs12_mclip = clip.std.Prewitt(planes=planes).std.Binarize(threshold=(eedimthr + 1) << (clip.format.bits_per_sample - 8), planes=planes)
-        elif mtype == "Sobel":
-            rs12_mclip = clip.std.Sobel(planes=planes).std.Binarize(threshold=(eedimthr + 1) << (clip.format.bits_per_sample - 8), planes=planes)
-        
-        rs12_mclip = rs12_mclip.std.Inflate(planes=planes)
-    else:
-        rs12_mclip = None
-        
-        
-    if chroma == 0:
-        clip_y8 = core.std.ShufflePlanes(clips=clip, planes=0, colorfamily=vs.GRAY)
-    else:
-        clip_y8 = clip
+    # The number of edi_rpow2 doublings rsaa needs when it starts from a width x height clip
+    def RsaaDoublings(width, height):
+        if "edi" in uscl and (ow > width or oh > height):
+            return _rfactor(ow, width) * _rfactor(oh, height)
+        return 1
         
-        
-    if ssw == iw and ssh == ih:
-        rs1 = clip_y8
-    elif rs1_isedi:
-        edi_params = dict(clip=clip_y8, rfactorX=rs1_rfacX, rfactorY=rs1_rfacY, edi=rs1_type, cplace=cplace,
-                          alpha=eediA, beta=eediB, gamma=eediG, sclip=rs_sclip, mclip=rs12_mclip)
-        if delay_cshift:
-            edi_params.update(dict(YV12cfix=False))
-        else:
-            edi_params.update(dict(cshift=rs1_cshift, fwidth=ssw, fheight=ssh))
-            
-        rs1 = edi_rpow2(**edi_params)
-    else:
-        rs1 = eval("core.resize." + rs1_type)(clip=clip_y8, width=ssw, height=ssh, chromaloc_s=chromaloc, chromaloc_in_s=chromaloc)
-    
     
-    ##### Apply antialiasing to the supersampled clip #####
-    
-    # To avoid resizing twice, don't downscale the aaclip after di antialiasing unless needed for csharp=1.
-    aa_delayresize_h = aa_mode == "di" and csharp != 1 and not aa_v
-    aa_delayresize_v = aa_mode == "di" and csharp != 1 and aa_v
+    # To avoid resizing twice, leave the last resize of rs1 to rsaa if no other processing will happen
+    # until then, and if rsaa doesn't need more edi_rpow2 doublings because of it.
+    # This isn't done all the time because the center shift messes with antialiasing.
+    delay_cshift = aa_mode == "null" and (rs1_isedi or ssw != iw or ssh != ih) and RsaaDoublings(rs1_w, rs1_h) <= RsaaDoublings(ssw, ssh)
     
-    if aa_delayresize_h:
-        aa_hshift = -0.5
-    else:
-        aa_hshift = 0
     
-    if aa_delayresize_v:
-        aa_vshift = -0.5
-    else:
-        aa_vshift = 0
-        
-    if aa_delayresize_h and hssc12 and chroma and cplace == "MPEG1":
-        aa_hshift_c = -0.5 + aa_hshift
-    else:
-        aa_hshift_c = aa_hshift
+    ##### Apply antialiasing to the supersampled clip #####
     
-    if aa_delayresize_v and vssc12 and chroma:
-        aa_vshift_c = aa_vshift * 2.0
+    # The context every roi tile gets on each side, so that the interpolator sees the same pixels
+    # as when it processes the whole frame. This is the distance the plugin reaches with its default
+    # settings, for every pass, rounded up to mod8.
+    if roi:
+        roi_margin = (_interpolators[aa_type].support * aa_pass + 7) // 8 * 8
+
+        # The tiles are made larger when there would be more than _roi_max_tiles of them.
+        while ((ssw + roi - 1) // roi) * ((ssh + roi - 1) // roi) > _roi_max_tiles:
+            roi += 8
+
+        # The mosaic the tiles are antialiased in takes at most _roi_max_slots tiles, and at most
+        # half the frame. Without room for a single tile, the whole frame is antialiased.
+        roi_tiles = ((ssw + roi - 1) // roi) * ((ssh + roi - 1) // roi)
+        roi_slots = min(roi_tiles - 1, _roi_max_slots, ssw * ssh // (2 * (roi + roi_margin * 2) ** 2))
+        if roi_slots < 1:
+            roi = 0
+
+    if not roi:
+        roi_margin = 0
+        roi_slots = 0
+
+    # To avoid resizing twice, don't downscale the aaclip after di antialiasing unless needed for csharp=1,
+    # which compares it with rs1 pixel by pixel. rsaa never needs more doublings because the aaclip is bigger.
+    # With roi, the mosaic is downscaled so that the tiles can be put back together.
+    aa_delayresize_h = aa_mode == "di" and csharp != 1 and not aa_v and not roi
+    aa_delayresize_v = aa_mode == "di" and csharp != 1 and aa_v and not roi
+    
+    # The size of the aaclip, and the shift that was left to rsaa
+    if delay_cshift:
+        aa_ow = rs1_w
+        aa_oh = rs1_h
+        aa_shift = rs1_shift
+    elif aa_delayresize_h:
+        aa_ow = ssw * 2
+        aa_oh = ssh
+        aa_shift = _edi_cshift(2, 1, hssc12, vssc12, chroma, cplace)
+    elif aa_delayresize_v:
+        aa_ow = ssw
+        aa_oh = ssh * 2
+        aa_shift = _edi_cshift(1, 2, hssc12, vssc12, chroma, cplace)
     else:
-        aa_vshift_c = aa_vshift
-        
+        aa_ow = ssw
+        aa_oh = ssh
+        aa_shift = _no_shift
         
     # Pad the frame with rows of duplicate pixels to avoid errors from
     # mod1 resolutions and edge distortion caused by deinterlacing.
     rs1_ismod4 = ssw % 4 == 0 and ssh % 4 == 0
     rs1_ismod8 = ssw % 8 == 0 and ssh % 8 == 0
-    rs1_pad8 = (not rs1_ismod8 and aa_type == "eedi2" and hssc12 and not is420(clip) and chroma) or \
-               (not rs1_ismod8 and aa_type == "eedi3" and hssc12 and not is420(clip) and chroma and aa_sclip not in ["", "SangNom", "znedi3", "nnedi3cl"])
+    rs1_pad8 = not rs1_ismod8 and aa_type != "null" and _needs_fields(aa_type, aa_sclip) and hssc12 and not is_420 and chroma
     
     
     # Don't add padding when using di eedi3 antialiasing unless it's
@@ -1037,25 +1719,216 @@ def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom",
         ssh_pad_c = ssh_pad
         
     
-    # Edge mask for eedi3's mclip parameter to use for antialiasing
+    ##### Scale the antialiased clip to the output resolution #####
+    
+    if ow > aa_ow or oh > aa_oh:
+        rsaa_type = uscl
+    else:
+        rsaa_type = dscl
+    rsaa_isedi = "edi" in rsaa_type
+        
+    rsaa_rfacX = _rfactor(ow, aa_ow)
+    rsaa_rfacY = _rfactor(oh, aa_oh)
+        
+    if ow >= aa_ow * rsaa_rfacX or oh >= aa_oh * rsaa_rfacY:
+        rsaa_cshift = "Spline36"
+    else:
+        rsaa_cshift = dscl
+        
+    # The center shift of edi_rpow2 if it's used, plus the shift that was left to rsaa
+    if rsaa_isedi:
+        rsaa_shift = _shift_scaled(aa_shift, rsaa_rfacX, rsaa_rfacY, _edi_cshift(rsaa_rfacX, rsaa_rfacY, hssc12, vssc12, chroma, cplace))
+    else:
+        rsaa_shift = aa_shift
+    
+    
+    ##### Scale the input clip to the output resolution without antialiasing for masking and chroma #####
+    
+    rs2_rfacX = _rfactor(ow, iw)
+    rs2_rfacY = _rfactor(oh, ih)
+        
+    if ow >= iw * rs2_rfacX and oh >= ih * rs2_rfacY:
+        rs2_cshift = "Spline36"
+    else:
+        rs2_cshift = dscl
+
+
+    return XaaPlan(format_id=format_id, width=iw, height=ih,
+                   ow=ow, oh=oh, ssw=ssw, ssh=ssh,
+                   aa_mode=aa_mode, aa_h=aa_h, aa_v=aa_v, aa_pass=aa_pass, aa_type=aa_type, aa_sclip=aa_sclip,
+                   uscl=uscl, dscl=dscl, rs_sclip=rs_sclip, csharp=csharp, cstr=cstr,
+                   mask=mask, mtype=mtype, temtype=temtype, mthr=mthr, mshare=mshare, chroma=chroma, planes=planes, roi=roi, roi_margin=roi_margin, roi_slots=roi_slots, skip_below=skip_below, dedupe=dedupe, dedupe_thr=dedupe_thr, adaptive_passes=adaptive_passes,
+                   cplace=cplace, chromaloc=chromaloc, nns=nns, eedimthr=eedimthr, eediA=eediA, eediB=eediB, eediG=eediG,
+                   aa_ow=aa_ow, aa_oh=aa_oh,
+                   rs1_type=rs1_type, rs1_isedi=rs1_isedi, rs1_rfacX=rs1_rfacX, rs1_rfacY=rs1_rfacY, rs1_cshift=rs1_cshift, rs1_shift=rs1_shift, delay_cshift=delay_cshift,
+                   aa_delayresize_h=aa_delayresize_h, aa_delayresize_v=aa_delayresize_v, aa_shift=aa_shift,
+                   rs1_pad8=rs1_pad8, rs1_addpad=rs1_addpad, rs1_padL=rs1_padL, rs1_padR=rs1_padR, rs1_padT=rs1_padT, rs1_padB=rs1_padB,
+                   ssw_pad=ssw_pad, ssh_pad=ssh_pad, ssw_pad_c=ssw_pad_c, ssh_pad_c=ssh_pad_c,
+                   rsaa_type=rsaa_type, rsaa_isedi=rsaa_isedi, rsaa_rfacX=rsaa_rfacX, rsaa_rfacY=rsaa_rfacY, rsaa_cshift=rsaa_cshift, rsaa_shift=rsaa_shift,
+                   rs2_type=rs2_type, rs2_isedi=rs2_isedi, rs2_rfacX=rs2_rfacX, rs2_rfacY=rs2_rfacY, rs2_cshift=rs2_cshift)
+
+
+@_with_backend
+@_with_transposes
+@_with_planes
+def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom", uscl=None, dscl="Spline36", csharp=None, cstr=None, mask=None, mtype=None, mthr=None, chroma=None, cplace="MPEG2", nns=1, eedimthr=0.0, eediA=0.2, eediB=0.25, eediG=20.0, mshare=False, roi=0, skip_below=0.0, dedupe=0, dedupe_thr=0.001, adaptive_passes=0.0, plan=None, profile=None, counters=None, disk_cache=None, stage_cache=None, backend=None):
+    core = _get_core()
+
+
+    if not _is_clip(clip):
+        raise ValueError("xaa: 'clip' must be a clip.")
+
+    iw = clip.width
+    ih = clip.height
+
+    if clip.width == 0 or clip.height == 0:
+        raise RuntimeError("xaa: 'clip' must have constant dimensions.")
+
+    if clip.format is None:
+        raise RuntimeError("xaa: 'clip' must have constant format.")
+
+    # Resolving the parameters is the expensive part of building the graph, so the plans are cached.
+    # A plan obtained from xaa.plan() can also be passed directly, in which case the other parameters are ignored.
+    if plan is None:
+        plan = xaa_plan(clip.format, iw, ih, ow=ow, oh=oh, ss=ss, ssw=ssw, ssh=ssh, mode=mode, uscl=uscl, dscl=dscl, csharp=csharp, cstr=cstr, mask=mask, mtype=mtype, mthr=mthr, chroma=chroma, cplace=cplace, nns=nns, eedimthr=eedimthr, eediA=eediA, eediB=eediB, eediG=eediG, mshare=mshare, roi=roi, skip_below=skip_below, dedupe=dedupe, dedupe_thr=dedupe_thr, adaptive_passes=adaptive_passes)
+    elif not isinstance(plan, XaaPlan):
+        raise TypeError("xaa: 'plan' must be an XaaPlan.")
+    elif plan.format_id != clip.format.id or plan.width != iw or plan.height != ih:
+        raise ValueError("xaa: 'plan' was made for a {}x{} clip with format id {}, not for a {}x{} {} clip.".format(plan.width, plan.height, plan.format_id, iw, ih, clip.format.name))
+
+    ow, oh, ssw, ssh = plan.ow, plan.oh, plan.ssw, plan.ssh
+    aa_mode, aa_h, aa_v, aa_pass, aa_type, aa_sclip = plan.aa_mode, plan.aa_h, plan.aa_v, plan.aa_pass, plan.aa_type, plan.aa_sclip
+    uscl, dscl, rs_sclip, csharp, cstr = plan.uscl, plan.dscl, plan.rs_sclip, plan.csharp, plan.cstr
+    mask, mtype, temtype, mthr, chroma = plan.mask, plan.mtype, plan.temtype, plan.mthr, plan.chroma
+    cplace, chromaloc, nns, eedimthr, eediA, eediB, eediG = plan.cplace, plan.chromaloc, plan.nns, plan.eedimthr, plan.eediA, plan.eediB, plan.eediG
+    planes = list(plan.planes)
+    roi = plan.roi
+
+    vssc12 = clip.format.subsampling_h > 0
+
+    # Timing probes are only inserted when profiling, so there is no overhead otherwise.
+    if profile is None:
+        profile = getattr(_local, "profiler", None)
+    elif not isinstance(profile, XaaProfiler):
+        raise TypeError("xaa: 'profile' must be an XaaProfiler.")
+
+    if counters is not None and not isinstance(counters, XaaCounters):
+        raise TypeError("xaa: 'counters' must be an XaaCounters.")
+
+    if stage_cache is not None and not isinstance(stage_cache, XaaStageCache):
+        raise TypeError("xaa: 'stage_cache' must be an XaaStageCache.")
+
+    if disk_cache is not None:
+        # The disk cache is in xaa_tools, which imports this module.
+        from xaa_tools import XaaDiskCache
+
+        if not isinstance(disk_cache, XaaDiskCache):
+            raise TypeError("xaa: 'disk_cache' must be an XaaDiskCache.")
+
+    # The stage cache recognises the input by the clip that was passed in.
+    source = clip
+
+    # The stages are shared with the other variants of a sweep, and go through the stage cache and
+    # the timing probes, when they're used.
+    def Stage(stage, name):
+        sweep = getattr(_local, "sweep", None)
+        if sweep is not None:
+            stage = sweep.share(source, stage, name, plan)
+        if stage_cache is not None:
+            stage = stage_cache.wrap(source, stage, name, plan)
+        if profile is not None:
+            stage = profile.probe(stage, name)
+        return stage
+
+
+    # Remove frame properties that could confuse nnedi3 etc or the resizer.
+    clip = core.std.RemoveFrameProps(clip=clip, props=["_FieldBased", "_Field"])
+
+
+    ##### Scale the input clip to the supersampled resolution #####
+
+
+    # All the edge masks go through this, so none of them is made twice.
+    masks = _EdgeMasks(core, resample=plan.mshare)
+
+    # Edge mask for eedi3's mclip parameter to use for the rs1 and rs2 resizes
+    if uscl == "eedi3" and eedimthr > 0:
+        rs12_mclip = masks.get(clip, mtype, temtype, eedimthr, planes, picture="input")
+    else:
+        rs12_mclip = None
+
+
+    if chroma == 0:
+        clip_y8 = _extract_plane(core, clip, 0)
+    else:
+        clip_y8 = clip
+
+
+    if ssw == iw and ssh == ih:
+        rs1 = clip_y8
+    elif plan.delay_cshift and not plan.rs1_isedi:
+        # The whole resize is left to rsaa.
+        rs1 = clip_y8
+    elif plan.rs1_isedi:
+        edi_params = dict(clip=clip_y8, rfactorX=plan.rs1_rfacX, rfactorY=plan.rs1_rfacY, edi=plan.rs1_type, cplace=cplace,
+                          alpha=eediA, beta=eediB, gamma=eediG, sclip=rs_sclip, mclip=rs12_mclip)
+        if plan.delay_cshift:
+            edi_params.update(dict(YV12cfix=False))
+        else:
+            edi_params.update(dict(cshift=plan.rs1_cshift, fwidth=ssw, fheight=ssh))
+
+        rs1 = edi_rpow2(**edi_params)
+    else:
+        rs1 = eval("core.resize." + plan.rs1_type)(clip=clip_y8, width=ssw, height=ssh, chromaloc_s=chromaloc, chromaloc_in_s=chromaloc)
+
+    if rs1 is not clip_y8:
+        rs1 = Stage(rs1, "rs1")
+
+
+    ##### Scale the input clip to the output resolution without antialiasing for masking and chroma #####
+
+    rs2_type, rs2_isedi, rs2_rfacX, rs2_rfacY, rs2_cshift = plan.rs2_type, plan.rs2_isedi, plan.rs2_rfacX, plan.rs2_rfacY, plan.rs2_cshift
+        
+    
+    if ow == iw and oh == ih:
+        rs2 = clip
+    elif rs2_isedi:
+        rs2 = clip
+        # The Avisynth version had rfactorY=rs1_rfacY and rs2_rfacY was never used.
+        rs2 = edi_rpow2(clip=rs2, rfactorX=rs2_rfacX, rfactorY=rs2_rfacY, edi=rs2_type, cshift=rs2_cshift, fwidth=ow, fheight=oh, cplace=cplace, alpha=eediA, beta=eediB, gamma=eediG, sclip=rs_sclip, mclip=rs12_mclip)
+    else:
+        rs2 = eval("core.resize." + rs2_type)(clip=clip,
+                                              width=ow,
+                                              height=oh,
+                                              chromaloc_in_s=chromaloc,
+                                              chromaloc_s=chromaloc)
+        
+    
+    
+    
+    
+    if rs2 is not clip:
+        rs2 = Stage(rs2, "rs2")
+
+
+    ##### Apply antialiasing to the supersampled clip #####
+
+    aa_delayresize_h = plan.aa_delayresize_h
+    aa_delayresize_v = plan.aa_delayresize_v
+
+    rs1_addpad = plan.rs1_addpad
+    rs1_padL, rs1_padR, rs1_padT, rs1_padB = plan.rs1_padL, plan.rs1_padR, plan.rs1_padT, plan.rs1_padB
+
+
+    # Edge mask for eedi3's mclip parameter to use for antialiasing
     aa_mclip = None
     aa_mclipv = None
     aa_mcliph = None
-    
+
     if eedimthr > 0:
-        if mtype == "TEdgeMask":
-            aa_mclip = rs1.tedgemask.TEdgeMask(threshold=eedimthr, type=temtype, link=0, planes=planes)
-        elif mtype == "TCanny":
-            aa_mclip = rs1.tcanny.TCanny(t_h=eedimthr, t_l=eedimthr, planes=planes, op=0)
-            aa_mclip = aa_mclip.std.Maximum(planes=planes, coordinates=mt_expand_mode_both).std.Inflate(planes=planes)
-            aa_mclip = aa_mclip.std.Minimum(planes=planes, coordinates=mt_expand_mode_both)
-        elif mtype == "Prewitt":
-            aa_mclip = rs1.std.Prewitt(planes=planes).std.Binarize(threshold=(eedimthr + 1) << (rs1.format.bits_per_sample - 8), planes=planes)
-        elif mtype == "Sobel":
-            aa_mclip = rs1.std.Sobel(planes=planes).std.Binarize(threshold=(eedimthr + 1) << (rs1.format.bits_per_sample - 8), planes=planes)
-        
-        aa_mclip = aa_mclip.std.Inflate(planes=planes)
-        
+        # rs1 is only aligned with the input once the center shift has been corrected.
+        aa_mclip = masks.get(rs1, mtype, temtype, eedimthr, planes, picture=None if plan.delay_cshift else "input")
+
         if rs1_addpad:
             aa_mclip_pad = aa_mclip.resize.Point(width=ssw + rs1_padL + rs1_padR,
                                                  height=ssh + rs1_padT + rs1_padB,
@@ -1065,9 +1938,9 @@ def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom",
                                                  src_height=ssh + rs1_padT + rs1_padB)
         else:
             aa_mclip_pad = aa_mclip
-            
+
         aa_mclipv = aa_mclip_pad
-        aa_mcliph = aa_mclipv.std.Transpose()
+        aa_mcliph = _transpose(core, aa_mclipv)
 
 
     if rs1_addpad:
@@ -1081,136 +1954,215 @@ def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom",
         rs1_pad = rs1
         
     
-    # Perform antialiasing
-    if aa_mode == "null":
-        aaclip = rs1
-    elif (aa_type != "SangNom" and not is422(clip)) or (aa_type != "SangNom" and is420(clip) and chroma):
-        # When using SangNom2, it's faster to split the planes into Y8 clips and process them separately
-        # TODO Is it? Why?
-        
-        aaclip = rs1_pad
-        
-        if aa_h:
-            aaclip = aaclip.std.Transpose()
+    # The center shift of the di antialiasing, which always doubles the height
+    di_shift = _edi_cshift(1, 2, False, vssc12, chroma, cplace)
 
-            if aa_mode == "sr":
-                aaclip = xaa_sr(aaclip, aa_type, aa_pass, cplace, 48, nns, eediA, eediB, eediG, aa_sclip, aa_mcliph)
-            elif aa_mode == "dr":
-                aaclip = xaa_dr(aaclip, aa_type, aa_pass, cplace, 48, nns, eediA, eediB, eediG, aa_sclip, aa_mcliph)
-            elif aa_mode == "di":
-                aaclip = xaa_di(aaclip, aa_type, aa_pass, cplace, 48, nns, eediA, eediB, eediG, aa_sclip, aa_mcliph)
-            
-                if not aa_delayresize_h:
-                    if vssc12 and chroma:
-                        aaclip = ResizeSeparately(clip=aaclip,
-                                                  width=ssh_pad,
-                                                  height=ssw_pad,
-                                                  src_left=[0, 0],
-                                                  src_top=[-0.5, -1.0],
-                                                  kernel=dscl,
-                                                  cplace=cplace)
-                    else:
-                        aaclip = eval("core.resize." + dscl)(clip=aaclip,
-                                                             width=ssh_pad,
-                                                             height=ssw_pad,
-                                                             src_left=0,
-                                                             src_top=-0.5,
-                                                             chromaloc_s=chromaloc,
-                                                             chromaloc_in_s=chromaloc)
-        
-            aaclip = aaclip.std.Transpose()
-
-        if aa_v:
-            if aa_mode == "sr":
-                aaclip = xaa_sr(aaclip, aa_type, aa_pass, cplace, 48, nns, eediA, eediB, eediG, aa_sclip, aa_mclipv)
-            elif aa_mode == "dr":
-                aaclip = xaa_dr(aaclip, aa_type, aa_pass, cplace, 48, nns, eediA, eediB, eediG, aa_sclip, aa_mclipv)
-            elif aa_mode == "di":
-                aaclip = xaa_di(aaclip, aa_type, aa_pass, cplace, 48, nns, eediA, eediB, eediG, aa_sclip, aa_mclipv)
-                
-                if not aa_delayresize_v:
-                    if vssc12 and chroma:
-                        aaclip = ResizeSeparately(clip=aaclip,
-                                                  width=ssw_pad,
-                                                  height=ssh_pad,
-                                                  src_left=[0, 0],
-                                                  src_top=[-0.5, -1.0],
-                                                  kernel=dscl,
-                                                  cplace=cplace)
-                    else:
-                        aaclip = eval("core.resize." + dscl)(clip=aaclip,
-                                                             width=ssw_pad,
-                                                             height=ssh_pad,
-                                                             src_left=0,
-                                                             src_top=-0.5,
-                                                             chromaloc_s=chromaloc,
-                                                             chromaloc_in_s=chromaloc)
-    else:
-        snaa_plane = [48, 0, 0]
-        ssw_pad_plane = [ssw_pad, ssw_pad_c, ssw_pad_c]
-        ssh_pad_plane = [ssh_pad, ssh_pad_c, ssh_pad_c]
-        aaclip_plane = [None, None, None]
-        
-        for plane in range(rs1_pad.format.num_planes):
-            aaclip_plane[plane] = core.std.ShufflePlanes(clips=rs1_pad, planes=plane, colorfamily=vs.GRAY)
-            
-            if aa_mcliph is not None:
-                aa_mcliph_plane = core.std.ShufflePlanes(clips=aa_mcliph, planes=plane, colorfamily=vs.GRAY)
-            else:
-                aa_mcliph_plane = None
-                
-            if aa_mclipv is not None:
-                aa_mclipv_plane = core.std.ShufflePlanes(clips=aa_mclipv, planes=plane, colorfamily=vs.GRAY)
-            else:
-                aa_mclipv_plane = None
+    # Applies the antialiasing to aainput, which is rs1_pad or the roi mosaic. The result
+    # has the same size as aainput, unless the di downscale is delayed.
+    def Antialias(aainput, aa_mcliph, aa_mclipv):
+        aainput_w = aainput.width
+        aainput_h = aainput.height
+
+        if (aa_type != "SangNom" and not is422(clip)) or (aa_type != "SangNom" and is420(clip) and chroma):
+            # When using SangNom2, it's faster to split the planes into Y8 clips and process them separately
+            # TODO Is it? Why?
+        
+            aaclip = aainput
         
             if aa_h:
-                aaclip_plane[plane] = aaclip_plane[plane].std.Transpose()
+                aaclip = _transpose(core, aaclip)
 
                 if aa_mode == "sr":
-                    aaclip_plane[plane] = xaa_sr(aaclip_plane[plane], aa_type, aa_pass, cplace, snaa_plane[plane], nns, eediA, eediB, eediG, aa_sclip, aa_mcliph_plane)
+                    aaclip = xaa_sr(aaclip, aa_type, aa_pass, cplace, 48, nns, eediA, eediB, eediG, aa_sclip, aa_mcliph, adaptive_passes=plan.adaptive_passes)
                 elif aa_mode == "dr":
-                    aaclip_plane[plane] = xaa_dr(aaclip_plane[plane], aa_type, aa_pass, cplace, snaa_plane[plane], nns, eediA, eediB, eediG, aa_sclip, aa_mcliph_plane)
+                    aaclip = xaa_dr(aaclip, aa_type, aa_pass, cplace, 48, nns, eediA, eediB, eediG, aa_sclip, aa_mcliph, adaptive_passes=plan.adaptive_passes)
                 elif aa_mode == "di":
-                    aaclip_plane[plane] = xaa_di(aaclip_plane[plane], aa_type, aa_pass, cplace, snaa_plane[plane], nns, eediA, eediB, eediG, aa_sclip, aa_mcliph_plane)
-                    
+                    aaclip = xaa_di(aaclip, aa_type, aa_pass, cplace, 48, nns, eediA, eediB, eediG, aa_sclip, aa_mcliph, adaptive_passes=plan.adaptive_passes)
+            
                     if not aa_delayresize_h:
-                        aaclip_plane[plane] = eval("core.resize." + dscl)(clip=aaclip_plane[plane],
-                                                                          width=ssh_pad_plane[plane],
-                                                                          height=ssw_pad_plane[plane],
-                                                                          src_left=0,
-                                                                          src_top=-0.5)
-                    
-                aaclip_plane[plane] = aaclip_plane[plane].std.Transpose()
-                
+                        aaclip = _shift_resize(core, aaclip, aainput_h, aainput_w, di_shift, dscl, cplace, chromaloc)
+        
+                aaclip = _transpose(core, aaclip)
+
             if aa_v:
                 if aa_mode == "sr":
-                    aaclip_plane[plane] = xaa_sr(aaclip_plane[plane], aa_type, aa_pass, cplace, snaa_plane[plane], nns, eediA, eediB, eediG, aa_sclip, aa_mclipv_plane)
+                    aaclip = xaa_sr(aaclip, aa_type, aa_pass, cplace, 48, nns, eediA, eediB, eediG, aa_sclip, aa_mclipv, adaptive_passes=plan.adaptive_passes)
                 elif aa_mode == "dr":
-                    aaclip_plane[plane] = xaa_dr(aaclip_plane[plane], aa_type, aa_pass, cplace, snaa_plane[plane], nns, eediA, eediB, eediG, aa_sclip, aa_mclipv_plane)
+                    aaclip = xaa_dr(aaclip, aa_type, aa_pass, cplace, 48, nns, eediA, eediB, eediG, aa_sclip, aa_mclipv, adaptive_passes=plan.adaptive_passes)
                 elif aa_mode == "di":
-                    aaclip_plane[plane] = xaa_di(aaclip_plane[plane], aa_type, aa_pass, cplace, snaa_plane[plane], nns, eediA, eediB, eediG, aa_sclip, aa_mclipv_plane)
-                    
+                    aaclip = xaa_di(aaclip, aa_type, aa_pass, cplace, 48, nns, eediA, eediB, eediG, aa_sclip, aa_mclipv, adaptive_passes=plan.adaptive_passes)
+                
                     if not aa_delayresize_v:
-                        aaclip_plane[plane] = eval("core.resize." + dscl)(clip=aaclip_plane[plane],
-                                                                          width=ssw_pad_plane[plane],
-                                                                          height=ssh_pad_plane[plane],
-                                                                          src_left=0,
-                                                                          src_top=-0.5)
-        if rs1_pad.format.num_planes == 1:
-            aaclip = aaclip_plane[0]
+                        aaclip = _shift_resize(core, aaclip, aainput_w, aainput_h, di_shift, dscl, cplace, chromaloc)
         else:
-            aaclip = core.std.ShufflePlanes(clips=aaclip_plane, planes=[0, 0, 0], colorfamily=rs1_pad.format.color_family)
+            snaa_plane = [48, 0, 0]
+            ssw_pad_plane = [aainput_w, aainput_w >> aainput.format.subsampling_w, aainput_w >> aainput.format.subsampling_w]
+            ssh_pad_plane = [aainput_h, aainput_h >> aainput.format.subsampling_h, aainput_h >> aainput.format.subsampling_h]
+            aaclip_plane = [None, None, None]
         
-    
-    # Crop the padding off
-    if rs1_addpad:
-        if aa_delayresize_h:
-            aaclip = aaclip.std.Crop(left=rs1_padL * 2, top=rs1_padT, right=rs1_padR * 2, bottom=rs1_padB)
-        elif aa_delayresize_v:
-            aaclip = aaclip.std.Crop(left=rs1_padL, top=rs1_padT * 2, right=rs1_padR, bottom=rs1_padB * 2)
+            for plane in range(aainput.format.num_planes):
+                aaclip_plane[plane] = _extract_plane(core, aainput, plane)
+            
+                # The mask is turned one plane at a time, like the planes themselves. The chroma of a turned 422 clip
+                # wouldn't have the dimensions of the turned chroma planes.
+                if aa_mclipv is not None:
+                    aa_mclipv_plane = _extract_plane(core, aa_mclipv, plane)
+                    aa_mcliph_plane = _transpose(core, aa_mclipv_plane)
+                else:
+                    aa_mclipv_plane = None
+                    aa_mcliph_plane = None
+        
+                if aa_h:
+                    aaclip_plane[plane] = _transpose(core, aaclip_plane[plane])
+
+                    if aa_mode == "sr":
+                        aaclip_plane[plane] = xaa_sr(aaclip_plane[plane], aa_type, aa_pass, cplace, snaa_plane[plane], nns, eediA, eediB, eediG, aa_sclip, aa_mcliph_plane, adaptive_passes=plan.adaptive_passes)
+                    elif aa_mode == "dr":
+                        aaclip_plane[plane] = xaa_dr(aaclip_plane[plane], aa_type, aa_pass, cplace, snaa_plane[plane], nns, eediA, eediB, eediG, aa_sclip, aa_mcliph_plane, adaptive_passes=plan.adaptive_passes)
+                    elif aa_mode == "di":
+                        aaclip_plane[plane] = xaa_di(aaclip_plane[plane], aa_type, aa_pass, cplace, snaa_plane[plane], nns, eediA, eediB, eediG, aa_sclip, aa_mcliph_plane, adaptive_passes=plan.adaptive_passes)
+                    
+                        if not aa_delayresize_h:
+                            aaclip_plane[plane] = eval("core.resize." + dscl)(clip=aaclip_plane[plane],
+                                                                              width=ssh_pad_plane[plane],
+                                                                              height=ssw_pad_plane[plane],
+                                                                              src_left=0,
+                                                                              src_top=-0.5)
+                    
+                    aaclip_plane[plane] = _transpose(core, aaclip_plane[plane])
+                
+                if aa_v:
+                    if aa_mode == "sr":
+                        aaclip_plane[plane] = xaa_sr(aaclip_plane[plane], aa_type, aa_pass, cplace, snaa_plane[plane], nns, eediA, eediB, eediG, aa_sclip, aa_mclipv_plane, adaptive_passes=plan.adaptive_passes)
+                    elif aa_mode == "dr":
+                        aaclip_plane[plane] = xaa_dr(aaclip_plane[plane], aa_type, aa_pass, cplace, snaa_plane[plane], nns, eediA, eediB, eediG, aa_sclip, aa_mclipv_plane, adaptive_passes=plan.adaptive_passes)
+                    elif aa_mode == "di":
+                        aaclip_plane[plane] = xaa_di(aaclip_plane[plane], aa_type, aa_pass, cplace, snaa_plane[plane], nns, eediA, eediB, eediG, aa_sclip, aa_mclipv_plane, adaptive_passes=plan.adaptive_passes)
+                    
+                        if not aa_delayresize_v:
+                            aaclip_plane[plane] = eval("core.resize." + dscl)(clip=aaclip_plane[plane],
+                                                                              width=ssw_pad_plane[plane],
+                                                                              height=ssh_pad_plane[plane],
+                                                                              src_left=0,
+                                                                              src_top=-0.5)
+            if aainput.format.num_planes == 1:
+                aaclip = aaclip_plane[0]
+            else:
+                aaclip = _shuffle_planes(core, aaclip_plane, [0, 0, 0], aainput.format.color_family)
+
+        return aaclip
+
+
+    # Antialiases only the roi x roi tiles of rs1 that the final edge mask can take pixels from.
+    # For each frame, up to roi_slots of them are put side by side in a mosaic, each with roi_margin
+    # pixels of context around it, and the mosaic goes through a single antialiasing chain. The other
+    # tiles are copied from rs1, which is what rsaa would be there anyway. Frames with more tiles to
+    # antialias than the mosaic has room for use whole, the antialiased frame, instead.
+    def AntialiasTiles(whole):
+        roi_margin = plan.roi_margin
+        roi_slots = plan.roi_slots
+        tiles_x = (ssw + roi - 1) // roi
+        tiles_y = (ssh + roi - 1) // roi
+        tile_size = roi + roi_margin * 2
+
+        # Pad with duplicate pixels so that every tile, context included, is inside the frame and has the same size.
+        roi_pad_w = tiles_x * roi + roi_margin * 2
+        roi_pad_h = tiles_y * roi + roi_margin * 2
+        roi_pad = core.resize.Point(clip=rs1, width=roi_pad_w, height=roi_pad_h,
+                                    src_left=-roi_margin, src_top=-roi_margin, src_width=roi_pad_w, src_height=roi_pad_h)
+        if aa_mclip is not None:
+            roi_mclip = core.resize.Point(clip=aa_mclip, width=roi_pad_w, height=roi_pad_h,
+                                          src_left=-roi_margin, src_top=-roi_margin, src_width=roi_pad_w, src_height=roi_pad_h)
+
+        # The tiles are picked with the same mask that is used for the final merge.
+        emask = masks.get(rs2, mtype, temtype, mthr, planes, picture="input")
+        emask_planes = [_extract_plane(core, emask, plane) for plane in planes]
+
+        # How far from a tile rsaa can still pick up its pixels, in output pixels.
+        scale_x = ow / ssw
+        scale_y = oh / ssh
+        reach = 32 if plan.rsaa_isedi else 4
+        if csharp == 1:
+            reach += 1
+        reach_x = int(math.ceil(reach * max(1.0, scale_x))) + 1
+        reach_y = int(math.ceil(reach * max(1.0, scale_y))) + 1
+
+        tiles = []
+        tile_mclips = []
+        skipped = []
+        stats = []
+        for y in range(0, ssh, roi):
+            for x in range(0, ssw, roi):
+                tiles.append(core.std.CropAbs(clip=roi_pad, width=tile_size, height=tile_size, left=x, top=y))
+                skipped.append(core.std.CropAbs(clip=roi_pad, width=roi, height=roi, left=x + roi_margin, top=y + roi_margin))
+                if aa_mclip is not None:
+                    tile_mclips.append(core.std.CropAbs(clip=roi_mclip, width=tile_size, height=tile_size, left=x, top=y))
+
+                left = max(0, int(x * scale_x) - reach_x)
+                top = max(0, int(y * scale_y) - reach_y)
+                right = min(ow, int(math.ceil(min(x + roi, ssw) * scale_x)) + reach_x)
+                bottom = min(oh, int(math.ceil(min(y + roi, ssh) * scale_y)) + reach_y)
+
+                for plane, emask_plane in zip(planes, emask_planes):
+                    sub_w = emask.format.subsampling_w if plane > 0 else 0
+                    sub_h = emask.format.subsampling_h if plane > 0 else 0
+                    left_p = left >> sub_w
+                    top_p = top >> sub_h
+                    right_p = (right + (1 << sub_w) - 1) >> sub_w
+                    bottom_p = (bottom + (1 << sub_h) - 1) >> sub_h
+                    region = core.std.CropAbs(clip=emask_plane, width=right_p - left_p, height=bottom_p - top_p, left=left_p, top=top_p)
+                    stats.append(core.std.PlaneStats(clipa=region))
+
+        active = core.std.ModifyFrame(clip=stats[0], clips=stats, selector=functools.partial(_roi_active, per_tile=len(planes)))
+
+        mosaic = [core.std.FrameEval(clip=tiles[0], eval=functools.partial(_roi_slot, slot=slot, tiles=tiles), prop_src=active)
+                  for slot in range(roi_slots)]
+        mosaic = core.std.StackHorizontal(clips=mosaic) if len(mosaic) > 1 else mosaic[0]
+
+        if aa_mclip is not None:
+            mosaic_mclipv = [core.std.FrameEval(clip=tile_mclips[0], eval=functools.partial(_roi_slot, slot=slot, tiles=tile_mclips), prop_src=active)
+                             for slot in range(roi_slots)]
+            mosaic_mclipv = core.std.StackHorizontal(clips=mosaic_mclipv) if len(mosaic_mclipv) > 1 else mosaic_mclipv[0]
+            mosaic_mcliph = _transpose(core, mosaic_mclipv)
         else:
-            aaclip = aaclip.std.Crop(left=rs1_padL, top=rs1_padT, right=rs1_padR, bottom=rs1_padB)
+            mosaic_mclipv = None
+            mosaic_mcliph = None
+
+        done = Antialias(mosaic, mosaic_mcliph, mosaic_mclipv)
+        slots = [core.std.CropAbs(clip=done, width=roi, height=roi, left=slot * tile_size + roi_margin, top=roi_margin)
+                 for slot in range(roi_slots)]
+
+        rows = []
+        for row_start in range(0, len(tiles), tiles_x):
+            row = [core.std.FrameEval(clip=skipped[index], eval=functools.partial(_roi_select, index=index, skipped=skipped[index], slots=slots), prop_src=active)
+                   for index in range(row_start, row_start + tiles_x)]
+            rows.append(core.std.StackHorizontal(clips=row) if len(row) > 1 else row[0])
+
+        aaclip = core.std.StackVertical(clips=rows) if len(rows) > 1 else rows[0]
+        aaclip = core.std.Crop(clip=aaclip, right=tiles_x * roi - ssw, bottom=tiles_y * roi - ssh)
+
+        return core.std.FrameEval(clip=aaclip, eval=functools.partial(_roi_choose, unchanged=rs1, tiles=aaclip, whole=whole, slots=roi_slots), prop_src=active)
+
+
+    if aa_mode == "null":
+        aaclip = rs1
+    else:
+        aaclip = Antialias(rs1_pad, aa_mcliph, aa_mclipv)
+
+        # Crop the padding off
+        if rs1_addpad:
+            if aa_delayresize_h:
+                aaclip = _crop(core, aaclip, left=rs1_padL * 2, top=rs1_padT, right=rs1_padR * 2, bottom=rs1_padB)
+            elif aa_delayresize_v:
+                aaclip = _crop(core, aaclip, left=rs1_padL, top=rs1_padT * 2, right=rs1_padR, bottom=rs1_padB * 2)
+            else:
+                aaclip = _crop(core, aaclip, left=rs1_padL, top=rs1_padT, right=rs1_padR, bottom=rs1_padB)
+
+        if roi:
+            aaclip = AntialiasTiles(aaclip)
+
+    if aa_mode != "null":
+        aaclip = Stage(aaclip, "aa")
             
     
     ##### Apply contra-sharpening before scaling to the output resolution if csharp=1 #####
@@ -1227,74 +2179,17 @@ def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom",
         sharpdiff = core.std.MakeDiff(clipa=aaclip, clipb=aablur, planes=planes)
         repaired = core.rgvs.Repair(clip=sharpdiff, repairclip=aadiff, mode=13)
         aaclip = core.std.MergeDiff(clipa=aaclip, clipb=repaired, planes=planes)
+
+        aaclip = Stage(aaclip, "csharp")
     
-    
+
+
     ##### Scale the antialiased clip to the output resolution #####
-    
-    # rsaa_type and rsaa_isedi are defined earlier
-    if ow > aa_ow * 6 - 4:
-        rsaa_rfacX = 8
-    elif ow > aa_ow * 3 - 4:
-        rsaa_rfacX = 4
-    elif ow > aa_ow:
-        rsaa_rfacX = 2
-    else:
-        rsaa_rfacX = 1
-        
-    if oh > aa_oh * 6 - 4:
-        rsaa_rfacY = 8
-    elif oh > aa_oh * 3 - 4:
-        rsaa_rfacY = 4
-    elif oh > aa_oh:
-        rsaa_rfacY = 2
-    else:
-        rsaa_rfacY = 1
-        
-    if ow >= aa_ow * rsaa_rfacX or oh >= aa_oh * rsaa_rfacY:
-        rsaa_cshift = "Spline36"
-    else:
-        rsaa_cshift = dscl
-        
-    
-    # Center shift values for the rsaa resize if edi_rpow2 is used
-    if rsaa_isedi and rsaa_rfacX > 1:
-        if not hssc12 or chroma == 0:
-            rsaa_hshift = -0.5
-        else:
-            rsaa_hshift = -0.5 * (rsaa_rfacX - 1)
-    else:
-        rsaa_hshift = 0
-        
-    if rsaa_isedi and rsaa_rfacY > 1:
-        rsaa_vshift = -0.5
-    else:
-        rsaa_vshift = 0
-        
-    if rsaa_isedi and rsaa_rfacX > 1 and cplace == "MPEG1" and hssc12 and chroma:
-        rsaa_hshift_c = -0.5 * (rsaa_rfacX - 1) + rsaa_hshift
-    else:
-        rsaa_hshift_c = rsaa_hshift
-        
-    if rsaa_isedi and rsaa_rfacY > 1 and vssc12 and chroma:
-        rsaa_vshift_c = rsaa_vshift * 2.0
-    else:
-        rsaa_vshift_c = rsaa_vshift
-        
-    # Add center shift corrections from rs1 delay_cshift and aa_delayresize to the rsaa corrections
-    if rsaa_isedi:
-        rsaa_hshift = rsaa_hshift + rs1_hshift * rsaa_rfacX + aa_hshift * rsaa_rfacX
-        rsaa_vshift = rsaa_vshift + rs1_vshift * rsaa_rfacY + aa_vshift * rsaa_rfacY
-        rsaa_hshift_c = rsaa_hshift_c + rs1_hshift_c * rsaa_rfacX + aa_hshift_c * rsaa_rfacX
-        rsaa_vshift_c = rsaa_vshift_c + rs1_vshift_c * rsaa_rfacY + aa_vshift_c * rsaa_rfacY
-    else:
-        rsaa_hshift = rs1_hshift + aa_hshift
-        rsaa_vshift = rs1_vshift + aa_vshift
-        rsaa_hshift_c = rs1_hshift_c + aa_hshift_c
-        rsaa_vshift_c = rs1_vshift_c + aa_vshift_c
-        
-    rsaa_UVshift = rsaa_hshift != rsaa_hshift_c or rsaa_vshift != rsaa_vshift_c
-    
-    
+
+    aa_ow, aa_oh = plan.aa_ow, plan.aa_oh
+    rsaa_type, rsaa_isedi, rsaa_rfacX, rsaa_rfacY, rsaa_cshift = plan.rsaa_type, plan.rsaa_isedi, plan.rsaa_rfacX, plan.rsaa_rfacY, plan.rsaa_cshift
+
+
     # Reuse the eedi3 mclip mask from antialiasing
     if uscl == "eedi3" and eedimthr > 0:
         rsaa_mclip = aa_mclip
@@ -1305,98 +2200,29 @@ def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom",
     aaclip_y8 = aaclip
         
         
-    if ow == aa_ow and oh == aa_oh and not delay_cshift and not aa_delayresize_h and not aa_delayresize_v:
+    if ow == aa_ow and oh == aa_oh and plan.aa_shift == _no_shift:
         rsaa = aaclip_y8
-    elif rsaa_isedi and (delay_cshift or aa_delayresize_h or aa_delayresize_v):
+    elif rsaa_isedi and plan.aa_shift != _no_shift:
         rsaa = aaclip_y8
         rsaa = edi_rpow2(clip=rsaa, rfactorX=rsaa_rfacX, rfactorY=rsaa_rfacY, edi=rsaa_type, cplace=cplace, YV12cfix=False, alpha=eediA, beta=eediB, gamma=eediG, sclip=rs_sclip, mclip=rsaa_mclip)
-        if rsaa_UVshift:
-            rsaa = ResizeSeparately(clip=rsaa,
-                                    width=ow,
-                                    height=oh,
-                                    src_left=[rsaa_hshift, rsaa_hshift_c],
-                                    src_top=[rsaa_vshift, rsaa_vshift_c],
-                                    kernel=rsaa_cshift,
-                                    cplace=cplace)
-        else:
-            rsaa = eval("core.resize." + rsaa_cshift)(clip=rsaa,
-                                                      width=ow,
-                                                      height=oh,
-                                                      src_left=rsaa_hshift,
-                                                      src_top=rsaa_vshift,
-                                                      chromaloc_in_s=chromaloc,
-                                                      chromaloc_s=chromaloc)
+        rsaa = _shift_resize(core, rsaa, ow, oh, plan.rsaa_shift, rsaa_cshift, cplace, chromaloc)
     elif rsaa_isedi:
         rsaa = aaclip_y8
         rsaa = edi_rpow2(clip=rsaa, rfactorX=rsaa_rfacX, rfactorY=rsaa_rfacY, edi=rsaa_type, cshift=rsaa_cshift, fwidth=ow, fheight=oh, cplace=cplace, alpha=eediA, beta=eediB, gamma=eediG, sclip=rs_sclip, mclip=rsaa_mclip)
     else:
-        if rsaa_UVshift:
-            rsaa = ResizeSeparately(clip=aaclip_y8,
-                                    width=ow,
-                                    height=oh,
-                                    src_left=[rsaa_hshift, rsaa_hshift_c],
-                                    src_top=[rsaa_vshift, rsaa_vshift_c],
-                                    kernel=rsaa_cshift,
-                                    cplace=cplace)
-        else:
-            rsaa = eval("core.resize." + rsaa_cshift)(clip=aaclip_y8,
-                                                      width=ow,
-                                                      height=oh,
-                                                      src_left=rsaa_hshift,
-                                                      src_top=rsaa_vshift,
-                                                      chromaloc_in_s=chromaloc,
-                                                      chromaloc_s=chromaloc)
+        rsaa = _shift_resize(core, aaclip_y8, ow, oh, plan.rsaa_shift, rsaa_cshift, cplace, chromaloc)
             
     
     # Make sure the rsaa clip has the same chroma sampling as the input
-    # rsaa is either the same format as the input clip (when chroma is not 0), or it is GRAY (when chroma is 0)
+    # rsaa is either the same format as the input clip (when chroma is not 0), or it is GRAY (when chroma is 0).
+    # The chroma of rsaa is never used then, so it's taken from rs2 instead of converting the format.
     if rsaa.format.id != clip.format.id:
-        rsaa = core.resize.Bicubic(clip=rsaa, format=clip.format.id)
-    
-    
-    ##### Scale the input clip to the output resolution without antialiasing for masking and chroma #####
-    
-    if ow > iw * 6 - 4:
-        rs2_rfacX = 8
-    elif ow > iw * 3 - 4:
-        rs2_rfacX = 4
-    elif ow > iw:
-        rs2_rfacX = 2
-    else:
-        rs2_rfacX = 1
-        
-    if oh > ih * 6 - 4:
-        rs2_rfacY = 8
-    elif oh > ih * 3 - 4:
-        rs2_rfacY = 4
-    elif oh > ih:
-        rs2_rfacY = 2
-    else:
-        rs2_rfacY = 1
-        
-    if ow >= iw * rs2_rfacX and oh >= ih * rs2_rfacY:
-        rs2_cshift = "Spline36"
-    else:
-        rs2_cshift = dscl
-        
-    
-    if ow == iw and oh == ih:
-        rs2 = clip
-    elif rs2_isedi:
-        rs2 = clip
-        # The Avisynth version had rfactorY=rs1_rfacY and rs2_rfacY was never used.
-        rs2 = edi_rpow2(clip=rs2, rfactorX=rs2_rfacX, rfactorY=rs2_rfacY, edi=rs2_type, cshift=rs2_cshift, fwidth=ow, fheight=oh, cplace=cplace, alpha=eediA, beta=eediB, gamma=eediG, sclip=rs_sclip, mclip=rs12_mclip)
-    else:
-        rs2 = eval("core.resize." + rs2_type)(clip=clip,
-                                              width=ow,
-                                              height=oh,
-                                              chromaloc_in_s=chromaloc,
-                                              chromaloc_s=chromaloc)
-        
-    
-    
-    
+        rsaa = _shuffle_planes(core, [rsaa, rs2, rs2], [0, 1, 2], clip.format.color_family)
+
+    if rsaa is not aaclip:
+        rsaa = Stage(rsaa, "rsaa")
     
+
     ##### Apply contra-sharpening after scaling to the output resolution if csharp=2 #####
     
     if csharp == 2:
@@ -1412,25 +2238,15 @@ def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom",
         repaired = core.rgvs.Repair(clip=sharpdiff, repairclip=aadiff, mode=[13, UVrp, UVrp])
         rsaa = core.std.MergeDiff(clipa=rsaa, clipb=repaired, planes=planes)
         
+        rsaa = Stage(rsaa, "csharp")
+        
     
     ##### Masking, chroma merging, and output #####
     
-    # Reuse the eedi3 mclip mask from the rs1 and rs2 resizes if it's the same
-    if rs12_mclip is not None and mthr == eedimthr and iw == ow and ih == oh:
-        emask = rs12_mclip
-    else:
-        if mtype == "TEdgeMask":
-            emask = rs2.tedgemask.TEdgeMask(threshold=mthr, type=temtype, link=0, planes=planes)
-        elif mtype == "TCanny":
-            emask = rs2.tcanny.TCanny(t_h=mthr, t_l=mthr, planes=planes, op=0)
-            emask = emask.std.Maximum(planes=planes, coordinates=mt_expand_mode_both).std.Inflate(planes=planes)
-            emask = emask.std.Minimum(planes=planes, coordinates=mt_expand_mode_both)
-        elif mtype == "Prewitt":
-            emask = rs2.std.Prewitt(planes=planes).std.Binarize(threshold=(mthr + 1) << (rs2.format.bits_per_sample - 8), planes=planes)
-        elif mtype == "Sobel":
-            emask = rs2.std.Sobel(planes=planes).std.Binarize(threshold=(mthr + 1) << (rs2.format.bits_per_sample - 8), planes=planes)
+    # This reuses the eedi3 mclip masks if they're the same.
+    emask = masks.get(rs2, mtype, temtype, mthr, planes, picture="input")
             
-        emask = emask.std.Inflate(planes=planes)
+    emask = Stage(emask, "emask")
     
     
     # 8-bit version of the rs2 clip for masking
@@ -1450,7 +2266,7 @@ def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom",
         eover = rs2
         overlay = rs2
     eover = core.std.Expr(clips=eover, expr=["", "x 2 /"])
-    overlay = core.std.MaskedMerge(clipa=overlay, clipb=eover, mask=core.std.ShufflePlanes(clips=emask, planes=0, colorfamily=vs.GRAY), first_plane=True)
+    overlay = core.std.MaskedMerge(clipa=overlay, clipb=eover, mask=_extract_plane(core, emask, 0), first_plane=True)
     
     if is422(clip):
         overlay = overlay.resize.Bicubic(format=core.query_video_format(color_family=overlay.format.color_family,
@@ -1471,18 +2287,34 @@ def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom",
         if isGray(clip) or chroma == 1:
             merged = rsaa
         elif chroma == 0:
-            merged = core.std.ShufflePlanes(clips=[rsaa, rs2, rs2], planes=[0, 1, 2], colorfamily=rsaa.format.color_family)
+            merged = _shuffle_planes(core, [rsaa, rs2, rs2], [0, 1, 2], rsaa.format.color_family)
         elif chroma == 2:
-            merged = core.std.ShufflePlanes(clips=[rs2, rsaa, rsaa], planes=[0, 1, 2], colorfamily=rsaa.format.color_family)
+            merged = _shuffle_planes(core, [rs2, rsaa, rsaa], [0, 1, 2], rsaa.format.color_family)
     elif mask == 1:
         merged = core.std.MaskedMerge(clipa=rs2, clipb=rsaa, mask=emask, planes=merge_planes)
     elif mask == 2:
         merged = core.std.MaskedMerge(clipa=rsaa, clipb=rs2, mask=emask, planes=merge_planes)
         
         if chroma == 0:
-            merged = core.std.ShufflePlanes(clips=[merged, rs2, rs2], planes=[0, 1, 2], colorfamily=merged.format.color_family)
+            merged = _shuffle_planes(core, [merged, rs2, rs2], [0, 1, 2], merged.format.color_family)
         elif chroma == 2:
-            merged = core.std.ShufflePlanes(clips=[rs2, merged, merged], planes=[0, 1, 2], colorfamily=merged.format.color_family)
+            merged = _shuffle_planes(core, [rs2, merged, merged], [0, 1, 2], merged.format.color_family)
+
+    # The merges take the frame properties from rs2 when the mask is applied.
+    if plan.adaptive_passes > 0 and aa_mode != "null" and merged is not rsaa:
+        merged = core.std.ModifyFrame(clip=merged, clips=[merged, rsaa], selector=_copy_passes)
+
+    # Serve the frames with few edges straight from rs2, so that nothing else is requested for them.
+    if plan.skip_below > 0:
+        coverage = emask
+        for plane in planes:
+            coverage = core.std.PlaneStats(clipa=coverage, plane=plane, prop="XaaCoverage{}".format(plane))
+
+        bypassed = core.std.SetFrameProps(clip=rs2, XaaBypassed=1)
+        if plan.adaptive_passes > 0:
+            bypassed = core.std.SetFrameProps(clip=bypassed, XaaPasses=0)
+        processed = core.std.SetFrameProps(clip=merged, XaaBypassed=0)
+        merged = core.std.FrameEval(clip=processed, eval=functools.partial(_skip_select, bypassed=bypassed, processed=processed, planes=planes, threshold=plan.skip_below), prop_src=coverage)
     
     
     if mask < 0:
@@ -1490,15 +2322,93 @@ def xaa(clip, ow=None, oh=None, ss=None, ssw=None, ssh=None, mode="sr SangNom",
     else:
         output = merged
         
-    return output
+    # Before dedupe, so that the cached frames only depend on the input frame they're keyed on.
+    if disk_cache is not None:
+        output = disk_cache.wrap(clip, output, (plan, _get_backend()))
 
+    # A frame that repeats one of the previous few input frames gets the output of the earliest
+    # of them, which is held on to, instead of going through the whole chain again. That output
+    # was itself reused if its frame was a repeat, so a held frame goes through the chain once.
+    dedupe_window = min(plan.dedupe, clip.num_frames - 1)
+    if dedupe_window > 0:
+        # The frames are compared at 1/8 of the size, and all the planes count because the output has all of them.
+        modw = 1 << clip.format.subsampling_w
+        modh = 1 << clip.format.subsampling_h
+        small = core.resize.Bilinear(clip=clip, width=max(modw, iw // 8 // modw * modw), height=max(modh, ih // 8 // modh * modh))
 
-##### Recursive functions for multipass antialiasing #####
-# TODO move these functions inside xaa
-# maybe?
+        diffs = small
+        for k in range(1, dedupe_window + 1):
+            small_k = small[0] * k + small[:-k]
+            for plane in range(clip.format.num_planes):
+                diffs = core.std.PlaneStats(clipa=diffs, clipb=small_k, plane=plane, prop="XaaDup{}_{}".format(k, plane))
 
-def xaa_sr(clip, type="SangNom", passes=1, cplace="MPEG2", snaa=48, nns=1, alpha=0.2, beta=0.25, gamma=20.0, sclip="", mclip=None, f=1):
-    core = vs.core
+        # The repeats go back through the deduped output, which only exists once the FrameEval
+        # is made, so earlier is filled in afterwards.
+        earlier = []
+        held = _DedupeFrames(dedupe_window + 1)
+
+        # The held frames are returned by a ModifyFrame on a blank clip for each distance, so that nothing is requested for them.
+        pins = _FramePins()
+        blank = core.std.BlankClip(clip=output, keep=True)
+        reused = [core.std.ModifyFrame(clip=blank, clips=blank, selector=functools.partial(_dedupe_reuse, pins, k)) for k in range(1, dedupe_window + 1)]
+
+        output = core.std.SetFrameProps(clip=output, XaaReused=0)
+        output = core.std.FrameEval(clip=output, eval=functools.partial(_dedupe_select, current=output, earlier=earlier, held=held, reused=reused, pins=pins,
+                                                                        num_planes=clip.format.num_planes, threshold=plan.dedupe_thr, counters=counters), prop_src=diffs)
+        output = core.std.ModifyFrame(clip=output, clips=output, selector=functools.partial(_dedupe_keep, held))
+
+        for k in range(1, dedupe_window + 1):
+            earlier.append(core.std.SetFrameProps(clip=output[0] * k + output[:-k], XaaReused=k))
+
+    if profile is not None:
+        output = profile.probe(output, "output")
+
+    if counters is not None:
+        counters._add_transposes(_local.transposes.removed)
+
+    return output
+
+
+# Allows xaa.plan(...) after "from xaa import xaa".
+xaa.plan = xaa_plan
+
+
+##### Recursive functions for multipass antialiasing #####
+# TODO move these functions inside xaa
+# maybe?
+
+# With adaptive_passes, a pass is skipped for the frames that the previous pass changed by less than
+# adaptive_passes, and so are all the passes after it. p counts the passes and should be left at 1.
+
+# Marks aa as pass number count over clip and measures how much it changed clip, for the next pass.
+# From the second pass on, the frames where the previous pass changed little come from clip instead.
+def _adaptive_pass(core, clip, aa, count, tolerance):
+    aa = core.std.SetFrameProps(clip=aa, XaaPasses=count)
+
+    # The first pass of xaa_di doubles the height, so there is nothing to compare it with.
+    if aa.width == clip.width and aa.height == clip.height:
+        aa = core.std.PlaneStats(clipa=aa, clipb=clip, prop="XaaPass")
+    else:
+        aa = core.std.RemoveFrameProps(clip=aa, props=["XaaPassDiff"])
+
+    if count > 1:
+        aa = core.std.FrameEval(clip=aa, eval=functools.partial(_pass_select, previous=clip, current=aa, threshold=tolerance), prop_src=clip)
+
+    return aa
+
+
+@_with_backend
+def xaa_sr(clip, type="SangNom", passes=1, cplace="MPEG2", snaa=48, nns=1, alpha=0.2, beta=0.25, gamma=20.0, sclip="", mclip=None, f=1, adaptive_passes=0.0, p=1, backend=None):
+    core = _get_core()
+
+    # Translate the cplace parameter into values understood by the VapourSynth resizers.
+    if cplace == "MPEG1":
+        chromaloc = "center"
+    elif cplace == "MPEG2":
+        chromaloc = "left"
+
+    if type not in _interpolators:
+        raise ValueError("xaa_sr: invalid antialiasing type '{}'.".format(type))
 
     iw = clip.width
     ih = clip.height
@@ -1506,27 +2416,9 @@ def xaa_sr(clip, type="SangNom", passes=1, cplace="MPEG2", snaa=48, nns=1, alpha
     # Alternate the field every pass, starting with 1 by default
     field = f % 2
     
-    if field == 1:
-        snfield = 1
-    else:
-        snfield = 2
-        
     if clip.format.num_planes > 1:
         snaa = [snaa, 0, 0]
         
-    # SeparateFields will throw an error from mod2 heights if the input is YV12,
-    # so don't define sf unless it's needed, in which case the resolution will have been padded to mod4.
-    pad8 = type == "eedi2" or (type == "eedi3" and sclip not in ["", "SangNom", "znedi3", "nnedi3cl"])
-    
-    if pad8:
-        sf = clip.std.SeparateFields(tff=True).std.RemoveFrameProps(props=["_Field"])
-        if field == 1:
-            sf = sf.std.SelectEvery(cycle=2, offsets=0)
-        else:
-            sf = sf.std.SelectEvery(cycle=2, offsets=1)
-    else:
-        sf = None
-        
     # Use a src_top shift dependent on the field when resizing for the sclip to keep it in alignment with the eedi3 clip.
     # Additionally, the vertical shift for YV12 chroma is doubled, so the chroma must be resized separately.
     if field == 1:
@@ -1534,19 +2426,14 @@ def xaa_sr(clip, type="SangNom", passes=1, cplace="MPEG2", snaa=48, nns=1, alpha
     else:
         rshift = -0.25
     
-        
+    # SeparateFields will throw an error from mod2 heights if the input is YV12,
+    # so the fields are only separated when needed, in which case the resolution will have been padded to mod4.
     if sclip == "":
         sclip2 = None
-    elif sclip == "SangNom":
-        sclip2 = clip.sangnom.SangNom(order=snfield, aa=snaa)
-    elif sclip == "znedi3":
-        sclip2 = clip.znedi3.nnedi3(field=field, nns=nns)
-    elif sclip == "nnedi3cl":
-        sclip2 = clip.nnedi3cl.NNEDI3CL(field=field, nns=nns)
-    elif sclip == "eedi2":
-        sclip2 = sf.eedi2.EEDI2(field=field)
+    elif sclip in _interpolators:
+        sclip2 = _interpolate(core, sclip, clip, field, aa=snaa, nns=nns)
     elif is420(clip):
-        sclip2 = ResizeSeparately(clip=sf,
+        sclip2 = ResizeSeparately(clip=_separate_fields(core, clip, field),
                                   width=iw,
                                   height=ih,
                                   src_left=[0, 0],
@@ -1554,7 +2441,7 @@ def xaa_sr(clip, type="SangNom", passes=1, cplace="MPEG2", snaa=48, nns=1, alpha
                                   kernel=sclip,
                                   cplace=cplace)
     else:
-        sclip2 = eval("core.resize." + sclip)(clip=sf,
+        sclip2 = eval("core.resize." + sclip)(clip=_separate_fields(core, clip, field),
                                               width=iw,
                                               height=ih,
                                               src_left=0,
@@ -1562,29 +2449,30 @@ def xaa_sr(clip, type="SangNom", passes=1, cplace="MPEG2", snaa=48, nns=1, alpha
                                               chromaloc_in_s=chromaloc,
                                               chromaloc_s=chromaloc)
         
+    aa = _interpolate(core, type, clip, field, aa=snaa, nns=nns, alpha=alpha, beta=beta, gamma=gamma, sclip=sclip2, mclip=mclip)
     
-    if type == "SangNom":
-        aa = clip.sangnom.SangNom(order=snfield, aa=snaa)
-    elif type == "znedi3":
-        aa = clip.znedi3.nnedi3(field=field, nns=nns)
-    elif type == "nnedi3cl":
-        aa = clip.nnedi3cl.NNEDI3CL(field=field, nns=nns)
-    elif type == "eedi3":
-        aa = clip.eedi3m.EEDI3(field=field, alpha=alpha, beta=beta, gamma=gamma, sclip=sclip2, mclip=mclip)
-    elif type == "eedi2":
-        aa = sf.eedi2.EEDI2(field=field)
-    else:
-        raise ValueError("xaa_sr: invalid antialiasing type '{}'.".format(type))
+    if adaptive_passes > 0:
+        aa = _adaptive_pass(core, clip, aa, p, adaptive_passes)
     
     if passes > 0:
-        return xaa_sr(clip=aa, type=type, passes=passes - 1, cplace=cplace, snaa=snaa, nns=nns, alpha=alpha, beta=beta, gamma=gamma, sclip=sclip, mclip=mclip, f=f + 1)
+        return xaa_sr(clip=aa, type=type, passes=passes - 1, cplace=cplace, snaa=snaa, nns=nns, alpha=alpha, beta=beta, gamma=gamma, sclip=sclip, mclip=mclip, f=f + 1, adaptive_passes=adaptive_passes, p=p + 1)
     else:
         return clip
     
 
 
-def xaa_dr(clip, type="znedi3", passes=1, cplace="MPEG2", snaa=48, nns=1, alpha=0.2, beta=0.25, gamma=20.0, sclip="", mclip=None):
-    core = vs.core
+@_with_backend
+def xaa_dr(clip, type="znedi3", passes=1, cplace="MPEG2", snaa=48, nns=1, alpha=0.2, beta=0.25, gamma=20.0, sclip="", mclip=None, adaptive_passes=0.0, p=1, backend=None):
+    core = _get_core()
+
+    # Translate the cplace parameter into values understood by the VapourSynth resizers.
+    if cplace == "MPEG1":
+        chromaloc = "center"
+    elif cplace == "MPEG2":
+        chromaloc = "left"
+
+    if type not in _interpolators:
+        raise ValueError("xaa_dr: invalid antialiasing type '{}'.".format(type))
 
     iw = clip.width
     ih = clip.height
@@ -1592,87 +2480,66 @@ def xaa_dr(clip, type="znedi3", passes=1, cplace="MPEG2", snaa=48, nns=1, alpha=
     if clip.format.num_planes > 1:
         snaa = [snaa, 0, 0]
     
-    pad8 = type == "eedi2" or (type == "eedi3" and sclip not in ["", "SangNom", "znedi3", "nnedi3cl"])
-    
-    if pad8:
-        sf = clip.std.SeparateFields(tff=True).std.RemoveFrameProps(props=["_Field"])
-        tf = sf.std.SelectEvery(cycle=2, offsets=0)
-        bf = sf.std.SelectEvery(cycle=2, offsets=1)
-    else:
-        sf = None
-        tf = None
-        bf = None
-        
+    # Both fields of every frame are interpolated, each at the clip's own rate, and blended
+    # right away, so no double rate clip has to go through the cache.
     if sclip == "":
-        sclip2 = None
-    elif sclip == "SangNom":
-        sclip2 = core.std.Interleave(clips=[core.sangnom.SangNom(clip=clip, order=1, aa=snaa),
-                                            core.sangnom.SangNom(clip=clip, order=2, aa=snaa)])
-    elif sclip == "znedi3":
-        sclip2 = clip.znedi3.nnedi3(field=3, nns=nns)
-    elif sclip == "nnedi3cl":
-        sclip2 = clip.nnedi3cl.NNEDI3CL(field=3, nns=nns)
-    elif sclip == "eedi2":
-        sclip2 = sf.eedi2.EEDI2(field=3)
-    elif is420(clip):
-        sclip2 = core.std.Interleave(clips=[ResizeSeparately(clip=tf,
-                                                             width=iw,
-                                                             height=ih,
-                                                             src_left=[0, 0],
-                                                             src_top=[0.25, 0.5],
-                                                             kernel=sclip,
-                                                             cplace=cplace),
-                                            ResizeSeparately(clip=bf,
-                                                             width=iw,
-                                                             height=ih,
-                                                             src_left=[0, 0],
-                                                             src_top=[-0.25, -0.5],
-                                                             kernel=sclip,
-                                                             cplace=cplace)])
-    else:
-        sclip2 = core.std.Interleave(clips=[eval("core.resize." + sclip)(clip=tf,
-                                                                         width=iw,
-                                                                         height=ih,
-                                                                         src_left=0,
-                                                                         src_top=0.25,
-                                                                         chromaloc_in_s=chromaloc,
-                                                                         chromaloc_s=chromaloc),
-                                            eval("core.resize." + sclip)(clip=bf,
-                                                                         width=iw,
-                                                                         height=ih,
-                                                                         src_left=0,
-                                                                         src_top=-0.25,
-                                                                         chromaloc_in_s=chromaloc,
-                                                                         chromaloc_s=chromaloc)])
-    
-    
-    if type == "SangNom":
-        aa = core.std.Interleave(clips=[core.sangnom.SangNom(clip=clip, order=1, aa=snaa),
-                                        core.sangnom.SangNom(clip=clip, order=2, aa=snaa)])
-    elif type == "znedi3":
-        aa = clip.znedi3.nnedi3(field=3, nns=nns)
-    elif type == "nnedi3cl":
-        aa = clip.nnedi3cl.NNEDI3CL(field=3, nns=nns)
-    elif type == "eedi3":
-        aa = clip.eedi3m.EEDI3(field=3, alpha=alpha, beta=beta, gamma=gamma, sclip=sclip2, mclip=mclip)
-    elif type == "eedi2":
-        aa = sf.eedi2.EEDI2(field=3)
+        sclip_top = None
+        sclip_bottom = None
+    elif sclip in _interpolators:
+        sclip_top = _interpolate(core, sclip, clip, 1, aa=snaa, nns=nns)
+        sclip_bottom = _interpolate(core, sclip, clip, 0, aa=snaa, nns=nns)
     else:
-        raise ValueError("xaa_dr: invalid antialiasing type '{}'.".format(type))
+        tf = _separate_fields(core, clip, 1)
+        bf = _separate_fields(core, clip, 0)
     
-    aa = core.std.Merge(clipa=aa.std.SelectEvery(cycle=2, offsets=0),
-                        clipb=aa.std.SelectEvery(cycle=2, offsets=1),
+        if is420(clip):
+            sclip_top = ResizeSeparately(clip=tf,
+                                         width=iw,
+                                         height=ih,
+                                         src_left=[0, 0],
+                                         src_top=[0.25, 0.5],
+                                         kernel=sclip,
+                                         cplace=cplace)
+            sclip_bottom = ResizeSeparately(clip=bf,
+                                            width=iw,
+                                            height=ih,
+                                            src_left=[0, 0],
+                                            src_top=[-0.25, -0.5],
+                                            kernel=sclip,
+                                            cplace=cplace)
+        else:
+            sclip_top = eval("core.resize." + sclip)(clip=tf,
+                                                     width=iw,
+                                                     height=ih,
+                                                     src_left=0,
+                                                     src_top=0.25,
+                                                     chromaloc_in_s=chromaloc,
+                                                     chromaloc_s=chromaloc)
+            sclip_bottom = eval("core.resize." + sclip)(clip=bf,
+                                                        width=iw,
+                                                        height=ih,
+                                                        src_left=0,
+                                                        src_top=-0.25,
+                                                        chromaloc_in_s=chromaloc,
+                                                        chromaloc_s=chromaloc)
+        
+    aa = core.std.Merge(clipa=_interpolate(core, type, clip, 1, aa=snaa, nns=nns, alpha=alpha, beta=beta, gamma=gamma, sclip=sclip_top, mclip=mclip),
+                        clipb=_interpolate(core, type, clip, 0, aa=snaa, nns=nns, alpha=alpha, beta=beta, gamma=gamma, sclip=sclip_bottom, mclip=mclip),
                         weight=0.5)
     
+    if adaptive_passes > 0:
+        aa = _adaptive_pass(core, clip, aa, p, adaptive_passes)
+    
     if passes > 0:
-        return xaa_dr(clip=aa, type=type, passes=passes - 1, cplace=cplace, snaa=snaa, nns=nns, alpha=alpha, beta=beta, gamma=gamma, sclip=sclip, mclip=mclip)
+        return xaa_dr(clip=aa, type=type, passes=passes - 1, cplace=cplace, snaa=snaa, nns=nns, alpha=alpha, beta=beta, gamma=gamma, sclip=sclip, mclip=mclip, adaptive_passes=adaptive_passes, p=p + 1)
     else:
         return clip
 
     
     
-def xaa_di(clip, type="znedi3", passes=1, cplace="MPEG2", snaa=48, nns=1, alpha=0.2, beta=0.25, gamma=20.0, sclip="", mclip=None, f=1, dh=True):
-    core = vs.core
+@_with_backend
+def xaa_di(clip, type="znedi3", passes=1, cplace="MPEG2", snaa=48, nns=1, alpha=0.2, beta=0.25, gamma=20.0, sclip="", mclip=None, f=1, dh=True, adaptive_passes=0.0, p=1, backend=None):
+    core = _get_core()
 
     # Translate the cplace parameter into values understood by the VapourSynth resizers.
     if cplace == "MPEG1":
@@ -1680,6 +2547,9 @@ def xaa_di(clip, type="znedi3", passes=1, cplace="MPEG2", snaa=48, nns=1, alpha=
     elif cplace == "MPEG2":
         chromaloc = "left"
 
+    if type not in _interpolators:
+        raise ValueError("xaa_di: invalid antialiasing type '{}'.".format(type))
+
     iw = clip.width
     ih = clip.height
     
@@ -1687,76 +2557,36 @@ def xaa_di(clip, type="znedi3", passes=1, cplace="MPEG2", snaa=48, nns=1, alpha=
     # Don't change the f value from the default or else the center shift correction will be wrong.
     field = f % 2
     
-    if field == 1:
-        snfield = 1
-    else:
-        snfield = 2
-        
     if clip.format.num_planes > 1:
         snaa = [snaa, 0, 0]
         
-    pad8 = type == "eedi2" or (type == "eedi3" and sclip not in ["", "SangNom", "znedi3", "nnedi3cl"])
-    
-    if pad8:
-        sf = clip.std.SeparateFields(tff=True).std.RemoveFrameProps(props=["_Field"])
-        if field == 1:
-            sf = sf.std.SelectEvery(cycle=2, offsets=0)
-        else:
-            sf = sf.std.SelectEvery(cycle=2, offsets=1)
-    else:
-        sf = None
-        
     if field == 1:
         rshift = 0.25
     else:
         rshift = -0.25
         
+    # The resized sclip comes from the whole frame when doubling the height, otherwise from a single field.
+    if dh:
+        rsclip = clip
+    else:
+        rsclip = _separate_fields(core, clip, field)
+        
     if sclip == "":
         sclip2 = None
-    elif sclip == "SangNom":
-        sclip2 = clip
-        if dh:
-            sclip2 = core.resize.Point(clip=sclip2, width=iw, height=ih * 2, chromaloc_in_s=chromaloc, chromaloc_s=chromaloc)
-        sclip2 = sclip2.sangnom.SangNom(order=snfield, aa=snaa)
-    elif sclip == "znedi3":
-        sclip2 = clip.znedi3.nnedi3(field=field, dh=dh, nns=nns)
-    elif sclip == "nnedi3cl":
-        sclip2 = clip.nnedi3cl.NNEDI3CL(field=field, dh=dh, nns=nns)
-    elif sclip == "eedi2":
-        if dh:
-            sclip2 = clip.eedi2.EEDI2(field=field)
-        else:
-            sclip2 = sf.eedi2.EEDI2(field=field)
+    elif sclip in _interpolators:
+        sclip2 = _interpolate(core, sclip, clip, field, dh=dh, aa=snaa, nns=nns, chromaloc=chromaloc)
     elif is420(clip):
-        if dh:
-            sclip2 = ResizeSeparately(clip=clip,
-                                      width=iw,
-                                      height=ih * 2,
-                                      src_left=[0, 0],
-                                      src_top=[rshift, rshift * 2],
-                                      kernel=sclip,
-                                      cplace=cplace)
-        else:
-            sclip2 = ResizeSeparately(clip=sf,
-                                      width=iw,
-                                      height=ih * 2,
-                                      src_left=[0, 0],
-                                      src_top=[rshift, rshift * 2],
-                                      kernel=sclip,
-                                      cplace=cplace)
-    else:
-        if dh:
-            sclip2 = eval("core.resize." + sclip)(clip=clip,
-                                              width=iw,
-                                              height=ih * 2,
-                                              src_left=0,
-                                              src_top=rshift,
-                                              chromaloc_in_s=chromaloc,
-                                              chromaloc_s=chromaloc)
-        else:
-            sclip2 = eval("core.resize." + sclip)(clip=sf,
+        sclip2 = ResizeSeparately(clip=rsclip,
+                                  width=iw,
+                                  height=ih * 2 if dh else ih,
+                                  src_left=[0, 0],
+                                  src_top=[rshift, rshift * 2],
+                                  kernel=sclip,
+                                  cplace=cplace)
+    else:
+        sclip2 = eval("core.resize." + sclip)(clip=rsclip,
                                               width=iw,
-                                              height=ih,
+                                              height=ih * 2 if dh else ih,
                                               src_left=0,
                                               src_top=rshift,
                                               chromaloc_in_s=chromaloc,
@@ -1764,28 +2594,10 @@ def xaa_di(clip, type="znedi3", passes=1, cplace="MPEG2", snaa=48, nns=1, alpha=
             
     
     # The height is only doubled on the first pass
-    if type == "SangNom":
-        aa = clip
-        if dh:
-            aa = core.resize.Point(clip=aa,
-                                   width=iw,
-                                   height=ih * 2,
-                                   chromaloc_in_s=chromaloc,
-                                   chromaloc_s=chromaloc)
-        aa = aa.sangnom.SangNom(order=snfield, aa=snaa)
-    elif type == "znedi3":
-        aa = clip.znedi3.nnedi3(field=field, dh=dh, nns=nns)
-    elif type == "nnedi3cl":
-        aa = clip.nnedi3cl.NNEDI3CL(field=field, dh=dh, nns=nns)
-    elif type == "eedi3":
-        aa = clip.eedi3m.EEDI3(field=field, dh=dh, alpha=alpha, beta=beta, gamma=gamma, sclip=sclip2, mclip=mclip)
-    elif type == "eedi2":
-        if dh:
-            aa = clip.eedi2.EEDI2(field=field)
-        else:
-            aa = sf.eedi2.EEDI2(field=field)
-    else:
-        raise ValueError("xaa_di: invalid antialiasing type '{}'.".format(type))
+    aa = _interpolate(core, type, clip, field, dh=dh, aa=snaa, nns=nns, alpha=alpha, beta=beta, gamma=gamma, sclip=sclip2, mclip=mclip, chromaloc=chromaloc)
+
+    if adaptive_passes > 0:
+        aa = _adaptive_pass(core, clip, aa, p, adaptive_passes)
 
 
     # Double the height of the mclip for passes after the first.
@@ -1807,9 +2619,766 @@ def xaa_di(clip, type="znedi3", passes=1, cplace="MPEG2", snaa=48, nns=1, alpha=
                                          chromaloc_in_s=chromaloc,
                                          chromaloc_s=chromaloc)
         
-        mclip = mclip.std.Binarize(planes=planes)
+        mclip = mclip.std.Binarize()
         
     if passes > 0:
-        return xaa_di(clip=aa, type=type, passes=passes - 1, cplace=cplace, snaa=snaa, nns=nns, alpha=alpha, beta=beta, gamma=gamma, sclip=sclip, mclip=mclip, f=f + 1, dh=False)
+        return xaa_di(clip=aa, type=type, passes=passes - 1, cplace=cplace, snaa=snaa, nns=nns, alpha=alpha, beta=beta, gamma=gamma, sclip=sclip, mclip=mclip, f=f + 1, dh=False, adaptive_passes=adaptive_passes, p=p + 1)
     else:
         return clip
+
+
+
+##### Stand-in plugins #####
+
+# These replace the external plugins when the backend is "standin". They take
+# the same parameters and return clips with the same format, dimensions, and
+# number of frames, but only use std and resize filters. The missing lines are
+# interpolated with Spline36 and the edge masks come from Sobel, so the output
+# only shows whether the geometry is right, and the speed only measures what
+# surrounds the plugins. Parameters that only tune the plugins are ignored.
+
+def _standin_threshold(clip, threshold):
+    # The plugins' thresholds are on the 8 bit scale.
+    if clip.format.sample_type == vs.FLOAT:
+        return threshold / 255.0
+    return threshold * (1 << (clip.format.bits_per_sample - 8))
+
+
+# Keeps the top (field=1) or bottom (field=0) field and interpolates the other one.
+# With dh=True, clip is a single field and the result is twice as tall.
+def _standin_field(core, clip, field, dh):
+    if not dh:
+        clip = core.std.SeparateFields(clip=clip, tff=True)
+        clip = core.std.RemoveFrameProps(clip=clip, props=["_Field"])
+        clip = core.std.SelectEvery(clip=clip, cycle=2, offsets=0 if field == 1 else 1)
+
+    return core.resize.Spline36(clip=clip, width=clip.width, height=clip.height * 2, src_left=0, src_top=0.25 if field == 1 else -0.25)
+
+
+# Calls process(clip, field) on the given planes, one plane at a time when the planes
+# have different sizes, like the plugins do. The other planes are copied.
+# Fields 2 and 3 are double rate, starting with the bottom and the top field respectively.
+def _standin_interpolate(core, clip, field, planes, process):
+    if field > 1:
+        first = _standin_interpolate(core, clip, field - 2, planes, process)
+        second = _standin_interpolate(core, clip, 3 - field, planes, process)
+        return core.std.Interleave(clips=[first, second])
+
+    fmt = clip.format
+
+    if planes is None:
+        planes = list(range(fmt.num_planes))
+    elif isinstance(planes, int):
+        planes = [planes]
+
+    if fmt.num_planes == 1:
+        if 0 in planes:
+            return process(clip, field)
+        return clip
+
+    if fmt.subsampling_w == 0 and fmt.subsampling_h == 0 and len(planes) == fmt.num_planes:
+        return process(clip, field)
+
+    result = []
+    for plane in range(fmt.num_planes):
+        p = _extract_plane(core, clip, plane)
+        if plane in planes:
+            p = process(p, field)
+        result.append(p)
+
+    return _shuffle_planes(core, result, [0, 0, 0], fmt.color_family)
+
+
+def _standin_sangnom(core, clip, order=1, dh=False, aa=None, planes=None, **tuning):
+    # order 0 is double rate, top field first.
+    field = {0: 3, 1: 1, 2: 0}[order]
+
+    return _standin_interpolate(core, clip, field, None if dh else planes, lambda p, f: _standin_field(core, p, f, dh))
+
+
+def _standin_nnedi3(core, clip, field, dh=False, planes=None, **tuning):
+    return _standin_interpolate(core, clip, field, None if dh else planes, lambda p, f: _standin_field(core, p, f, dh))
+
+
+def _standin_nnedi3cl(core, clip, field, dh=False, dw=False, planes=None, **tuning):
+    def process(p, f):
+        p = _standin_field(core, p, f, dh)
+        if dw:
+            p = core.std.Transpose(clip=p)
+            p = _standin_field(core, p, f, True)
+            p = core.std.Transpose(clip=p)
+        return p
+
+    return _standin_interpolate(core, clip, field, None if dh or dw else planes, process)
+
+
+def _standin_eedi3(core, clip, field, dh=False, planes=None, sclip=None, mclip=None, **tuning):
+    aa = _standin_interpolate(core, clip, field, None if dh else planes, lambda p, f: _standin_field(core, p, f, dh))
+
+    # eedi3 falls back on sclip where its own interpolation fails. Blending it in keeps
+    # the sclip in the graph, and fails just like eedi3 if its format or size is wrong.
+    # The mclip only decides where eedi3 does the expensive work, so it's ignored.
+    if sclip is not None:
+        aa = core.std.Merge(clipa=aa, clipb=sclip)
+
+    return aa
+
+
+def _standin_eedi2(core, clip, field, planes=None, **tuning):
+    # The input is always a single field. With field 2 or 3 the input frames are
+    # alternating fields, starting with the bottom or the top field respectively.
+    def process(p, f):
+        return _standin_field(core, p, f, True)
+
+    if field > 1:
+        first = core.std.SelectEvery(clip=clip, cycle=2, offsets=0)
+        second = core.std.SelectEvery(clip=clip, cycle=2, offsets=1)
+        return core.std.Interleave(clips=[_standin_interpolate(core, first, field - 2, None, process),
+                                          _standin_interpolate(core, second, 3 - field, None, process)])
+
+    return _standin_interpolate(core, clip, field, None, process)
+
+
+def _standin_tcanny(core, clip, sigma=None, t_h=8.0, t_l=1.0, mode=0, op=1, planes=None, **tuning):
+    mask = core.std.Sobel(clip=clip, planes=planes)
+
+    # mode 0 returns a binary edge map, the others the gradient magnitude.
+    if mode == 0:
+        mask = core.std.Binarize(clip=mask, threshold=_standin_threshold(clip, t_h), planes=planes)
+
+    return mask
+
+
+def _standin_tedgemask(core, clip, threshold=8.0, type=2, link=2, scale=None, planes=None, **tuning):
+    mask = core.std.Sobel(clip=clip, planes=planes)
+
+    # A threshold of 0 returns the gradient magnitude instead of a binary mask.
+    if threshold > 0:
+        mask = core.std.Binarize(clip=mask, threshold=_standin_threshold(clip, threshold), planes=planes)
+
+    return mask
+
+
+_standin_functions = {
+    "sangnom": {"SangNom": _standin_sangnom},
+    "znedi3": {"nnedi3": _standin_nnedi3},
+    "nnedi3cl": {"NNEDI3CL": _standin_nnedi3cl},
+    "eedi3m": {"EEDI3": _standin_eedi3},
+    "eedi2": {"EEDI2": _standin_eedi2},
+    "tcanny": {"TCanny": _standin_tcanny},
+    "tedgemask": {"TEdgeMask": _standin_tedgemask},
+}
+
+
+class _StandinNamespace:
+    def __init__(self, core, name):
+        self._core = core
+        self._name = name
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        function = _standin_functions[self._name].get(name)
+        if function is None:
+            raise AttributeError("xaa: there is no stand-in for {}.{}.".format(self._name, name))
+        return functools.partial(function, self._core)
+
+
+# Wraps a core (vs.core or a tracing core) and replaces the plugin namespaces with stand-ins.
+class _StandinCore:
+    def __init__(self, core):
+        self._core = core
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        if name in _standin_functions:
+            return _StandinNamespace(self._core, name)
+        return getattr(self._core, name)
+
+
+
+##### Dry-run planning #####
+
+# One filter of a traced graph. megapixels is the number of pixels the filter
+# writes per output frame, counting only the planes it processes.
+XaaStage = collections.namedtuple("XaaStage", ["filter", "planes", "in_width", "in_height", "out_width", "out_height", "megapixels"])
+
+
+def _trace_nodes(value):
+    if isinstance(value, _TraceNode):
+        return [value]
+    elif isinstance(value, (list, tuple)):
+        return [node for v in value for node in _trace_nodes(v)]
+    elif isinstance(value, dict):
+        return [node for v in value.values() for node in _trace_nodes(v)]
+    elif isinstance(value, functools.partial):
+        # Callbacks for FrameEval and ModifyFrame carry the clips they can pick from this way.
+        return _trace_nodes(list(value.args)) + _trace_nodes(value.keywords)
+    else:
+        return []
+
+
+def _trace_plane_size(clip, plane):
+    if plane == 0:
+        return clip.width, clip.height
+    else:
+        return clip.width >> clip.format.subsampling_w, clip.height >> clip.format.subsampling_h
+
+
+class _TraceNode:
+    def __init__(self, tracer, format, width, height, num_frames, inputs=()):
+        self.format = format
+        self.width = width
+        self.height = height
+        self.num_frames = num_frames
+        self._tracer = tracer
+        self._inputs = inputs
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _TraceNamespace(self._tracer, name, self)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self._tracer.call("std", "Trim", [], dict(clip=self, first=key, length=1))
+        start, stop, step = key.indices(self.num_frames)
+        return self._tracer.call("std", "Trim", [], dict(clip=self, length=len(range(start, stop, step))))
+
+    def __add__(self, other):
+        return self._tracer.call("std", "Splice", [], dict(clips=[self, other]))
+
+    def __mul__(self, times):
+        return self._tracer.call("std", "Loop", [], dict(clip=self, times=times))
+
+
+class _TraceNamespace:
+    def __init__(self, tracer, name, bound=None):
+        self._tracer = tracer
+        self._name = name
+        self._bound = bound
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            if self._bound is not None:
+                args = (self._bound,) + args
+            return self._tracer.call(self._name, name, args, kwargs)
+
+        return call
+
+
+class _TraceCore:
+    def __init__(self, tracer):
+        self._tracer = tracer
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _TraceNamespace(self._tracer, name)
+
+    def query_video_format(self, *args, **kwargs):
+        return vs.core.query_video_format(*args, **kwargs)
+
+    def get_video_format(self, id):
+        return vs.core.get_video_format(id)
+
+
+class _Tracer:
+    def __init__(self):
+        self.calls = []
+
+    def format(self, format):
+        if isinstance(format, int):
+            return vs.core.get_video_format(format)
+        return format
+
+    def call(self, namespace, name, args, kwargs):
+        filter = namespace + "." + name
+        kwargs = dict(kwargs)
+
+        # Only the first argument is ever passed positionally.
+        if args:
+            if name in ["ShufflePlanes", "Interleave", "Splice", "StackHorizontal", "StackVertical"]:
+                kwargs["clips"] = args[0]
+            elif name in ["MakeDiff", "MergeDiff", "MaskedMerge", "Merge"]:
+                kwargs["clipa"] = args[0]
+            else:
+                kwargs["clip"] = args[0]
+
+        clips = kwargs.get("clips")
+        if isinstance(clips, _TraceNode):
+            clips = [clips]
+            kwargs["clips"] = clips
+
+        src = kwargs.get("clip", kwargs.get("clipa", clips[0] if clips else None))
+
+        if src is not None:
+            fmt, width, height, num_frames = src.format, src.width, src.height, src.num_frames
+        else:
+            fmt, width, height, num_frames = None, 0, 0, 1
+
+        if namespace == "resize":
+            width = kwargs.get("width", width)
+            height = kwargs.get("height", height)
+            if kwargs.get("format") is not None:
+                fmt = self.format(kwargs["format"])
+        elif filter == "std.BlankClip":
+            width = kwargs.get("width", width)
+            height = kwargs.get("height", height)
+            num_frames = kwargs.get("length", num_frames)
+            if kwargs.get("format") is not None:
+                fmt = self.format(kwargs["format"])
+        elif filter == "std.ShufflePlanes":
+            planes = kwargs["planes"]
+            if isinstance(planes, int):
+                planes = [planes]
+            if kwargs["colorfamily"] == vs.GRAY:
+                width, height = _trace_plane_size(clips[0], planes[0])
+                fmt = vs.core.query_video_format(vs.GRAY, clips[0].format.sample_type, clips[0].format.bits_per_sample, 0, 0)
+            else:
+                clips = clips + [clips[-1]] * (3 - len(clips))
+                width, height = _trace_plane_size(clips[0], planes[0])
+                width_c, height_c = _trace_plane_size(clips[1], planes[1])
+                fmt = vs.core.query_video_format(kwargs["colorfamily"], clips[0].format.sample_type, clips[0].format.bits_per_sample,
+                                                 (width // width_c).bit_length() - 1, (height // height_c).bit_length() - 1)
+        elif filter == "std.Transpose":
+            width, height = height, width
+        elif filter == "std.Crop":
+            width -= kwargs.get("left", 0) + kwargs.get("right", 0)
+            height -= kwargs.get("top", 0) + kwargs.get("bottom", 0)
+        elif filter == "std.CropAbs":
+            width = kwargs["width"]
+            height = kwargs["height"]
+        elif filter == "std.AddBorders":
+            width += kwargs.get("left", 0) + kwargs.get("right", 0)
+            height += kwargs.get("top", 0) + kwargs.get("bottom", 0)
+        elif filter == "std.StackHorizontal":
+            width = sum(c.width for c in clips)
+        elif filter == "std.StackVertical":
+            height = sum(c.height for c in clips)
+        elif filter == "std.SeparateFields":
+            height //= 2
+            num_frames *= 2
+        elif filter == "std.DoubleWeave":
+            height *= 2
+        elif filter == "std.SelectEvery":
+            offsets = kwargs["offsets"]
+            if isinstance(offsets, int):
+                offsets = [offsets]
+            num_frames = num_frames * len(offsets) // kwargs["cycle"]
+        elif filter == "std.Interleave":
+            num_frames = max(c.num_frames for c in clips) * len(clips)
+        elif filter == "std.Splice":
+            num_frames = sum(c.num_frames for c in clips)
+        elif filter == "std.Loop":
+            num_frames *= kwargs.get("times", 0) or 1
+        elif filter == "std.Trim":
+            num_frames = kwargs.get("length", num_frames)
+        elif filter in ["znedi3.nnedi3", "nnedi3cl.NNEDI3CL", "eedi3m.EEDI3"]:
+            if kwargs.get("dh"):
+                height *= 2
+            if kwargs.get("dw"):
+                width *= 2
+            if kwargs.get("field", 0) > 1:
+                num_frames *= 2
+        elif filter == "eedi2.EEDI2":
+            height *= 2
+
+        node = _TraceNode(self, fmt, width, height, num_frames, tuple(_trace_nodes(kwargs)))
+        self.calls.append((filter, node, src, kwargs))
+        return node
+
+    def stages(self, output):
+        # Only count the filters the output actually depends on.
+        reachable = set()
+        pending = [output]
+        while pending:
+            node = pending.pop()
+            if id(node) in reachable:
+                continue
+            reachable.add(id(node))
+            pending.extend(node._inputs)
+
+        stages = []
+        for filter, node, src, kwargs in self.calls:
+            if id(node) not in reachable:
+                continue
+
+            num_planes = node.format.num_planes
+            planes = kwargs.get("planes")
+            if filter == "std.ShufflePlanes" or planes is None:
+                planes = list(range(num_planes))
+            elif isinstance(planes, int):
+                planes = [planes]
+            planes = [p for p in planes if 0 <= p < num_planes]
+
+            pixels = sum(w * h for w, h in [_trace_plane_size(node, p) for p in planes])
+            megapixels = pixels * node.num_frames / output.num_frames / 1000000.0
+
+            if src is None:
+                in_width, in_height = None, None
+            else:
+                in_width, in_height = src.width, src.height
+
+            stages.append(XaaStage(filter=filter, planes=len(planes), in_width=in_width, in_height=in_height,
+                                   out_width=node.width, out_height=node.height, megapixels=megapixels))
+
+        return stages
+
+
+# Walks the decision logic of xaa() (or another function of this module, such as edi_rpow2)
+# for a clip of the given format and dimensions, and returns the filters it would create.
+# No plugins are needed.
+def xaa_dryrun(format, width, height, num_frames=1, function=None, **params):
+    if function is None:
+        function = xaa
+
+    if isinstance(format, int):
+        format = vs.core.get_video_format(format)
+
+    tracer = _Tracer()
+    source = _TraceNode(tracer, format, width, height, num_frames)
+
+    previous = getattr(_local, "core", None)
+    _local.core = _TraceCore(tracer)
+    try:
+        output = function(source, **params)
+    finally:
+        _local.core = previous
+
+    return tracer.stages(output)
+
+
+
+##### Profiling #####
+
+def _profile_request(profiler, name, clip, n):
+    profiler._start(name, n)
+    return clip
+
+
+def _profile_deliver(profiler, name, n, f):
+    profiler._stop(name, n)
+    return f
+
+
+# Collects per-stage timings from the clips xaa() builds while it's active, either
+# as a context manager ("with XaaProfiler() as profiler:") or through xaa(profile=profiler).
+# A stage's time runs from the request of a frame to its delivery, so it includes
+# the time spent in the stages it depends on.
+class XaaProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._stages = collections.OrderedDict()
+        self._previous = []
+
+    def __enter__(self):
+        self._previous.append(getattr(_local, "profiler", None))
+        _local.profiler = self
+        return self
+
+    def __exit__(self, *exc):
+        _local.profiler = self._previous.pop()
+        return False
+
+    def probe(self, clip, name):
+        core = _get_core()
+
+        with self._lock:
+            self._stages.setdefault(name, [0, 0.0])
+
+        requested = core.std.FrameEval(clip=clip, eval=functools.partial(_profile_request, self, name, clip))
+        return core.std.ModifyFrame(clip=requested, clips=requested, selector=functools.partial(_profile_deliver, self, name))
+
+    def _start(self, name, n):
+        now = time.perf_counter()
+        with self._lock:
+            self._pending.setdefault((name, n), []).append(now)
+
+    def _stop(self, name, n):
+        now = time.perf_counter()
+        with self._lock:
+            starts = self._pending.get((name, n))
+            if not starts:
+                return
+            start = starts.pop(0)
+            if not starts:
+                del self._pending[(name, n)]
+            stage = self._stages[name]
+            stage[0] += 1
+            stage[1] += now - start
+
+    def reset(self):
+        with self._lock:
+            self._pending.clear()
+            for stage in self._stages.values():
+                stage[0] = 0
+                stage[1] = 0.0
+
+    def report(self):
+        with self._lock:
+            stages = [(name, frames, seconds) for name, (frames, seconds) in self._stages.items()]
+
+        return [dict(stage=name,
+                     frames=frames,
+                     seconds=seconds,
+                     ms_per_frame=seconds * 1000.0 / frames if frames else 0.0) for name, frames, seconds in stages]
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.report(), **kwargs)
+
+
+
+##### Stage cache #####
+
+# The plan fields that each of xaa's stages depends on, including through the stages before it.
+_stage_common = ["format_id", "width", "height", "chroma", "planes", "cplace", "chromaloc", "eediA", "eediB", "eediG", "rs_sclip",
+                 "uscl", "eedimthr", "mtype", "temtype", "mshare"]
+_stage_rs1 = _stage_common + ["ssw", "ssh", "rs1_type", "rs1_isedi", "rs1_rfacX", "rs1_rfacY", "rs1_cshift", "delay_cshift"]
+_stage_rs2 = _stage_common + ["ow", "oh", "rs2_type", "rs2_isedi", "rs2_rfacX", "rs2_rfacY", "rs2_cshift"]
+_stage_emask = _stage_rs2 + ["mthr"]
+_stage_aa = _stage_rs1 + ["dscl", "nns", "aa_mode", "aa_h", "aa_v", "aa_pass", "aa_type", "aa_sclip", "aa_delayresize_h", "aa_delayresize_v",
+                          "adaptive_passes", "rs1_addpad", "rs1_padL", "rs1_padR", "rs1_padT", "rs1_padB"]
+_stage_csharp = _stage_aa + ["csharp", "cstr"]
+_stage_rsaa = _stage_csharp + _stage_rs2 + ["aa_ow", "aa_oh", "aa_shift", "rsaa_type", "rsaa_isedi", "rsaa_rfacX", "rsaa_rfacY", "rsaa_cshift", "rsaa_shift"]
+
+# The roi tiles are chosen with the final edge mask, and how far around them it looks depends on rsaa and csharp.
+_stage_roi = _stage_emask + ["roi", "roi_margin", "roi_slots", "rsaa_isedi", "csharp"]
+
+_stage_fields = dict(rs1=_stage_rs1, rs2=_stage_rs2, emask=_stage_emask, aa=_stage_aa, csharp=_stage_rsaa, rsaa=_stage_rsaa)
+
+
+def _stage_key(plan, name):
+    fields = _stage_fields[name]
+
+    # csharp=1 sharpens aa, before rsaa.
+    if name == "csharp" and plan.csharp == 1:
+        fields = _stage_csharp
+
+    if plan.roi and name in ["aa", "csharp", "rsaa"]:
+        fields = fields + _stage_roi
+
+    # With mshare, the edge mask can be resampled from the mask of rs1 made for eedi3's mclip.
+    if name == "emask" and plan.mshare and plan.eedimthr > 0 and plan.eedimthr == plan.mthr:
+        fields = fields + _stage_rs1
+
+    return (name,) + tuple((field, getattr(plan, field)) for field in dict.fromkeys(fields))
+
+
+# FrameEval callback for XaaStageCache. A frame that is in the cache is returned by hit, a ModifyFrame
+# on a blank clip, so nothing of the stage it replaces is requested. The others come from store.
+def _stage_cache_select(n, cache, key, pins, hit, store):
+    frame = cache._get(key, n)
+    if frame is not None:
+        pins.put(n, frame)
+        return hit
+
+    return store
+
+
+def _stage_cache_hit(pins, n, f):
+    return pins.take(n)
+
+
+def _stage_cache_store(cache, key, n, f):
+    cache._put(key, n, f)
+    return f
+
+
+# Keeps the frames of xaa's intermediate stages (rs1, aa, csharp, rsaa, rs2, and emask) in memory
+# when it's passed as xaa(stage_cache=...), so that calls whose settings only differ further down
+# reuse them instead of computing them again. A stage is identified by the input clip and the
+# parameters it depends on. When the frames take more than max_bytes, the least recently used
+# ones are dropped.
+class XaaStageCache:
+    def __init__(self, max_bytes=1 << 30):
+        if max_bytes <= 0:
+            raise ValueError("XaaStageCache: 'max_bytes' must be greater than 0.")
+
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._frames = collections.OrderedDict()
+        self._sources = []
+        self._bytes = 0
+
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+
+    def _source_index(self, source):
+        with self._lock:
+            for i, known in enumerate(self._sources):
+                if known is source:
+                    return i
+
+            # Holding on to the clip keeps its id from being reused by another one.
+            self._sources.append(source)
+            return len(self._sources) - 1
+
+    def wrap(self, source, clip, name, plan):
+        core = _get_core()
+
+        key = (self._source_index(source), _get_backend()) + _stage_key(plan, name)
+        pins = _FramePins()
+        blank = core.std.BlankClip(clip=clip, keep=True)
+        hit = core.std.ModifyFrame(clip=blank, clips=blank, selector=functools.partial(_stage_cache_hit, pins))
+        store = core.std.ModifyFrame(clip=clip, clips=clip, selector=functools.partial(_stage_cache_store, self, key))
+
+        return core.std.FrameEval(clip=clip, eval=functools.partial(_stage_cache_select, cache=self, key=key, pins=pins, hit=hit, store=store))
+
+    def _get(self, key, n):
+        with self._lock:
+            entry = self._frames.get((key, n))
+            if entry is None:
+                self.misses[key[2]] += 1
+                return None
+
+            self._frames.move_to_end((key, n))
+            self.hits[key[2]] += 1
+            return entry[0]
+
+    def _put(self, key, n, frame):
+        size = sum(memoryview(frame[plane]).nbytes for plane in range(frame.format.num_planes))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if (key, n) in self._frames:
+                return
+
+            self._frames[(key, n)] = (frame, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                old_key, (old_frame, old_size) = self._frames.popitem(last=False)
+                self._bytes -= old_size
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._sources = []
+            self._bytes = 0
+
+    def report(self):
+        with self._lock:
+            hits = sum(self.hits.values())
+            misses = sum(self.misses.values())
+            return dict(hits=hits,
+                        misses=misses,
+                        hit_rate=hits / (hits + misses) if hits + misses else 0.0,
+                        stages={name: dict(hits=self.hits[name], misses=self.misses[name]) for name in sorted(set(self.hits) | set(self.misses))},
+                        frames=len(self._frames),
+                        bytes=self._bytes)
+
+
+
+##### Sweeps #####
+
+# While xaa_sweep builds its variants, hands every stage of xaa the clip that an earlier variant
+# built for the same input and the same parameters, if there is one. The clips the variants
+# built themselves are then left out of the graph.
+class _SweepStages:
+    def __init__(self):
+        self.clips = {}
+        self.built = collections.Counter()
+        self.shared = collections.Counter()
+
+    def share(self, source, clip, name, plan):
+        key = (id(source), _get_backend()) + _stage_key(plan, name)
+
+        shared = self.clips.get(key)
+        if shared is not None:
+            self.shared[name] += 1
+            return shared
+
+        self.clips[key] = clip
+        self.built[name] += 1
+        return clip
+
+
+# Builds xaa(clip, **params) for every combination of the settings in grid, a dict of parameter
+# names and lists of values, with the stages the variants have in common built only once.
+# Returns a list of (settings, clip) pairs, in the order of the grid, and a report of the stages
+# that were shared.
+def xaa_sweep(clip, grid, **params):
+    if not isinstance(grid, dict) or not grid:
+        raise ValueError("xaa_sweep: 'grid' must be a dict of parameter names and lists of values.")
+
+    for name, values in grid.items():
+        if name in params:
+            raise ValueError("xaa_sweep: '{}' is both in 'grid' and a parameter.".format(name))
+        if not isinstance(values, (list, tuple)) or not values:
+            raise ValueError("xaa_sweep: the values of '{}' must be a non-empty list.".format(name))
+
+    names = list(grid)
+    stages = _SweepStages()
+
+    previous = getattr(_local, "sweep", None)
+    _local.sweep = stages
+    try:
+        clips = []
+        for values in itertools.product(*[grid[name] for name in names]):
+            settings = dict(zip(names, values))
+            clips.append((settings, xaa(clip, **dict(params, **settings))))
+    finally:
+        _local.sweep = previous
+
+    report = dict(variants=len(clips),
+                  built=sum(stages.built.values()),
+                  shared=sum(stages.shared.values()),
+                  stages={name: dict(built=stages.built[name], shared=stages.shared[name]) for name in sorted(set(stages.built) | set(stages.shared))})
+
+    return clips, report
+
+
+
+##### Counters #####
+
+# Counts what xaa(dedupe=...) did with the frames it was asked for, and how many transposes were
+# left out of the graphs built with it. Pass one through xaa(counters=...) and read it after rendering.
+# A frame requested twice, e.g. after it fell out of the cache, counts twice.
+class XaaCounters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.reused = 0
+        self.distances = collections.Counter()
+        self.transposes_removed = 0
+
+    def _add_transposes(self, removed):
+        with self._lock:
+            self.transposes_removed += removed
+
+    def _count(self, distance):
+        with self._lock:
+            self.frames += 1
+            if distance:
+                self.reused += 1
+                self.distances[distance] += 1
+
+    @property
+    def reuse_rate(self):
+        with self._lock:
+            return self.reused / self.frames if self.frames else 0.0
+
+    def reset(self):
+        with self._lock:
+            self.frames = 0
+            self.reused = 0
+            self.distances.clear()
+            self.transposes_removed = 0
+
+    def report(self):
+        with self._lock:
+            return dict(frames=self.frames,
+                        reused=self.reused,
+                        reuse_rate=self.reused / self.frames if self.frames else 0.0,
+                        distances=dict(sorted(self.distances.items())),
+                        transposes_removed=self.transposes_removed)
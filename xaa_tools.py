@@ -0,0 +1,921 @@
+import asyncio
+import collections
+import ctypes
+import functools
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import runpy
+import shutil
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import vapoursynth as vs
+
+from xaa import _FramePins, _get_core, _is_clip
+
+
+# Each worker process of xaa_render and xaa_job keeps the clip of its script here.
+_local = threading.local()
+
+
+##### Frames #####
+
+# The number of bytes a frame of clip takes in a raw stream.
+def _frame_size(clip):
+    fmt = clip.format
+    size = clip.width * clip.height
+    if fmt.num_planes > 1:
+        size += 2 * (clip.width >> fmt.subsampling_w) * (clip.height >> fmt.subsampling_h)
+    return size * fmt.bytes_per_sample
+
+
+# The pixels of frame as byte buffers, plane by plane, in the order of a raw stream. The planes are
+# used in place unless their lines are padded, which the usual widths aren't.
+def _frame_buffers(frame):
+    buffers = []
+    for plane in range(frame.format.num_planes):
+        view = memoryview(frame[plane])
+        if view.c_contiguous:
+            buffers.append(view.cast("B"))
+        else:
+            buffers.append(memoryview(view.tobytes()))
+    return buffers
+
+
+
+##### Disk cache #####
+
+def _frame_hash(frame):
+    digest = hashlib.blake2b(digest_size=16)
+    for buffer in _frame_buffers(frame):
+        digest.update(buffer)
+    return digest.hexdigest()
+
+
+# Copies the raw planes in data into the writable frame.
+def _fill_frame(frame, data):
+    position = 0
+    for plane in range(frame.format.num_planes):
+        view = memoryview(frame[plane])
+        if view.c_contiguous:
+            view.cast("B")[:] = data[position:position + view.nbytes]
+        else:
+            row = view.shape[1] * view.itemsize
+            pointer = ctypes.cast(frame.get_write_ptr(plane), ctypes.c_void_p).value
+            for y in range(view.shape[0]):
+                ctypes.memmove(pointer + y * frame.get_stride(plane), data[position + y * row:position + (y + 1) * row], row)
+        position += view.nbytes
+
+
+# The frame properties of frame that aren't the same in source, and the names of the ones frame
+# doesn't have, as JSON. Properties that hold frames, clips, or functions are left out.
+def _dump_props(frame, source):
+    changed = []
+    for name, value in frame.props.items():
+        if name in source.props and source.props[name] == value:
+            continue
+
+        values = value if isinstance(value, list) else [value]
+        if all(isinstance(v, (int, float, str)) for v in values):
+            changed.append([name, "v", value])
+        elif all(isinstance(v, bytes) for v in values):
+            changed.append([name, "b", [v.hex() for v in values] if isinstance(value, list) else value.hex()])
+
+    deleted = [name for name in source.props.keys() if name not in frame.props]
+    return json.dumps([changed, deleted])
+
+
+# Applies the properties saved by _dump_props to frame, which has the properties of the source frame.
+def _load_props(frame, props):
+    changed, deleted = json.loads(props)
+    for name in deleted:
+        del frame.props[name]
+
+    for name, kind, value in changed:
+        if kind == "b":
+            value = [bytes.fromhex(v) for v in value] if isinstance(value, list) else bytes.fromhex(value)
+        frame.props[name] = value
+
+
+# FrameEval callback for XaaDiskCache. f is the source frame. A frame that is in the cache comes from
+# load, a ModifyFrame on a blank clip, so nothing of the clip it replaces is requested. Its pixels are
+# read here, so a chunk that is evicted later doesn't matter, and a frame that is gone by now is made
+# again by save. Either gets what it needs from pins.
+def _disk_cache_select(n, f, cache, variant, frame_size, pins, load, save):
+    key = _frame_hash(f)
+    entry = cache._lookup(variant, key, frame_size)
+
+    if entry is not None:
+        pins.put(n, entry)
+        return load
+
+    pins.put(n, key)
+    return save
+
+
+def _disk_cache_load(pins, n, f):
+    data, props = pins.take(n)
+
+    fout = f[0].copy()
+    _fill_frame(fout, data)
+
+    for name, value in f[1].props.items():
+        fout.props[name] = value
+    _load_props(fout, props)
+    fout.props["XaaCached"] = 1
+    return fout
+
+
+def _disk_cache_save(cache, variant, frame_size, pins, n, f):
+    cache._store(variant, pins.take(n), frame_size, _frame_buffers(f[0]), _dump_props(f[0], f[1]))
+
+    fout = f[0].copy()
+    fout.props["XaaCached"] = 0
+    return fout
+
+
+# Keeps the frames made by xaa(disk_cache=...) on disk, keyed by a hash of the input frame and the
+# resolved parameters, so that running the same settings on the same source again only reads them.
+# The frames are kept in chunk files of chunk_frames frames that are memory mapped, with an SQLite
+# index. When the chunks take more than max_size MB, the least recently used ones are deleted.
+class XaaDiskCache:
+    def __init__(self, path, max_size=10240, chunk_frames=64):
+        if max_size <= 0:
+            raise ValueError("XaaDiskCache: 'max_size' must be greater than 0.")
+
+        if not isinstance(chunk_frames, int) or chunk_frames < 1:
+            raise ValueError("XaaDiskCache: 'chunk_frames' must be a positive integer.")
+
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.max_size = max_size
+        self.chunk_frames = chunk_frames
+
+        self._lock = threading.Lock()
+        self._maps = {}
+
+        self._db = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, variant TEXT, frame_size INTEGER, slots INTEGER, used INTEGER, last_used REAL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS frames (variant TEXT, key TEXT, chunk INTEGER, slot INTEGER, props TEXT, PRIMARY KEY (variant, key))")
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    # Serves the frames of clip, which is made from source, from the cache where it can. key has to
+    # tell apart everything other than source that clip depends on.
+    def wrap(self, source, clip, key):
+        core = _get_core()
+
+        if clip.width == 0 or clip.height == 0 or clip.format is None:
+            raise ValueError("XaaDiskCache: the clip must have constant format and dimensions.")
+
+        variant = hashlib.blake2b(repr((key, clip.format.name, clip.width, clip.height)).encode("utf-8"), digest_size=16).hexdigest()
+        frame_size = _frame_size(clip)
+
+        pins = _FramePins()
+        blank = core.std.BlankClip(clip=clip, keep=True)
+        load = core.std.ModifyFrame(clip=blank, clips=[blank, source], selector=functools.partial(_disk_cache_load, pins))
+        save = core.std.ModifyFrame(clip=clip, clips=[clip, source], selector=functools.partial(_disk_cache_save, self, variant, frame_size, pins))
+
+        return core.std.FrameEval(clip=clip,
+                                  eval=functools.partial(_disk_cache_select, cache=self, variant=variant, frame_size=frame_size, pins=pins, load=load, save=save),
+                                  prop_src=source)
+
+    def _chunk_path(self, chunk):
+        return os.path.join(self.path, "{:08d}.chunk".format(chunk))
+
+    def _map(self, chunk, size):
+        mapped = self._maps.get(chunk)
+        if mapped is None:
+            with open(self._chunk_path(chunk), "r+b") as f:
+                mapped = mmap.mmap(f.fileno(), size)
+            self._maps[chunk] = mapped
+        return mapped
+
+    # Returns a copy of the pixels and the properties of a frame, or None if it isn't in the cache.
+    # Chunks are only evicted with the lock held, so the frame can't go away while it's copied.
+    def _lookup(self, variant, key, frame_size):
+        with self._lock:
+            entry = self._db.execute("SELECT frames.chunk, frames.slot, frames.props, chunks.slots FROM frames JOIN chunks ON chunks.id = frames.chunk "
+                                     "WHERE frames.variant = ? AND frames.key = ?", (variant, key)).fetchone()
+            if entry is None:
+                self.misses += 1
+                return None
+
+            chunk, slot, props, slots = entry
+            try:
+                mapped = self._map(chunk, slots * frame_size)
+            except (OSError, ValueError):
+                # Another process sharing the cache deleted the chunk, so its frames are stored again.
+                self._db.execute("DELETE FROM frames WHERE chunk = ?", (chunk,))
+                self._db.execute("DELETE FROM chunks WHERE id = ?", (chunk,))
+                self.misses += 1
+                return None
+            data = mapped[slot * frame_size:(slot + 1) * frame_size]
+
+            self.hits += 1
+            self._db.execute("UPDATE chunks SET last_used = ? WHERE id = ?", (time.time(), chunk))
+            return data, props
+
+    def _store(self, variant, key, frame_size, buffers, props):
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM frames WHERE variant = ? AND key = ?", (variant, key)).fetchone() is not None:
+                return
+
+            row = self._db.execute("SELECT id, used, slots FROM chunks WHERE variant = ? AND used < slots ORDER BY id DESC LIMIT 1", (variant,)).fetchone()
+            if row is None:
+                slots = self.chunk_frames
+                chunk = self._db.execute("INSERT INTO chunks (variant, frame_size, slots, used, last_used) VALUES (?, ?, ?, 0, ?)",
+                                         (variant, frame_size, slots, time.time())).lastrowid
+                with open(self._chunk_path(chunk), "wb") as f:
+                    f.truncate(slots * frame_size)
+                slot = 0
+            else:
+                chunk, slot, slots = row
+
+            mapped = self._map(chunk, slots * frame_size)
+            position = slot * frame_size
+            for buffer in buffers:
+                mapped[position:position + buffer.nbytes] = buffer
+                position += buffer.nbytes
+
+            self._db.execute("INSERT INTO frames (variant, key, chunk, slot, props) VALUES (?, ?, ?, ?, ?)", (variant, key, chunk, slot, props))
+            self._db.execute("UPDATE chunks SET used = used + 1, last_used = ? WHERE id = ?", (time.time(), chunk))
+
+            self._evict()
+
+    # Deletes the least recently used chunks until the rest fit in max_size.
+    def _evict(self):
+        size = self._db.execute("SELECT COALESCE(SUM(frame_size * slots), 0) FROM chunks").fetchone()[0]
+
+        while size > self.max_size * 1024 * 1024:
+            chunk, chunk_size = self._db.execute("SELECT id, frame_size * slots FROM chunks ORDER BY last_used LIMIT 1").fetchone()
+
+            self._db.execute("DELETE FROM frames WHERE chunk = ?", (chunk,))
+            self._db.execute("DELETE FROM chunks WHERE id = ?", (chunk,))
+            mapped = self._maps.pop(chunk, None)
+            if mapped is not None:
+                mapped.close()
+            if os.path.exists(self._chunk_path(chunk)):
+                os.remove(self._chunk_path(chunk))
+
+            size -= chunk_size
+            self.evicted += 1
+
+    def size(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(frame_size * slots), 0) FROM chunks").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM frames")
+            for (chunk,) in self._db.execute("SELECT id FROM chunks").fetchall():
+                mapped = self._maps.pop(chunk, None)
+                if mapped is not None:
+                    mapped.close()
+                if os.path.exists(self._chunk_path(chunk)):
+                    os.remove(self._chunk_path(chunk))
+            self._db.execute("DELETE FROM chunks")
+
+    def close(self):
+        with self._lock:
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
+            self._db.close()
+
+    def report(self):
+        with self._lock:
+            frames = self._db.execute("SELECT COUNT(*) FROM frames").fetchone()[0]
+            size = self._db.execute("SELECT COALESCE(SUM(frame_size * slots), 0) FROM chunks").fetchone()[0]
+            lookups = self.hits + self.misses
+            return dict(hits=self.hits,
+                        misses=self.misses,
+                        hit_rate=self.hits / lookups if lookups else 0.0,
+                        evicted=self.evicted,
+                        frames=frames,
+                        size_mb=size / (1024.0 * 1024.0))
+
+
+
+##### Writing #####
+
+# The C tag of a Y4M header, e.g. C420p10. caller names the function errors are reported for.
+def _y4m_colorspace(format, caller):
+    if format.sample_type != vs.INTEGER:
+        raise ValueError("{}: Y4M only takes integer formats, not {}.".format(caller, format.name))
+
+    if format.color_family == vs.GRAY:
+        colorspace = "mono"
+        if format.bits_per_sample > 8:
+            colorspace += str(format.bits_per_sample)
+        return colorspace
+
+    subsamplings = {(1, 1): "420", (1, 0): "422", (0, 0): "444", (2, 0): "411"}
+    colorspace = subsamplings.get((format.subsampling_w, format.subsampling_h))
+    if format.color_family != vs.YUV or colorspace is None:
+        raise ValueError("{}: Y4M can't hold {}.".format(caller, format.name))
+
+    if format.bits_per_sample > 8:
+        colorspace += "p{}".format(format.bits_per_sample)
+    return colorspace
+
+
+def _y4m_header(clip, caller):
+    return "YUV4MPEG2 W{} H{} F{}:{} Ip A0:0 C{}\n".format(clip.width, clip.height, clip.fps.numerator, clip.fps.denominator,
+                                                          _y4m_colorspace(clip.format, caller)).encode("ascii")
+
+
+# Writes buffers to the file descriptor fd in as few system calls as possible. A pipe can take
+# less than everything at once, so the rest is written again.
+def _writev(fd, buffers):
+    pending = [buffer for buffer in buffers if buffer.nbytes]
+    while pending:
+        written = os.writev(fd, pending[:1024])
+        while written:
+            if written >= pending[0].nbytes:
+                written -= pending.pop(0).nbytes
+            else:
+                pending[0] = pending[0][written:]
+                written = 0
+
+
+# Writes clip to output (a file name, "-" for stdout, or a binary file object) as Y4M, or as raw frames
+# if y4m is False. prefetch frames are requested ahead of the one being written so that the core always
+# has work queued, and every frame is written straight from its planes in one call. With use_mmap the
+# output file is memory mapped and the frames are copied into it. Returns the throughput and how far
+# ahead of the writer the core was.
+def xaa_write(clip, output, prefetch=None, y4m=True, use_mmap=False):
+    core = _get_core()
+
+    if prefetch is None:
+        prefetch = max(2, core.num_threads)
+
+    if not isinstance(prefetch, int) or prefetch < 1:
+        raise ValueError("xaa_write: 'prefetch' must be a positive integer.")
+
+    if clip.width == 0 or clip.height == 0 or clip.format is None:
+        raise ValueError("xaa_write: 'clip' must have constant format and dimensions.")
+
+    if use_mmap and (not isinstance(output, str) or output == "-"):
+        raise ValueError("xaa_write: 'use_mmap' needs the name of a file to write.")
+
+    header = _y4m_header(clip, "xaa_write") if y4m else b""
+    frame_header = b"FRAME\n" if y4m else b""
+    frame_size = _frame_size(clip)
+    total_bytes = len(header) + clip.num_frames * (len(frame_header) + frame_size)
+
+    own_file = isinstance(output, str) and output != "-"
+    if output == "-":
+        out = sys.stdout.buffer
+    elif own_file:
+        out = open(output, "w+b" if use_mmap else "wb")
+    else:
+        out = output
+
+    mapped = None
+    position = 0
+    fd = None
+
+    if use_mmap:
+        out.truncate(total_bytes)
+        if total_bytes:
+            mapped = mmap.mmap(out.fileno(), total_bytes)
+    else:
+        # Whatever the file object holds has to go out before anything is written to its descriptor.
+        out.flush()
+        try:
+            if hasattr(os, "writev"):
+                fd = out.fileno()
+        except (AttributeError, OSError, ValueError):
+            fd = None
+
+    def Write(buffers):
+        nonlocal position
+
+        if mapped is not None:
+            for buffer in buffers:
+                mapped[position:position + buffer.nbytes] = buffer
+                position += buffer.nbytes
+        elif fd is not None:
+            _writev(fd, buffers)
+        else:
+            for buffer in buffers:
+                out.write(buffer)
+
+    stalls = 0
+    wait_seconds = 0.0
+    ready_total = 0
+    ready_max = 0
+
+    begin = time.perf_counter()
+    try:
+        Write([memoryview(header)])
+
+        futures = collections.deque()
+        next_request = 0
+        for n in range(clip.num_frames):
+            while next_request < clip.num_frames and next_request < n + prefetch:
+                futures.append(clip.get_frame_async(next_request))
+                next_request += 1
+
+            # How many of the requested frames were ready when the writer got to them.
+            ready = sum(1 for future in futures if future.done())
+            ready_total += ready
+            ready_max = max(ready_max, ready)
+
+            future = futures.popleft()
+            if not future.done():
+                stalls += 1
+                waited = time.perf_counter()
+                frame = future.result()
+                wait_seconds += time.perf_counter() - waited
+            else:
+                frame = future.result()
+
+            Write([memoryview(frame_header)] + _frame_buffers(frame))
+            del frame
+
+        if mapped is not None:
+            mapped.flush()
+        else:
+            out.flush()
+    finally:
+        if mapped is not None:
+            mapped.close()
+        if own_file:
+            out.close()
+
+    seconds = time.perf_counter() - begin
+
+    return dict(frames=clip.num_frames,
+                bytes=total_bytes,
+                seconds=seconds,
+                fps=clip.num_frames / seconds if seconds else 0.0,
+                mb_per_second=total_bytes / seconds / (1024 * 1024) if seconds else 0.0,
+                prefetch=prefetch,
+                stalls=stalls,
+                wait_seconds=wait_seconds,
+                ready_mean=ready_total / clip.num_frames if clip.num_frames else 0.0,
+                ready_max=ready_max)
+
+
+
+##### Rendering #####
+
+# Loads a VapourSynth script and returns the clip it sets as the given output.
+def _load_script(script, index):
+    runpy.run_path(script, run_name="__vapoursynth__")
+
+    # get_output returns a tuple with the clip since API 4.
+    output = vs.get_output(index)
+    return getattr(output, "clip", output)
+
+
+# Appends the raw frames start to end - 1 in path to out, with Y4M frame headers if y4m.
+def _write_chunk(out, path, start, end, frame_size, y4m):
+    with open(path, "rb") as f:
+        if y4m:
+            for n in range(start, end):
+                out.write(b"FRAME\n")
+                out.write(f.read(frame_size))
+        else:
+            shutil.copyfileobj(f, out, 1 << 24)
+
+
+# Every worker process of xaa_render loads the script once, with its own core.
+def _render_worker_init(script, index, threads, cache_size):
+    core = vs.core
+    if threads:
+        core.num_threads = threads
+    if cache_size is not None:
+        core.max_cache_size = cache_size
+
+    _local.render_clip = _load_script(script, index)
+
+
+# Renders frames start to end - 1 of the worker's clip as a raw stream into path.
+def _render_chunk(chunk):
+    start, end, path = chunk
+    with open(path, "wb") as f:
+        _local.render_clip[start:end].output(f)
+    return chunk
+
+
+# Renders a VapourSynth script's output in chunks of frames, each in one of a pool of worker processes
+# with its own core and cache, and writes them to output in order.
+def xaa_render(script, output, index=0, chunk_size=250, workers=None, threads=None, cache_size=None, y4m=True, baseline=False):
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 1) // 4)
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        raise ValueError("xaa_render: 'chunk_size' must be a positive integer.")
+
+    if not isinstance(workers, int) or workers < 1:
+        raise ValueError("xaa_render: 'workers' must be a positive integer.")
+
+    if not isinstance(threads, int) or threads < 0:
+        raise ValueError("xaa_render: 'threads' must be 0 or a positive integer.")
+
+    # The script is loaded here too, for the header and the frame count. Nothing is rendered from it
+    # unless the single process baseline is wanted.
+    clip = _load_script(script, index)
+    if clip.width == 0 or clip.height == 0 or clip.format is None:
+        raise ValueError("xaa_render: the output must have constant format and dimensions.")
+
+    header = _y4m_header(clip, "xaa_render") if y4m else b""
+    frame_size = _frame_size(clip)
+    num_frames = clip.num_frames
+
+    report = dict(frames=num_frames, chunks=(num_frames + chunk_size - 1) // chunk_size, workers=workers, threads=threads,
+                  seconds=None, fps=None, baseline_seconds=None, baseline_fps=None, speedup=None)
+
+    if baseline:
+        begin = time.perf_counter()
+        with open(os.devnull, "wb") as f:
+            clip.output(f)
+        report["baseline_seconds"] = time.perf_counter() - begin
+        report["baseline_fps"] = num_frames / report["baseline_seconds"]
+
+    del clip
+
+    chunks_dir = tempfile.mkdtemp(prefix="xaa_render_")
+    chunks = [(start, min(start + chunk_size, num_frames), os.path.join(chunks_dir, "{:08d}.raw".format(start)))
+              for start in range(0, num_frames, chunk_size)]
+
+    if output == "-":
+        out = sys.stdout.buffer
+    else:
+        out = open(output, "wb")
+
+    begin = time.perf_counter()
+    try:
+        out.write(header)
+
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(workers, initializer=_render_worker_init, initargs=(script, index, threads, cache_size)) as pool:
+            # imap hands the chunks back in order, while the workers carry on with the ones after.
+            for start, end, path in pool.imap(_render_chunk, chunks):
+                _write_chunk(out, path, start, end, frame_size, y4m)
+                os.remove(path)
+
+        out.flush()
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        shutil.rmtree(chunks_dir, ignore_errors=True)
+
+    report["seconds"] = time.perf_counter() - begin
+    report["fps"] = num_frames / report["seconds"]
+    if report["baseline_fps"]:
+        report["speedup"] = report["fps"] / report["baseline_fps"]
+
+    return report
+
+
+
+##### Jobs #####
+
+# An exclusive lock on a file next to the manifest. lockf takes POSIX locks, which work over NFS,
+# so processes on several machines can share a manifest.
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        try:
+            import fcntl
+        except ImportError:
+            import msvcrt
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.lockf(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            import fcntl
+        except ImportError:
+            import msvcrt
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.lockf(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+        return False
+
+
+def _read_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# The manifest is replaced in one go, so a crash never leaves half of it behind.
+def _write_manifest(path, manifest):
+    temp = path + ".tmp"
+    with open(temp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp, path)
+
+
+def _file_checksum(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(functools.partial(f.read, 1 << 24), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _worker_name():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+# Whether a claimed segment's worker is gone: a process on this machine that no longer exists, or
+# any claim older than claim_timeout seconds.
+def _claim_abandoned(segment, claim_timeout):
+    if claim_timeout is not None and time.time() - segment["claimed"] > claim_timeout:
+        return True
+
+    host, pid = segment["worker"].rsplit(":", 1)
+    if host != socket.gethostname():
+        return False
+
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+# Marks the first segment nobody is working on as claimed by this process and returns it,
+# or None when there is nothing left to claim.
+def _claim_segment(manifest_path, claim_timeout):
+    with _FileLock(manifest_path + ".lock"):
+        manifest = _read_manifest(manifest_path)
+
+        for segment in manifest["segments"]:
+            if segment["status"] == "pending" or (segment["status"] == "claimed" and _claim_abandoned(segment, claim_timeout)):
+                segment.update(status="claimed", worker=_worker_name(), claimed=time.time())
+                _write_manifest(manifest_path, manifest)
+                return segment
+
+    return None
+
+
+# Moves a rendered segment into place and marks it done, but only if this process still holds its
+# claim. A worker whose claim was taken over, because it was thought abandoned, leaves the segment
+# to the one that took it. Returns whether the segment was finished.
+def _finish_segment(manifest_path, start, partial):
+    with _FileLock(manifest_path + ".lock"):
+        manifest = _read_manifest(manifest_path)
+
+        for segment in manifest["segments"]:
+            if segment["start"] == start:
+                break
+        else:
+            return False
+
+        if segment["status"] != "claimed" or segment["worker"] != _worker_name():
+            return False
+
+        segment.update(status="done", checksum=_file_checksum(partial), worker=_worker_name())
+        os.replace(partial, segment["path"])
+        _write_manifest(manifest_path, manifest)
+
+    return True
+
+
+# Claims and renders segments until there are none left. A segment is written under a temporary
+# name of its own first, so its file only exists once it is complete, and two workers that both
+# think they own a segment never write to the same file.
+def _job_worker(manifest_path, script, index, threads, cache_size, claim_timeout):
+    _render_worker_init(script, index, threads, cache_size)
+
+    while True:
+        segment = _claim_segment(manifest_path, claim_timeout)
+        if segment is None:
+            return
+
+        partial = "{}.{}.partial".format(segment["path"], _worker_name().replace(":", "-"))
+        _render_chunk((segment["start"], segment["end"], partial))
+
+        if not _finish_segment(manifest_path, segment["start"], partial):
+            os.remove(partial)
+
+
+# Renders a VapourSynth script's output as a job of frame range segments described by a manifest.
+# Every segment is checkpointed to its own file with a checksum, so a job that is started again skips
+# the finished segments. Several processes, on one or several machines sharing the files, can work
+# on the same job. Whoever finds all the segments done writes them to output.
+def xaa_job(script, output, manifest=None, index=0, segment_size=1000, workers=1, threads=None, cache_size=None, y4m=True, claim_timeout=None):
+    if manifest is None:
+        manifest = output + ".xaajob"
+    manifest = os.path.abspath(manifest)
+
+    if not isinstance(segment_size, int) or segment_size < 1:
+        raise ValueError("xaa_job: 'segment_size' must be a positive integer.")
+
+    if not isinstance(workers, int) or workers < 0:
+        raise ValueError("xaa_job: 'workers' must be 0 or a positive integer.")
+
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // max(1, workers))
+
+    # The script is loaded here only for the header and the frame count.
+    clip = _load_script(script, index)
+    if clip.width == 0 or clip.height == 0 or clip.format is None:
+        raise ValueError("xaa_job: the output must have constant format and dimensions.")
+
+    header = _y4m_header(clip, "xaa_job").decode("ascii") if y4m else ""
+    frame_size = _frame_size(clip)
+    num_frames = clip.num_frames
+    del clip
+
+    segments_dir = manifest + ".segments"
+    os.makedirs(segments_dir, exist_ok=True)
+
+    with _FileLock(manifest + ".lock"):
+        if os.path.exists(manifest):
+            job = _read_manifest(manifest)
+            if job["frames"] != num_frames or job["segment_size"] != segment_size or job["header"] != header or job["frame_size"] != frame_size:
+                raise ValueError("xaa_job: the manifest '{}' belongs to a different job.".format(manifest))
+        else:
+            job = dict(script=os.path.abspath(script), index=index, frames=num_frames, segment_size=segment_size,
+                       header=header, frame_size=frame_size, assembled=False,
+                       segments=[dict(start=start, end=min(start + segment_size, num_frames),
+                                      path=os.path.join(segments_dir, "{:08d}-{:08d}.raw".format(start, min(start + segment_size, num_frames))),
+                                      status="pending", checksum=None, worker=None, claimed=None)
+                                 for start in range(0, num_frames, segment_size)])
+            _write_manifest(manifest, job)
+
+    # A finished segment whose file went missing or changed since is rendered again.
+    redo = []
+    for segment in job["segments"]:
+        if segment["status"] == "done" and (not os.path.exists(segment["path"]) or _file_checksum(segment["path"]) != segment["checksum"]):
+            redo.append(segment["start"])
+
+    with _FileLock(manifest + ".lock"):
+        job = _read_manifest(manifest)
+        for segment in job["segments"]:
+            if segment["start"] in redo:
+                segment.update(status="pending", checksum=None, worker=None, claimed=None)
+                job["assembled"] = False
+        _write_manifest(manifest, job)
+
+    skipped = sum(1 for segment in job["segments"] if segment["status"] == "done")
+
+    begin = time.perf_counter()
+
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_job_worker, args=(manifest, script, index, threads, cache_size, claim_timeout)) for i in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    seconds = time.perf_counter() - begin
+
+    with _FileLock(manifest + ".lock"):
+        job = _read_manifest(manifest)
+        done = sum(1 for segment in job["segments"] if segment["status"] == "done")
+
+        if done == len(job["segments"]) and not job["assembled"]:
+            out = open(output, "wb")
+            try:
+                out.write(header.encode("ascii"))
+                for segment in job["segments"]:
+                    _write_chunk(out, segment["path"], segment["start"], segment["end"], frame_size, y4m)
+            finally:
+                out.close()
+
+            job["assembled"] = True
+            _write_manifest(manifest, job)
+
+    return dict(segments=len(job["segments"]),
+                done=done,
+                skipped=skipped,
+                redone=len(redo),
+                assembled=job["assembled"],
+                seconds=seconds,
+                failed_workers=sum(1 for process in processes if process.exitcode != 0))
+
+
+
+##### Asyncio #####
+
+# Serves the frames of a clip to asyncio code. A frame that is requested again while it is still
+# on its way shares the first request, and at most concurrency frames are requested from the core
+# at once. Use it from one event loop.
+class XaaAsyncClip:
+    def __init__(self, clip, concurrency=None):
+        if not _is_clip(clip):
+            raise ValueError("XaaAsyncClip: 'clip' must be a clip.")
+
+        if concurrency is None:
+            concurrency = max(1, _get_core().num_threads)
+
+        if not isinstance(concurrency, int) or concurrency < 1:
+            raise ValueError("XaaAsyncClip: 'concurrency' must be a positive integer.")
+
+        self.clip = clip
+        self.concurrency = concurrency
+        self._semaphore = None
+        self._inflight = {}
+        self.requests = 0
+        self.coalesced = 0
+        self.fetched = 0
+
+    async def _fetch(self, n):
+        async with self._semaphore:
+            self.fetched += 1
+            return await asyncio.wrap_future(self.clip.get_frame_async(n))
+
+    def _forget(self, n, task):
+        if self._inflight.get(n) is task:
+            del self._inflight[n]
+
+    async def get_frame(self, n):
+        if not 0 <= n < self.clip.num_frames:
+            raise IndexError("XaaAsyncClip: frame {} is out of range.".format(n))
+
+        # The semaphore is made here so that it belongs to the running loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        self.requests += 1
+
+        task = self._inflight.get(n)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(n))
+            self._inflight[n] = task
+            task.add_done_callback(functools.partial(self._forget, n))
+        else:
+            self.coalesced += 1
+
+        # A caller that gives up doesn't cancel the request for the others.
+        return await asyncio.shield(task)
+
+    # The planes of frame n as NumPy arrays that use the frame's memory, or only the given plane.
+    async def get_array(self, n, plane=None):
+        import numpy
+
+        frame = await self.get_frame(n)
+        if plane is not None:
+            return numpy.asarray(frame[plane])
+        return [numpy.asarray(frame[p]) for p in range(frame.format.num_planes)]
+
+    def report(self):
+        return dict(requests=self.requests,
+                    coalesced=self.coalesced,
+                    fetched=self.fetched,
+                    inflight=len(self._inflight))
+
+
+# A minimal HTTP server for testing frame services without anything else: "GET /frame/<n>" returns
+# the raw planes of frame n, with its dimensions and format in the headers.
+async def xaa_serve(clip, host="127.0.0.1", port=0, concurrency=None):
+    frames = clip if isinstance(clip, XaaAsyncClip) else XaaAsyncClip(clip, concurrency)
+
+    async def Handle(reader, writer):
+        try:
+            request = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()).strip():
+                pass
+
+            parts = request[1].strip("/").split("/") if len(request) >= 2 and request[0] == "GET" else []
+            if len(parts) == 2 and parts[0] == "frame" and parts[1].isdigit() and int(parts[1]) < frames.clip.num_frames:
+                frame = await frames.get_frame(int(parts[1]))
+                buffers = _frame_buffers(frame)
+                writer.write("HTTP/1.0 200 OK\r\n"
+                             "Content-Type: application/octet-stream\r\n"
+                             "Content-Length: {}\r\n"
+                             "X-Width: {}\r\n"
+                             "X-Height: {}\r\n"
+                             "X-Format: {}\r\n\r\n".format(sum(buffer.nbytes for buffer in buffers), frame.width, frame.height, frame.format.name).encode("latin-1"))
+                for buffer in buffers:
+                    writer.write(buffer)
+            else:
+                writer.write(b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(Handle, host, port)